@@ -0,0 +1,26 @@
+import argparse
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.checkin import init_db, get_session, backfill_checkin_summaries
+
+def main():
+    """根据签到历史重建签到汇总表"""
+    parser = argparse.ArgumentParser(description='重建user_checkin_summaries汇总表')
+    parser.add_argument(
+        '--db-url',
+        default='sqlite:///../db/telegram_bot.db',
+        help='数据库地址'
+    )
+    args = parser.parse_args()
+    
+    init_db(args.db_url, async_mode=False)
+    with get_session() as session:
+        count = backfill_checkin_summaries(session)
+    print(f"已重建 {count} 条签到汇总记录")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+import argparse
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.checkin import init_db, get_session
+from src.message_stats import backfill_message_rollups
+
+def main():
+    """根据原始消息记录重建小时/天汇总表"""
+    parser = argparse.ArgumentParser(description='重建message_rollups_hourly/daily汇总表')
+    parser.add_argument(
+        '--db-url',
+        default='sqlite:///../db/telegram_bot.db',
+        help='数据库地址'
+    )
+    args = parser.parse_args()
+    
+    init_db(args.db_url, async_mode=False)
+    with get_session() as session:
+        count = backfill_message_rollups(session)
+    print(f"已汇总 {count} 条消息记录")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import MagicMock
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.checkin import Base
+from src.message_stats import MessageStats, MessageRecord
+from src.utils.db import DatabaseManager
+from src.utils.redis_client import redis_manager
+
+def make_update(chat_id: int, user_id: int):
+    """构造最小的消息更新对象"""
+    update = MagicMock()
+    update.effective_user.id = user_id
+    update.effective_user.full_name = f"user{user_id}"
+    update.effective_user.username = None
+    update.effective_chat.id = chat_id
+    update.message.text = "hello"
+    return update
+
+async def run(args):
+    manager = DatabaseManager(args.db_url, async_mode=args.async_db)
+    Base.metadata.create_all(manager.engine)
+    session_factory = manager.get_async_session if args.async_db else manager.get_session
+
+    stats = MessageStats(
+        session_factory,
+        batch_size=args.batch_size,
+        flush_interval=args.flush_interval,
+        max_pending=args.max_pending
+    )
+    updates = [make_update(i % args.chats, i % args.users) for i in range(1000)]
+
+    with manager.engine.connect() as conn:
+        before = conn.execute(MessageRecord.__table__.select().with_only_columns(
+            MessageRecord.__table__.c.id
+        ).order_by(MessageRecord.__table__.c.id.desc()).limit(1)).scalar() or 0
+
+    await stats.start()
+    start = time.perf_counter()
+    for i in range(args.messages):
+        update = updates[i % len(updates)]
+        # 入库按(群组, 消息ID)去重，每条消息使用不同的ID
+        update.message.message_id = i + 1
+        await stats.record_message(update)
+    enqueued = time.perf_counter() - start
+    await stats.stop()
+    elapsed = time.perf_counter() - start
+
+    with manager.engine.connect() as conn:
+        stored = conn.execute(
+            MessageRecord.__table__.select().where(MessageRecord.__table__.c.id > before)
+            .with_only_columns(MessageRecord.__table__.c.id)
+        ).all()
+    await manager.dispose()
+    await redis_manager.close()
+
+    print(f"消息数:     {args.messages}")
+    print(f"入队耗时:   {enqueued:.2f}s ({args.messages / enqueued:,.0f} 条/秒)")
+    print(f"入库耗时:   {elapsed:.2f}s ({args.messages / elapsed:,.0f} 条/秒)")
+    print(f"已入库:     {len(stored)}")
+
+def main():
+    """消息统计写入链路吞吐量测试(内存缓冲 -> Redis队列 -> 数据库)"""
+    parser = argparse.ArgumentParser(description='MessageStats写入吞吐量测试')
+    parser.add_argument('--messages', type=int, default=50000, help='写入消息数')
+    parser.add_argument('--chats', type=int, default=100, help='群组数')
+    parser.add_argument('--users', type=int, default=1000, help='用户数')
+    parser.add_argument('--batch-size', type=int, default=500, help='批量大小')
+    parser.add_argument('--flush-interval', type=float, default=1.0, help='批量时间窗口(秒)')
+    parser.add_argument('--max-pending', type=int, default=10000, help='内存队列上限')
+    parser.add_argument('--db-url', default=None, help='数据库地址(默认临时SQLite文件)')
+    parser.add_argument('--async-db', action='store_true', help='使用异步数据库引擎')
+    args = parser.parse_args()
+
+    # 未配置Redis时使用本地替身
+    os.environ.setdefault('REDIS_URL', 'fakeredis://')
+    redis_manager.url = os.environ['REDIS_URL']
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.db_url is None:
+            args.db_url = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+        asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import h11
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from telegram import Bot
+from src.webhook import WebhookServer
+
+SECRET_TOKEN = 'bench-secret'
+
+def make_update(update_id: int, chats: int) -> bytes:
+    """构造合成的群消息更新"""
+    return json.dumps({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': -1000 - update_id % chats, 'type': 'supergroup'},
+            'from': {'id': update_id % 1000, 'is_bot': False, 'first_name': 'bench'},
+            'text': f'message {update_id}'
+        }
+    }).encode()
+
+async def post_loop(host: str, port: int, path: str, updates, args, latencies: list):
+    """单个keep-alive连接上顺序POST更新，收到503时稍后重试"""
+    reader, writer = await asyncio.open_connection(host, port)
+    conn = h11.Connection(h11.CLIENT)
+    try:
+        for update_id in updates:
+            body = make_update(update_id, args.chats)
+            while True:
+                start = time.perf_counter()
+                writer.write(conn.send(h11.Request(method='POST', target=path, headers=[
+                    ('Host', host),
+                    ('Content-Type', 'application/json'),
+                    ('Content-Length', str(len(body))),
+                    ('X-Telegram-Bot-Api-Secret-Token', SECRET_TOKEN)
+                ])))
+                writer.write(conn.send(h11.Data(data=body)))
+                writer.write(conn.send(h11.EndOfMessage()))
+                status = None
+                while True:
+                    event = conn.next_event()
+                    if event is h11.NEED_DATA:
+                        conn.receive_data(await reader.read(65536))
+                    elif isinstance(event, h11.Response):
+                        status = event.status_code
+                    elif isinstance(event, h11.EndOfMessage):
+                        break
+                latencies.append(time.perf_counter() - start)
+                conn.start_next_cycle()
+                if status != 503:
+                    break
+                await asyncio.sleep(args.retry_delay)
+    finally:
+        writer.close()
+
+async def fake_telegram(url: str, args) -> list:
+    """模拟Telegram: 以固定数量的并发连接推送更新(对应max_connections)"""
+    parts = urlsplit(url)
+    latencies = []
+    updates = iter(range(args.updates))
+    await asyncio.gather(*(
+        post_loop(parts.hostname, parts.port or 80, parts.path, updates, args, latencies)
+        for _ in range(args.connections)
+    ))
+    return latencies
+
+async def run(args):
+    queue = asyncio.Queue(maxsize=args.queue_size)
+    received = 0
+    done = asyncio.Event()
+
+    async def consumer():
+        # 模拟分发耗时
+        nonlocal received
+        while True:
+            await queue.get()
+            if args.handler_ms:
+                await asyncio.sleep(args.handler_ms / 1000)
+            received += 1
+            if received >= args.updates:
+                done.set()
+
+    url = args.url
+    server = None
+    if url is None:
+        server = WebhookServer(
+            Bot('123456:bench'),
+            queue,
+            listen='127.0.0.1',
+            port=0,
+            path='/webhook',
+            secret_token=SECRET_TOKEN
+        )
+        await server.start()
+        url = f"http://127.0.0.1:{server.bound_port}/webhook"
+        consumers = [asyncio.create_task(consumer()) for _ in range(args.consumers)]
+
+    start = time.perf_counter()
+    latencies = await fake_telegram(url, args)
+    if server is not None:
+        await done.wait()
+    elapsed = time.perf_counter() - start
+
+    if server is not None:
+        for task in consumers:
+            task.cancel()
+        await server.stop()
+
+    latencies.sort()
+    print(f"更新数:     {args.updates} (并发连接 {args.connections})")
+    print(f"总耗时:     {elapsed:.2f}s ({args.updates / elapsed:,.0f} 条/秒)")
+    print(f"请求数:     {len(latencies)} (含503重试 {len(latencies) - args.updates})")
+    print(f"延迟 p50:   {statistics.median(latencies) * 1000:.2f}ms")
+    print(f"延迟 p99:   {latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f}ms")
+
+def main():
+    """Webhook接入吞吐量与延迟测试"""
+    parser = argparse.ArgumentParser(description='Webhook接入基准测试')
+    parser.add_argument('--updates', type=int, default=20000, help='发送的更新数')
+    parser.add_argument('--connections', type=int, default=40, help='并发连接数(对应max_connections)')
+    parser.add_argument('--chats', type=int, default=100, help='群组数')
+    parser.add_argument('--queue-size', type=int, default=1000, help='更新队列容量')
+    parser.add_argument('--consumers', type=int, default=1, help='队列消费者数')
+    parser.add_argument('--handler-ms', type=float, default=0, help='每个更新的模拟处理耗时(毫秒)')
+    parser.add_argument('--retry-delay', type=float, default=0.1, help='收到503后的重试间隔(秒)')
+    parser.add_argument('--url', default=None, help='压测已部署的Webhook地址(不启动本地服务)')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
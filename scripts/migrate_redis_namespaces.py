@@ -0,0 +1,35 @@
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from redis.asyncio import Redis
+from src.utils.redis_client import LEGACY_DATABASES, migrate_legacy_keys, redis_manager
+
+async def migrate(source_url: str):
+    for db, (name, patterns) in LEGACY_DATABASES.items():
+        source = Redis.from_url(source_url, db=db)
+        try:
+            count = await migrate_legacy_keys(source, redis_manager.namespace(name), patterns)
+        finally:
+            await source.aclose()
+        print(f"db{db} -> {name}: 已迁移 {count} 个键")
+    await redis_manager.close()
+
+def main():
+    """把旧版本按库(db 1/2/3)划分的Redis数据复制到REDIS_URL的命名空间下"""
+    parser = argparse.ArgumentParser(description='迁移旧版本Redis库中的数据到命名空间键')
+    parser.add_argument(
+        '--source-url',
+        default=os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+        help='旧Redis地址(库号按模块自动选择)'
+    )
+    args = parser.parse_args()
+    asyncio.run(migrate(args.source_url))
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
 import logging
-from datetime import datetime
-from typing import Optional
-from sqlalchemy import create_engine, Column, Integer, String, Date
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Date, Index
+from sqlalchemy import select, literal, func, true, case, and_, delete, inspect
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from telegram import Update
@@ -13,26 +14,86 @@ Base = declarative_base()
 class UserCheckIn(Base):
     """用户签到记录表"""
     __tablename__ = 'user_checkins'
+    __table_args__ = (
+        # 每个用户在每个群每天只能有一条记录，同时支撑按(群, 用户, 日期)的查找
+        Index(
+            'uq_user_checkins_chat_user_date',
+            'chat_id', 'user_id', 'checkin_date',
+            unique=True
+        ),
+    )
     
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, nullable=False)
+    chat_id = Column(BigInteger, nullable=False, default=0, server_default='0')  # 0为历史数据
+    user_id = Column(BigInteger, nullable=False)
     username = Column(String)
     checkin_date = Column(Date, nullable=False)
     streak_days = Column(Integer, default=1)
-    total_points = Column(Integer, default=0)
+    total_points = Column(Integer, default=0)  # 当日获得积分
 
-from contextlib import contextmanager
-from src.utils.db import DatabaseManager
+class UserCheckInSummary(Base):
+    """用户签到汇总表(每个群每个用户一行，签到时增量更新)"""
+    __tablename__ = 'user_checkin_summaries'
+    __table_args__ = (
+        Index('ix_checkin_summaries_chat_points', 'chat_id', 'total_points'),
+    )
+    
+    chat_id = Column(BigInteger, primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
+    username = Column(String)
+    streak_days = Column(Integer, nullable=False, default=0)  # 最近一次签到时的连续天数
+    last_checkin_date = Column(Date)
+    total_points = Column(Integer, nullable=False, default=0)  # 累计积分
+    level = Column(Integer, nullable=False, default=1)
+
+from contextlib import contextmanager, asynccontextmanager
+from src.utils.db import DatabaseManager, open_session, run_in_session, upsert_insert
+from src.utils.db import add_missing_columns, create_missing_indexes, drop_obsolete_indexes, widen_integer_columns
+from src.user_profiles import profile_cache
+from src.outbox import outbox
+from src.utils.redis_client import redis_manager
+
+# Redis连接(共享连接池，checkin命名空间)
+redis_conn = redis_manager.namespace('checkin')
 
 # 数据库连接（生产环境使用）
 db_manager = DatabaseManager('sqlite:///../db/telegram_bot.db')
 Base.metadata.create_all(db_manager.engine)
 
-def init_db(db_url: str = 'sqlite:///../db/telegram_bot.db'):
+def init_db(db_url: str = 'sqlite:///../db/telegram_bot.db', async_mode=None):
     """初始化数据库连接"""
     global db_manager
-    db_manager = DatabaseManager(db_url)
+    db_manager = DatabaseManager(db_url, async_mode=async_mode)
     Base.metadata.create_all(db_manager.engine)
+    # 旧版本的user_checkins没有chat_id列，且可能有并发签到留下的重复记录，需在建唯一索引前处理
+    add_missing_columns(Base.metadata, db_manager.engine)
+    # 旧版本用INTEGER存放群组/用户ID，超级群ID放不下
+    widen_integer_columns(Base.metadata, db_manager.engine)
+    remove_duplicate_checkins(db_manager.engine)
+    create_missing_indexes(Base.metadata, db_manager.engine)
+    drop_obsolete_indexes(Base.metadata, db_manager.engine)
+
+def remove_duplicate_checkins(engine) -> int:
+    """删除同一用户同一天的重复签到记录(保留id最小的一条)，返回删除行数
+
+    唯一索引已存在时不会有重复记录，直接跳过。
+    """
+    indexes = {index['name'] for index in inspect(engine).get_indexes(UserCheckIn.__tablename__)}
+    if 'uq_user_checkins_chat_user_date' in indexes:
+        return 0
+    
+    keep = select(func.min(UserCheckIn.id).label('id')).group_by(
+        UserCheckIn.chat_id,
+        UserCheckIn.user_id,
+        UserCheckIn.checkin_date
+    ).subquery()
+    with engine.begin() as conn:
+        deleted = conn.execute(
+            delete(UserCheckIn).where(UserCheckIn.id.not_in(select(keep.c.id)))
+        ).rowcount
+    if deleted:
+        logging.warning(f"已删除 {deleted} 条重复签到记录")
+    return deleted
 
 @contextmanager
 def get_session():
@@ -40,63 +101,360 @@ def get_session():
     with db_manager.get_session() as session:
         yield session
 
-__all__ = ['init_db', 'get_session', 'UserCheckIn', 'calculate_level', 'handle_checkin']
+@asynccontextmanager
+async def get_async_session():
+    """获取异步数据库会话"""
+    async with db_manager.get_async_session() as session:
+        yield session
+
+def default_session_factory():
+    """按数据库模式选择会话工厂"""
+    return get_async_session if db_manager.is_async else get_session
+
+__all__ = [
+    'init_db', 'get_session', 'get_async_session', 'default_session_factory',
+    'UserCheckIn', 'UserCheckInSummary', 'calculate_level', 'handle_checkin',
+    'handle_profile', 'get_checkin_summary', 'top_checkin_users',
+    'backfill_checkin_summaries', 'get_points_leaderboard', 'get_points_rank',
+    'show_points_rank'
+]
 
 # 等级计算
 def calculate_level(points: int) -> int:
     """根据积分计算用户等级"""
     return min(points // 100 + 1, 10)  # 最大10级
 
+def _level_expression(points):
+    """calculate_level的SQL表达式版本"""
+    return case((points >= 900, 10), else_=points // 100 + 1)
+
+def _checkin_statement(session: Session, chat_id: int, user, today):
+    """构造签到语句: 一条语句完成昨日连签查询与今日记录写入
+
+    今日已有记录时由唯一索引触发 ON CONFLICT DO NOTHING，不返回任何行。
+    """
+    previous_streak = select(UserCheckIn.streak_days).where(
+        UserCheckIn.chat_id == chat_id,
+        UserCheckIn.user_id == user.id,
+        UserCheckIn.checkin_date == today - timedelta(days=1)
+    ).scalar_subquery()
+    streak = select(
+        (func.coalesce(previous_streak, 0) + 1).label('streak_days')
+    ).subquery()
+    
+    values = select(
+        literal(chat_id, BigInteger),
+        literal(user.id, BigInteger),
+        literal(user.username, String),
+        literal(today, Date),
+        streak.c.streak_days,
+        streak.c.streak_days * 10  # 基础10分，连续签到加倍
+    ).where(true())  # SQLite要求INSERT...SELECT的UPSERT带WHERE子句
+    
+    return upsert_insert(session, UserCheckIn).from_select(
+        ['chat_id', 'user_id', 'username', 'checkin_date', 'streak_days', 'total_points'],
+        values
+    ).on_conflict_do_nothing(
+        index_elements=['chat_id', 'user_id', 'checkin_date']
+    ).returning(
+        UserCheckIn.streak_days,
+        UserCheckIn.total_points
+    )
+
+def _summary_statement(session: Session, chat_id: int, user, today, streak: int, points: int):
+    """构造汇总表增量更新语句，返回累计积分和等级"""
+    stmt = upsert_insert(session, UserCheckInSummary).values(
+        chat_id=chat_id,
+        user_id=user.id,
+        username=user.username,
+        streak_days=streak,
+        last_checkin_date=today,
+        total_points=points,
+        level=calculate_level(points)
+    )
+    new_total = UserCheckInSummary.total_points + stmt.excluded.total_points
+    return stmt.on_conflict_do_update(
+        index_elements=['chat_id', 'user_id'],
+        set_={
+            'username': stmt.excluded.username,
+            'streak_days': stmt.excluded.streak_days,
+            'last_checkin_date': stmt.excluded.last_checkin_date,
+            'total_points': new_total,
+            'level': _level_expression(new_total)
+        }
+    ).returning(
+        UserCheckInSummary.total_points,
+        UserCheckInSummary.level
+    )
+
+def _apply_checkin(session: Session, chat_id: int, user, today) -> Optional[dict]:
+    """写入签到记录并更新汇总，今日已签到时返回None"""
+    row = session.execute(_checkin_statement(session, chat_id, user, today)).first()
+    if row is None:
+        session.rollback()
+        return None
+    
+    streak, points = row
+    total, level = session.execute(
+        _summary_statement(session, chat_id, user, today, streak, points)
+    ).one()
+    session.commit()
+    return {
+        'streak_days': streak,
+        'points': points,
+        'total_points': total,
+        'level': level
+    }
+
+def get_checkin_summary(session: Session, chat_id: int, user_id: int) -> Optional[UserCheckInSummary]:
+    """读取用户签到汇总(主键查询)"""
+    return session.get(UserCheckInSummary, (chat_id, user_id))
+
+def top_checkin_users(session: Session, chat_id: int, limit: int = 10) -> List[UserCheckInSummary]:
+    """按累计积分读取群内签到排行"""
+    return session.query(UserCheckInSummary).filter(
+        UserCheckInSummary.chat_id == chat_id
+    ).order_by(
+        UserCheckInSummary.total_points.desc()
+    ).limit(limit).all()
+
+def backfill_checkin_summaries(session: Session) -> int:
+    """根据user_checkins历史记录重建汇总表，返回写入行数
+
+    明细可能已被数据保留清理，已有汇总的累计积分只增不减。
+    """
+    latest = select(
+        UserCheckIn.chat_id,
+        UserCheckIn.user_id,
+        func.max(UserCheckIn.checkin_date).label('last_checkin_date'),
+        func.sum(UserCheckIn.total_points).label('total_points')
+    ).group_by(
+        UserCheckIn.chat_id,
+        UserCheckIn.user_id
+    ).subquery()
+    
+    # 取最近一次签到记录上的用户名和连续天数
+    rows = select(
+        latest.c.chat_id,
+        latest.c.user_id,
+        UserCheckIn.username,
+        UserCheckIn.streak_days,
+        latest.c.last_checkin_date,
+        latest.c.total_points,
+        _level_expression(latest.c.total_points)
+    ).join(
+        UserCheckIn,
+        and_(
+            UserCheckIn.chat_id == latest.c.chat_id,
+            UserCheckIn.user_id == latest.c.user_id,
+            UserCheckIn.checkin_date == latest.c.last_checkin_date
+        )
+    ).where(true())
+    
+    stmt = upsert_insert(session, UserCheckInSummary).from_select(
+        ['chat_id', 'user_id', 'username', 'streak_days',
+         'last_checkin_date', 'total_points', 'level'],
+        rows
+    )
+    total_points = case(
+        (UserCheckInSummary.total_points > stmt.excluded.total_points, UserCheckInSummary.total_points),
+        else_=stmt.excluded.total_points
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['chat_id', 'user_id'],
+        set_={
+            **{
+                column: stmt.excluded[column]
+                for column in ('username', 'streak_days', 'last_checkin_date')
+            },
+            'total_points': total_points,
+            'level': _level_expression(total_points)
+        }
+    )
+    result = session.execute(stmt)
+    session.commit()
+    return result.rowcount
+
+def _points_key(chat_id: int) -> str:
+    """群签到积分排行的有序集合键"""
+    return redis_conn.key(f"points:{chat_id}")
+
+def _chat_points(session: Session, chat_id: int) -> dict:
+    """读取群内全部用户的累计积分"""
+    rows = session.query(
+        UserCheckInSummary.user_id,
+        UserCheckInSummary.total_points
+    ).filter(
+        UserCheckInSummary.chat_id == chat_id
+    ).all()
+    return {str(user_id): total for user_id, total in rows}
+
+async def rebuild_points_leaderboard(chat_id: int, session_factory=None) -> int:
+    """从汇总表重建群积分排行，返回成员数"""
+    async with open_session(session_factory or default_session_factory()) as session:
+        points = await run_in_session(session, lambda s: _chat_points(s, chat_id))
+    
+    key = _points_key(chat_id)
+    if not points:
+        await redis_conn.delete(key)
+        return 0
+    
+    # 先写临时键再RENAME，读者不会看到构建到一半的集合
+    tmp_key = f"{key}:rebuild"
+    async with redis_conn.pipeline(transaction=True) as pipe:
+        pipe.delete(tmp_key)
+        pipe.zadd(tmp_key, points)
+        pipe.rename(tmp_key, key)
+        await pipe.execute()
+    return len(points)
+
+async def _update_points_leaderboard(chat_id: int, user_id: int, total_points: int, session_factory):
+    """签到后同步更新积分排行，集合缺失时整体重建"""
+    key = _points_key(chat_id)
+    async with redis_conn.pipeline() as pipe:
+        pipe.exists(key)
+        pipe.zadd(key, {str(user_id): total_points})
+        existed, _ = await pipe.execute()
+    
+    if not existed:
+        await rebuild_points_leaderboard(chat_id, session_factory)
+
+async def _ensure_points_leaderboard(chat_id: int, session_factory=None):
+    """排行集合不存在时从数据库重建"""
+    if not await redis_conn.exists(_points_key(chat_id)):
+        await rebuild_points_leaderboard(chat_id, session_factory)
+
+async def get_points_leaderboard(chat_id: int, limit: int = 10, session_factory=None) -> List[dict]:
+    """获取群签到积分前N名"""
+    await _ensure_points_leaderboard(chat_id, session_factory)
+    rankings = await redis_conn.zrevrange(
+        _points_key(chat_id),
+        0,
+        limit - 1,
+        withscores=True
+    )
+    return [
+        {"user_id": int(uid.decode()), "points": int(points)}
+        for uid, points in rankings
+    ]
+
+async def get_points_rank(chat_id: int, user_id: int, session_factory=None) -> Optional[dict]:
+    """获取用户在群内的积分名次(从1开始)，无记录时返回None"""
+    await _ensure_points_leaderboard(chat_id, session_factory)
+    key = _points_key(chat_id)
+    async with redis_conn.pipeline() as pipe:
+        pipe.zrevrank(key, str(user_id))
+        pipe.zscore(key, str(user_id))
+        rank, points = await pipe.execute()
+    
+    if rank is None:
+        return None
+    return {"rank": rank + 1, "points": int(points)}
+
 async def handle_checkin(
     update: Update, 
     context: ContextTypes.DEFAULT_TYPE,
-    session_factory=get_session
+    session_factory=None
 ):
     """处理签到命令"""
     user = update.effective_user
+    chat_id = update.effective_chat.id
     today = datetime.now().date()
     
     try:
-        session = session_factory()
-        # 检查今日是否已签到
-        existing = session.query(UserCheckIn).filter_by(
-            user_id=user.id,
-            checkin_date=today
-        ).first()
+        async with open_session(session_factory or default_session_factory()) as session:
+            result = await run_in_session(
+                session,
+                lambda s: _apply_checkin(s, chat_id, user, today)
+            )
         
-        if existing:
-            await update.message.reply_text(f'@{user.username} 今天已经签到过了哦~')
-            return
+        await profile_cache.remember(user)
         
-        # 计算连续签到天数
-        yesterday = session.query(UserCheckIn).filter_by(
-            user_id=user.id,
-            checkin_date=today.replace(day=today.day-1)
-        ).first()
+        if result is None:
+            await outbox.reply(update.message, f'@{user.username} 今天已经签到过了哦~')
+            return
         
-        streak = 1 if not yesterday else yesterday.streak_days + 1
-        points = streak * 10  # 基础10分，连续签到加倍
+        # 更新积分排行(失败不影响签到结果，缺失时下次查询会重建)
+        try:
+            await _update_points_leaderboard(
+                chat_id, user.id, result['total_points'], session_factory
+            )
+        except Exception as e:
+            logging.error(f"更新积分排行失败: {e}")
         
-        # 创建签到记录
-        new_checkin = UserCheckIn(
-            user_id=user.id,
-            username=user.username,
-            checkin_date=today,
-            streak_days=streak,
-            total_points=points
+        await outbox.reply(
+            update.message,
+            f'🎉 @{user.username} 签到成功！\n'
+            f'连续签到: {result["streak_days"]}天\n'
+            f'今日获得: {result["points"]}积分\n'
+            f'累计积分: {result["total_points"]}\n'
+            f'当前等级: Lv.{result["level"]}'
         )
         
-        session.add(new_checkin)
-        session.commit()
+    except Exception as e:
+        logging.error(f"签到处理错误: {e}")
+        await outbox.reply(update.message, '签到失败，请稍后再试~')
+
+async def handle_profile(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    session_factory=None
+):
+    """查看个人签到信息"""
+    user = update.effective_user
+    chat_id = update.effective_chat.id
+    
+    try:
+        async with open_session(session_factory or default_session_factory()) as session:
+            summary = await run_in_session(
+                session,
+                lambda s: get_checkin_summary(s, chat_id, user.id)
+            )
         
-        level = calculate_level(points)
-        await update.message.reply_text(
-            f'🎉 @{user.username} 签到成功！\n'
+        if summary is None:
+            await outbox.reply(update.message, f'@{user.username} 还没有签到记录，发送 /checkin 开始签到吧~')
+            return
+        
+        # 昨天之前中断的连签不再计入
+        streak = summary.streak_days
+        if summary.last_checkin_date < datetime.now().date() - timedelta(days=1):
+            streak = 0
+        
+        await outbox.reply(
+            update.message,
+            f'📋 @{user.username} 的签到信息\n'
             f'连续签到: {streak}天\n'
-            f'今日获得: {points}积分\n'
-            f'当前等级: Lv.{level}'
+            f'累计积分: {summary.total_points}\n'
+            f'当前等级: Lv.{summary.level}'
         )
         
     except Exception as e:
-        logging.error(f"签到处理错误: {e}")
-        await update.message.reply_text('签到失败，请稍后再试~')
\ No newline at end of file
+        logging.error(f"查询签到信息错误: {e}")
+        await outbox.reply(update.message, '查询失败，请稍后再试~')
+
+async def show_points_rank(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    session_factory=None
+):
+    """显示签到积分排行榜及本人名次"""
+    user = update.effective_user
+    chat_id = update.effective_chat.id
+    
+    try:
+        rankings = await get_points_leaderboard(chat_id, 10, session_factory)
+        mine = await get_points_rank(chat_id, user.id, session_factory)
+        
+        names = await profile_cache.display_names(rank['user_id'] for rank in rankings)
+        
+        response = "🏅 签到积分排行榜:\n"
+        for i, rank in enumerate(rankings, 1):
+            response += f"{i}. {names[rank['user_id']]}: {rank['points']}分\n"
+        if mine:
+            response += f"\n你的排名: 第{mine['rank']}名 ({mine['points']}分)"
+        
+        await outbox.reply(update.message, response)
+        
+    except Exception as e:
+        logging.error(f"查询积分排行错误: {e}")
+        await outbox.reply(update.message, '查询失败，请稍后再试~')
@@ -0,0 +1,129 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+from typing import Any, Awaitable, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import (
+    Application,
+    ApplicationHandlerStop,
+    BaseHandler,
+    BaseUpdateProcessor,
+    CommandHandler
+)
+
+from src.sharding import routing_key
+from src.utils.metrics import (
+    UPDATE_LANES_ACTIVE,
+    UPDATE_LANE_PENDING,
+    UPDATE_LANE_DEPTH,
+    UPDATE_LANE_WAIT,
+    HandlerTracker
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _Lane:
+    """单个群组的串行通道"""
+
+    __slots__ = ('lock', 'depth')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+
+class ChatLaneProcessor(BaseUpdateProcessor):
+    """按群组串行、跨群组并发的更新处理器
+
+    同一群组(无群组时按用户)的更新进入同一通道，按到达顺序逐个处理；
+    只有通道队首的更新占用执行槽位(concurrency)，慢群组不会阻塞其他群组。
+    max_pending 限制已接收但未处理完成的更新总数。
+    """
+
+    def __init__(self, concurrency: Optional[int] = None, max_pending: Optional[int] = None):
+        super().__init__(max_pending or int(os.getenv('UPDATE_MAX_PENDING', '10000')))
+        self.concurrency = concurrency or int(os.getenv('UPDATE_CONCURRENCY', '16'))
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._lanes: Dict[Hashable, _Lane] = {}
+        self._pending = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def lane_count(self) -> int:
+        return len(self._lanes)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]):
+        """在群组通道内排队，轮到后占用执行槽位处理"""
+        if not isinstance(update, Update):
+            # 非Telegram更新(自定义事件)无顺序要求
+            async with self._slots:
+                await coroutine
+            return
+
+        key = routing_key(update)
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane()
+            UPDATE_LANES_ACTIVE.set(len(self._lanes))
+        lane.depth += 1
+        self._pending += 1
+        UPDATE_LANE_DEPTH.observe(lane.depth)
+        UPDATE_LANE_PENDING.set(self._pending)
+
+        queued_at = time.perf_counter()
+        try:
+            # asyncio.Lock 按等待顺序唤醒，保证群组内顺序
+            async with lane.lock:
+                async with self._slots:
+                    UPDATE_LANE_WAIT.observe(time.perf_counter() - queued_at)
+                    await coroutine
+        finally:
+            lane.depth -= 1
+            self._pending -= 1
+            if lane.depth == 0:
+                del self._lanes[key]
+                UPDATE_LANES_ACTIVE.set(len(self._lanes))
+            UPDATE_LANE_PENDING.set(self._pending)
+
+
+def handler_name(handler: BaseHandler) -> str:
+    """处理器的指标标签: 命令处理器取命令名，其余取回调名"""
+    if isinstance(handler, CommandHandler):
+        return '/' + min(handler.commands)
+    name = getattr(handler.callback, '__qualname__', '')
+    if not name or '<lambda>' in name:
+        return type(handler).__name__
+    return name
+
+
+def instrument_handlers(application: Application):
+    """为已注册的全部处理器回调记录耗时、在途数、结果与依赖耗时(重复调用不会重复包装)"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if getattr(handler.callback, '__instrumented__', False):
+                continue
+            handler.callback = _timed(handler_name(handler), handler.callback)
+
+
+def _timed(name: str, callback):
+    @functools.wraps(callback)
+    async def run(update, context):
+        with HandlerTracker(name) as tracker:
+            try:
+                return await callback(update, context)
+            except ApplicationHandlerStop:
+                # 主动停止后续处理器组，不计为错误
+                tracker.outcome = 'stopped'
+                raise
+
+    run.__instrumented__ = True
+    return run
@@ -1,14 +1,27 @@
 import os
+import sys
+import asyncio
 import logging
 from pathlib import Path
 from dotenv import load_dotenv
-from telegram.ext import ApplicationBuilder, CommandHandler
-from src.checkin import handle_checkin
+from telegram import Update
+from telegram.ext import (
+    ApplicationBuilder, CommandHandler, MessageHandler,
+    CallbackQueryHandler, ChatMemberHandler, filters
+)
+from src.checkin import handle_checkin, handle_profile, show_points_rank
 from src.member_management import MemberManager
 from src.message_stats import MessageStats
 from src.welcome_system import WelcomeSystem
 from src.task_scheduler import TaskScheduler
 from src.monitoring.system_monitor import SystemMonitor
+from src.user_profiles import profile_cache
+from src.outbox import outbox
+from src.webhook import WebhookServer, register_webhook, run_workers, serve_application
+from src.sharding import ShardRouter
+from src.dispatch import ChatLaneProcessor, instrument_handlers
+from src.utils.leader import LeaderElection
+from src.utils.redis_client import redis_manager
 
 # 加载环境变量
 load_dotenv('../config/.env')
@@ -19,57 +32,137 @@ logging.basicConfig(
     level=logging.INFO
 )
 
-# 初始化数据库 (通过checkin模块的init_db)
+# 初始化数据库 (通过checkin模块的init_db, DB_ASYNC=1 时启用异步引擎)
 from src.checkin import init_db
-init_db()
+init_db(os.getenv('DATABASE_URL', 'sqlite:///../db/telegram_bot.db'))
+
+# 由main()初始化的全局组件
+member_manager = None
+message_stats = None
+welcome_system = None
+task_scheduler = None
+scheduler_leader = None
 
 async def start(update, context):
     """处理/start命令"""
-    await update.message.reply_text(
+    await outbox.reply(
+        update.message,
         '欢迎使用群管机器人!\n\n'
         '可用命令:\n'
         '/start - 显示帮助\n'
         '/checkin - 每日签到\n'
-        '/rank - 活跃度排行\n'
+        '/profile - 签到信息\n'
+        '/rank [today|7d|30d] - 活跃度排行\n'
+        '/pointsrank - 签到积分排行\n'
         '/setwelcome - 设置欢迎语\n'
         '/ban - 封禁用户\n'
         '/mute - 禁言用户\n'
-        '/unban - 解封用户'
+        '/unban - 解封用户\n'
+        '/bulkban - 批量封禁\n'
+        '/bulkmute - 批量禁言'
     )
 
 async def set_welcome(update, context):
     """设置欢迎语"""
     if not context.args:
-        await update.message.reply_text("请提供欢迎语内容")
+        await outbox.reply(update.message, "请提供欢迎语内容")
         return
     
     welcome_text = ' '.join(context.args)
-    welcome_system.set_welcome_message(
+    await welcome_system.set_welcome_message(
         update.effective_chat.id,
         welcome_text
     )
-    await update.message.reply_text("✅ 欢迎语设置成功")
+    await outbox.reply(update.message, "✅ 欢迎语设置成功")
+
+# /rank 窗口参数对应的标题
+RANK_WINDOW_TITLES = {'all': '累计', 'today': '今日', '7d': '近7天', '30d': '近30天'}
 
 async def show_rank(update, context):
-    """显示活跃度排行榜"""
+    """显示活跃度排行榜(/rank [today|7d|30d])"""
     chat_id = update.effective_chat.id
-    rankings = message_stats.get_leaderboard(chat_id)
+    window = context.args[0] if context.args else 'all'
+    if window not in RANK_WINDOW_TITLES:
+        await outbox.reply(update.message, "用法: /rank [today|7d|30d]")
+        return
+    rankings = await message_stats.get_leaderboard(chat_id, window=window)
     
-    response = "🏆 活跃度排行榜:\n"
+    response = f"🏆 {RANK_WINDOW_TITLES[window]}活跃度排行榜:\n"
+    names = await profile_cache.display_names(rank['user_id'] for rank in rankings[:10])
     for i, rank in enumerate(rankings[:10], 1):
-        response += f"{i}. 用户 {rank['user_id']}: {rank['count']}条\n"
+        response += f"{i}. {names[rank['user_id']]}: {rank['count']}条\n"
     
-    await update.message.reply_text(response)
+    await outbox.reply(update.message, response)
+
+def is_primary_worker() -> bool:
+    """是否为主工作进程(多进程Webhook部署时只有0号进程注册Webhook和运行系统监控)"""
+    return os.getenv('WORKER_INDEX', '0') == '0'
+
+async def post_init(application):
+    """应用启动后启动后台写入任务"""
+    # 各模块经发送队列发消息，需最先启动
+    outbox.start()
+    await message_stats.start()
+    await member_manager.start()
+    # 验证超时清理与默认定时任务一样只在领导者上执行
+    await welcome_system.start(application.bot, leader=scheduler_leader)
+    # 每个实例都运行调度器，默认任务只在选举出的领导者上执行
+    scheduler_leader.start()
+    # 调度器任务运行在Application的事件循环上
+    task_scheduler.start()
+    webhook_url = os.getenv('WEBHOOK_URL')
+    if webhook_url and is_primary_worker():
+        await register_webhook(application.bot, webhook_url, os.getenv('WEBHOOK_SECRET_TOKEN', ''))
+
+async def post_shutdown(application):
+    """应用关闭时写出缓冲区中的剩余数据"""
+    task_scheduler.shutdown()
+    await scheduler_leader.stop()
+    await message_stats.stop()
+    await member_manager.stop()
+    await welcome_system.stop()
+    # 发完其他模块关闭时排入的消息
+    await outbox.stop()
+    await redis_manager.close()
+    from src import checkin
+    await checkin.db_manager.dispose()
 
 def main():
     """主程序入口"""
+    global member_manager, message_stats, welcome_system, task_scheduler, scheduler_leader
+    
+    # 设置WEBHOOK_URL时以Webhook方式接收更新，否则使用长轮询
+    webhook_url = os.getenv('WEBHOOK_URL')
+    workers = int(os.getenv('WEBHOOK_WORKERS', '1'))
+    if webhook_url and workers > 1 and 'WORKER_INDEX' not in os.environ:
+        # 多个工作进程通过SO_REUSEPORT共享同一端口，指标由主进程汇总输出
+        sys.exit(run_workers(main, workers, metrics_port=int(os.getenv('PROMETHEUS_PORT', '8000'))))
+    
     # 创建应用实例
-    application = ApplicationBuilder().token(os.getenv('BOT_TOKEN')).build()
+    builder = (
+        ApplicationBuilder()
+        .token(os.getenv('BOT_TOKEN'))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    update_processor = None
+    if int(os.getenv('UPDATE_CONCURRENCY', '16')) > 1:
+        # 跨群组并发处理更新，同一群组内保持顺序
+        update_processor = ChatLaneProcessor()
+        builder = builder.concurrent_updates(update_processor)
+    if webhook_url:
+        # 有界队列: 分发跟不上(或在途更新达到上限)时Webhook返回503，由Telegram重试
+        builder = builder.updater(None).update_queue(
+            asyncio.Queue(maxsize=int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000')))
+        )
+    application = builder.build()
     
     # 初始化管理器
-    member_manager = MemberManager(get_session)
-    message_stats = MessageStats(get_session())
-    welcome_system = WelcomeSystem(get_session())
+    from src import checkin
+    session_factory = checkin.default_session_factory()
+    member_manager = MemberManager(session_factory)
+    message_stats = MessageStats(session_factory)
+    welcome_system = WelcomeSystem(checkin.db_manager.Session())
     
     # 初始化监控系统
     monitor = SystemMonitor(os.getenv('BOT_TOKEN'))
@@ -78,11 +171,13 @@ def main():
     })
     
     # 初始化任务调度器
-    task_scheduler = TaskScheduler(application)
+    scheduler_leader = LeaderElection('scheduler')
+    task_scheduler = TaskScheduler(application, session_factory, leader=scheduler_leader)
     
     # 添加处理器
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("checkin", handle_checkin))
+    application.add_handler(CommandHandler("profile", handle_profile))
     application.add_handler(MessageHandler(
         filters=filters.TEXT & ~filters.COMMAND,
         callback=message_stats.record_message
@@ -109,30 +204,62 @@ def main():
     
     # 统计命令
     application.add_handler(CommandHandler("rank", show_rank))
+    application.add_handler(CommandHandler("pointsrank", show_points_rank))
     
     # 成员管理命令
     application.add_handler(CommandHandler(
         "ban", 
-        lambda u, c: member_manager.ban_member(u, c, u.args[0] if u.args else None)
+        lambda u, c: member_manager.handle_command(u, c, 'ban')
     ))
     application.add_handler(CommandHandler(
         "unban",
-        lambda u, c: member_manager.unban_member(u, c, u.args[0] if u.args else None)
+        lambda u, c: member_manager.handle_command(u, c, 'unban')
     ))
     application.add_handler(CommandHandler(
         "mute",
-        lambda u, c: member_manager.mute_member(u, c, u.args[0] if u.args else None)
+        lambda u, c: member_manager.handle_command(u, c, 'mute')
     ))
     
-    # 启动监控系统
-    monitor.start()
+    application.add_handler(CommandHandler(
+        "bulkban",
+        lambda u, c: member_manager.bulk_moderate(u, c, 'ban')
+    ))
+    application.add_handler(CommandHandler(
+        "bulkmute",
+        lambda u, c: member_manager.bulk_moderate(u, c, 'mute')
+    ))
     
-    # 启动任务调度器
-    task_scheduler.start()
+    # 管理员变更时刷新权限缓存
+    application.add_handler(ChatMemberHandler(
+        member_manager.handle_chat_member_update,
+        ChatMemberHandler.ANY_CHAT_MEMBER
+    ))
+    
+    # 记录各处理器耗时
+    instrument_handlers(application)
+    
+    # 启动监控系统
+    if is_primary_worker():
+        monitor.start()
     
     try:
         # 启动机器人
-        application.run_polling()
+        if webhook_url:
+            # 多进程时按群组一致性哈希分片，其他分片的更新经Redis转发
+            router = None
+            if workers > 1:
+                router = ShardRouter(application.bot, application.update_queue)
+            server = WebhookServer(
+                application.bot,
+                application.update_queue,
+                reuse_port=workers > 1,
+                router=router,
+                update_processor=update_processor
+            )
+            asyncio.run(serve_application(application, server))
+        else:
+            # chat_member更新需显式订阅
+            application.run_polling(allowed_updates=Update.ALL_TYPES)
     finally:
         # 关闭监控系统
         monitor.stop()
@@ -1,23 +1,112 @@
+import asyncio
 import json
 import logging
+import os
+import re
+import time
+import uuid
 from datetime import datetime
-from typing import Optional
-from telegram import ChatPermissions
+from typing import Awaitable, Callable, Dict, FrozenSet, Iterable, List, Optional
+from telegram import Bot, ChatPermissions, ChatMember
 from telegram import Update, User
 from telegram.ext import ContextTypes
-from telegram.error import BadRequest
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Index
 from sqlalchemy.orm import Session
-from redis import Redis
+from src.checkin import Base
+from src.outbox import outbox
+from src.utils.cache import TTLCache
+from src.utils.db import open_session, run_in_session, upsert_insert
+from src.utils.metrics import BULK_MODERATION_ACTIONS, BULK_MODERATION_RETRY_AFTER
+from src.utils.rate_limit import retry_after_seconds
+from src.utils.redis_client import redis_manager
+from src.utils.write_buffer import WriteBehindBuffer
 
-# 初始化Redis连接
-redis_conn = Redis(host='localhost', port=6379, db=1)
+# Redis连接(共享连接池，members命名空间)
+redis_conn = redis_manager.namespace('members')
+
+# 具有管理权限的成员状态
+ADMIN_STATUSES = (ChatMember.ADMINISTRATOR, ChatMember.OWNER)
+
+# 禁言后的成员权限
+MUTED_PERMISSIONS = ChatPermissions(
+    can_send_messages=False,
+    can_send_polls=False,
+    can_send_other_messages=False
+)
+
+# 单用户管理命令的用法提示
+COMMAND_USAGE = {
+    'ban': "用法: /ban <用户ID>",
+    'unban': "用法: /unban <用户ID>",
+    'mute': "用法: /mute <用户ID>",
+}
+
+def parse_positive_int(arg: str) -> Optional[int]:
+    """解析命令参数中的正整数(用户ID、分钟数)，无效时返回None"""
+    arg = arg.strip()
+    if not arg.isdigit() or int(arg) <= 0:
+        return None
+    return int(arg)
 
 class MemberManager:
     """成员管理核心类"""
     
-    def __init__(self, session_factory):
+    def __init__(
+        self,
+        session_factory,
+        admin_cache_ttl: Optional[float] = None,
+        action_window: Optional[int] = None
+    ):
         self.get_session = session_factory
         self.logger = logging.getLogger(__name__)
+        
+        # 管理操作日志: 批量写入数据库，Redis只保留每个群最近action_window条
+        self.action_window = action_window or int(os.getenv('ADMIN_ACTIONS_REDIS_WINDOW', '1000'))
+        self.action_buffer = WriteBehindBuffer(
+            'admin_actions',
+            self._write_actions,
+            max_batch_size=200,
+            flush_interval=1.0
+        )
+        
+        # 群管理员ID缓存: chat_id -> frozenset(user_id)
+        self.admin_cache = TTLCache(
+            'admin_permissions',
+            maxsize=4096,
+            ttl=admin_cache_ttl or float(os.getenv('ADMIN_CACHE_TTL', '300'))
+        )
+        # 进行中的管理员列表请求，同一群的并发未命中共享一次API调用
+        self._admin_fetches: Dict[int, asyncio.Task] = {}
+        # 失效代数，请求期间发生失效时不回填旧结果
+        self._admin_generation: Dict[int, int] = {}
+
+    async def start(self):
+        """启动操作日志的后台批量写入"""
+        self.action_buffer.start()
+
+    async def stop(self):
+        """关闭时写出剩余操作日志"""
+        await self.action_buffer.stop()
+
+    async def handle_command(
+        self,
+        update: Update,
+        context: ContextTypes.DEFAULT_TYPE,
+        action: str
+    ):
+        """/ban、/unban、/mute 命令入口: 参数不是有效用户ID时回复用法"""
+        args = context.args or []
+        user_id = parse_positive_int(args[0]) if args else None
+        if user_id is None:
+            await outbox.reply(update.message, COMMAND_USAGE[action])
+            return None
+        handler = {
+            'ban': self.ban_member,
+            'unban': self.unban_member,
+            'mute': self.mute_member,
+        }[action]
+        return await handler(update, context, user_id)
 
     async def ban_member(
         self,
@@ -28,11 +117,9 @@ class MemberManager:
     ):
         """封禁群成员"""
         try:
-            from src.monitoring.system_monitor import SystemMonitor
-            
             # 权限验证
             if not await self._check_admin_permission(update):
-                await update.message.reply_text("❌ 需要管理员权限")
+                await outbox.reply(update.message, "❌ 需要管理员权限")
                 return False
             
             # 执行封禁
@@ -41,18 +128,17 @@ class MemberManager:
                 user_id=user_id
             )
             
-            # 记录管理操作
-            SystemMonitor.REQUEST_COUNT.inc()
-            
             # 记录日志
-            self._log_action(
+            await self._log_action(
                 action='ban',
                 operator=update.effective_user.id,
                 target=user_id,
-                reason=reason
+                reason=reason,
+                chat_id=update.effective_chat.id
             )
             
-            await update.message.reply_text(
+            await outbox.reply(
+                update.message,
                 f"✅ 用户 {user_id} 已被封禁\n"
                 f"原因: {reason or '违反群规'}"
             )
@@ -60,7 +146,41 @@ class MemberManager:
             
         except BadRequest as e:
             self.logger.error(f"封禁失败: {e}")
-            await update.message.reply_text("封禁操作失败")
+            await outbox.reply(update.message, "封禁操作失败")
+            return False
+
+    async def unban_member(
+        self,
+        update: Update,
+        context: ContextTypes.DEFAULT_TYPE,
+        user_id: int
+    ):
+        """解除封禁"""
+        try:
+            if not await self._check_admin_permission(update):
+                await outbox.reply(update.message, "❌ 需要管理员权限")
+                return False
+            
+            await context.bot.unban_chat_member(
+                chat_id=update.effective_chat.id,
+                user_id=user_id,
+                only_if_banned=True
+            )
+            
+            await self._log_action(
+                action='unban',
+                operator=update.effective_user.id,
+                target=user_id,
+                reason=None,
+                chat_id=update.effective_chat.id
+            )
+            
+            await outbox.reply(update.message, f"✅ 用户 {user_id} 已解除封禁")
+            return True
+            
+        except BadRequest as e:
+            self.logger.error(f"解封失败: {e}")
+            await outbox.reply(update.message, "解封操作失败")
             return False
 
     async def mute_member(
@@ -75,7 +195,7 @@ class MemberManager:
         try:
             # 权限验证
             if not await self._check_admin_permission(update):
-                await update.message.reply_text("❌ 需要管理员权限")
+                await outbox.reply(update.message, "❌ 需要管理员权限")
                 return False
                 
             # 执行禁言
@@ -83,22 +203,27 @@ class MemberManager:
             await context.bot.restrict_chat_member(
                 chat_id=update.effective_chat.id,
                 user_id=user_id,
-                permissions=ChatPermissions(
-                    can_send_messages=False,
-                    can_send_polls=False,
-                    can_send_other_messages=False
-                ),
+                permissions=MUTED_PERMISSIONS,
                 until_date=until_date
             )
             
             # 记录到Redis
-            redis_conn.setex(
-                f"mute:{update.effective_chat.id}:{user_id}",
-                duration,
-                str(reason)
+            await redis_conn.set(
+                redis_conn.key(f"mute:{update.effective_chat.id}:{user_id}"),
+                str(reason),
+                ex=duration
+            )
+            
+            await self._log_action(
+                action='mute',
+                operator=update.effective_user.id,
+                target=user_id,
+                reason=reason,
+                chat_id=update.effective_chat.id
             )
             
-            await update.message.reply_text(
+            await outbox.reply(
+                update.message,
                 f"⏳ 用户 {user_id} 已被禁言 {duration//3600}小时\n"
                 f"原因: {reason or '违反发言规则'}"
             )
@@ -106,29 +231,336 @@ class MemberManager:
             
         except BadRequest as e:
             self.logger.error(f"禁言失败: {e}")
-            await update.message.reply_text("禁言操作失败")
+            await outbox.reply(update.message, "禁言操作失败")
             return False
 
+    async def bulk_moderate(
+        self,
+        update: Update,
+        context: ContextTypes.DEFAULT_TYPE,
+        action: str = 'ban',
+        duration: int = 3600
+    ):
+        """批量封禁/禁言
+
+        参数为用户ID列表，或 recent [分钟] 表示最近入群且未验证的成员。
+        """
+        if not await self._check_admin_permission(update):
+            await outbox.reply(update.message, "❌ 需要管理员权限")
+            return None
+        
+        chat_id = update.effective_chat.id
+        user_ids = await self._resolve_bulk_targets(chat_id, context.args or [])
+        if not user_ids:
+            await outbox.reply(update.message, "请提供用户ID列表，或使用 recent [分钟]")
+            return None
+        
+        # 进度消息之后会被编辑，不能与其他消息合并
+        status = await outbox.reply(
+            update.message,
+            f"⏳ 开始处理 {len(user_ids)} 个用户...",
+            merge=False
+        )
+        last_report = time.monotonic()
+        
+        async def report_progress(done: int, total: int):
+            nonlocal last_report
+            # 编辑消息本身也受限流约束，最多每2秒更新一次
+            if done < total and time.monotonic() - last_report < 2:
+                return
+            last_report = time.monotonic()
+            try:
+                await status.edit_text(f"⏳ 进度: {done}/{total}")
+            except TelegramError as e:
+                self.logger.warning(f"更新批量操作进度失败: {e}")
+        
+        moderator = BulkModerator(context.bot)
+        result = await moderator.run(
+            chat_id,
+            user_ids,
+            action=action,
+            duration=duration,
+            progress_callback=report_progress
+        )
+        
+        for user_id in result['succeeded']:
+            await self._log_action(
+                action=f'bulk_{action}',
+                operator=update.effective_user.id,
+                target=user_id,
+                reason=None,
+                chat_id=chat_id
+            )
+        
+        await status.edit_text(
+            f"✅ 批量{'封禁' if action == 'ban' else '禁言'}完成\n"
+            f"成功: {len(result['succeeded'])} 失败: {len(result['failed'])}\n"
+            f"耗时: {result['elapsed']:.1f}秒 ({result['throughput']:.1f}个/秒)"
+        )
+        return result
+
+    async def _resolve_bulk_targets(self, chat_id: int, args: List[str]) -> List[int]:
+        """解析批量操作目标用户，参数无效时返回空列表"""
+        if args and args[0] == 'recent':
+            from src.welcome_system import recent_joiners
+            if len(args) > 1 and parse_positive_int(args[1]) is None:
+                # 分钟数无效，由调用方回复用法
+                return []
+            minutes = int(args[1]) if len(args) > 1 else None
+            return await recent_joiners(chat_id, within_seconds=minutes * 60 if minutes else None)
+        
+        user_ids = [parse_positive_int(arg) for arg in args]
+        if None in user_ids:
+            # 含无效ID(非数字、0或负数)时整条命令不执行，由调用方回复用法
+            return []
+        # 去重并保持顺序
+        return list(dict.fromkeys(user_ids))
+
     async def _check_admin_permission(self, update: Update) -> bool:
         """验证管理员权限"""
-        admins = await update.effective_chat.get_administrators()
-        return update.effective_user.id in [admin.user.id for admin in admins]
+        admin_ids = await self._get_admin_ids(update.effective_chat)
+        return update.effective_user.id in admin_ids
+
+    async def _get_admin_ids(self, chat) -> FrozenSet[int]:
+        """获取群管理员ID集合(优先读缓存)"""
+        admin_ids = self.admin_cache.get(chat.id)
+        if admin_ids is not None:
+            return admin_ids
+        
+        task = self._admin_fetches.get(chat.id)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_admin_ids(chat))
+            self._admin_fetches[chat.id] = task
+            task.add_done_callback(lambda _: self._admin_fetches.pop(chat.id, None))
+        return await task
 
-    def _log_action(self, action: str, operator: int, target: int, reason: Optional[str]):
-        """记录管理操作日志"""
-        log_entry = {
+    async def _fetch_admin_ids(self, chat) -> FrozenSet[int]:
+        """调用Bot API获取管理员列表并写入缓存"""
+        generation = self._admin_generation.get(chat.id, 0)
+        admins = await chat.get_administrators()
+        admin_ids = frozenset(admin.user.id for admin in admins)
+        if self._admin_generation.get(chat.id, 0) == generation:
+            self.admin_cache.set(chat.id, admin_ids)
+        return admin_ids
+
+    def invalidate_admin_cache(self, chat_id: int):
+        """使群管理员缓存失效"""
+        self._admin_generation[chat_id] = self._admin_generation.get(chat_id, 0) + 1
+        self.admin_cache.invalidate(chat_id)
+
+    async def handle_chat_member_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """成员状态变更时刷新管理员缓存"""
+        member_update = update.chat_member or update.my_chat_member
+        if member_update is None:
+            return
+        
+        old_status = member_update.old_chat_member.status
+        new_status = member_update.new_chat_member.status
+        if old_status != new_status and (
+            old_status in ADMIN_STATUSES or new_status in ADMIN_STATUSES
+        ):
+            self.invalidate_admin_cache(member_update.chat.id)
+
+    async def _log_action(
+        self,
+        action: str,
+        operator: int,
+        target: int,
+        reason: Optional[str],
+        chat_id: int = 0
+    ):
+        """记录管理操作日志(入队，由缓冲区批量写入)"""
+        await self.action_buffer.put({
+            # 写入去重键，批次重试时不会重复插入
+            'action_id': uuid.uuid4().hex,
+            'chat_id': chat_id,
             'action': action,
-            'operator': operator,
-            'target': target,
+            'operator_id': operator,
+            'target_id': target,
             'reason': reason,
-            'timestamp': datetime.now().isoformat()
-        }
-        # 写入数据库
-        # 同时写入Redis缓存
-        redis_conn.rpush(
-            'admin_actions',
-            json.dumps(log_entry)
+            'timestamp': datetime.now()
+        })
+
+    async def _write_actions(self, entries: List[Dict]):
+        """批量写出操作日志: 一次批量插入 + 一次Redis事务
+
+        写入可被缓冲区整批重试: 数据库按action_id去重，已写入的行不会重复；
+        Redis部分在事务中执行，失败时不会留下半批。
+        """
+        def insert(session: Session):
+            statement = upsert_insert(session, AdminAction.__table__).on_conflict_do_nothing(
+                index_elements=['action_id']
+            )
+            session.execute(statement, entries)
+            session.commit()
+        
+        async with open_session(self.get_session) as session:
+            await run_in_session(session, insert)
+        
+        # Redis中按群保留最近的操作，列表头部为最新
+        async with redis_conn.pipeline(transaction=True) as pipe:
+            for chat_id in {entry['chat_id'] for entry in entries}:
+                key = redis_conn.key(f"admin_actions:{chat_id}")
+                pipe.lpush(key, *[
+                    json.dumps({**entry, 'timestamp': entry['timestamp'].isoformat()})
+                    for entry in entries if entry['chat_id'] == chat_id
+                ])
+                pipe.ltrim(key, 0, self.action_window - 1)
+            await pipe.execute()
+
+    async def get_recent_actions(self, chat_id: int, limit: int = 20) -> List[Dict]:
+        """读取群内最近的管理操作(Redis窗口)"""
+        entries = await redis_conn.lrange(
+            redis_conn.key(f"admin_actions:{chat_id}"),
+            0,
+            min(limit, self.action_window) - 1
         )
+        return [json.loads(entry) for entry in entries]
+
+    async def get_user_actions(self, chat_id: int, target_id: int, limit: int = 50) -> List[Dict]:
+        """查询群内针对某用户的管理操作(按时间倒序，走(chat_id, target_id, timestamp)索引)"""
+        def query(session: Session):
+            rows = session.query(AdminAction).filter(
+                AdminAction.chat_id == chat_id,
+                AdminAction.target_id == target_id
+            ).order_by(
+                AdminAction.timestamp.desc()
+            ).limit(limit).all()
+            return [
+                {
+                    'action': row.action,
+                    'operator_id': row.operator_id,
+                    'target_id': row.target_id,
+                    'reason': row.reason,
+                    'timestamp': row.timestamp
+                }
+                for row in rows
+            ]
+        
+        async with open_session(self.get_session) as session:
+            return await run_in_session(session, query)
+
+class BulkModerator:
+    """批量封禁/禁言执行器
+
+    以有界并发调用Bot API；收到RetryAfter时所有worker暂停到指定时间后重试。
+    """
+    
+    def __init__(self, bot: Bot, concurrency: Optional[int] = None, max_retries: int = 3):
+        self.bot = bot
+        self.concurrency = concurrency or int(os.getenv('BULK_MODERATION_CONCURRENCY', '8'))
+        self.max_retries = max_retries
+        self.logger = logging.getLogger(__name__)
+        self._resume_at = 0.0
+    
+    async def run(
+        self,
+        chat_id: int,
+        user_ids: Iterable[int],
+        action: str = 'ban',
+        duration: int = 3600,
+        progress_callback: Optional[Callable[[int, int], Awaitable[None]]] = None
+    ) -> Dict:
+        """执行批量操作，返回成功/失败列表与吞吐量"""
+        if action not in ('ban', 'mute', 'kick'):
+            raise ValueError(f"不支持的批量操作: {action}")
+        
+        user_ids = list(user_ids)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        until_date = int(datetime.now().timestamp()) + duration
+        succeeded: List[int] = []
+        failed: Dict[int, str] = {}
+        done = 0
+        start = time.perf_counter()
+        
+        async def worker(user_id: int):
+            nonlocal done
+            async with semaphore:
+                error = await self._apply(chat_id, user_id, action, until_date)
+            if error is None:
+                succeeded.append(user_id)
+            else:
+                failed[user_id] = error
+            BULK_MODERATION_ACTIONS.labels(
+                action=action,
+                result='success' if error is None else 'failure'
+            ).inc()
+            done += 1
+            if progress_callback:
+                await progress_callback(done, len(user_ids))
+        
+        await asyncio.gather(*(worker(user_id) for user_id in user_ids))
+        
+        elapsed = time.perf_counter() - start
+        return {
+            'action': action,
+            'total': len(user_ids),
+            'succeeded': succeeded,
+            'failed': failed,
+            'elapsed': elapsed,
+            'throughput': len(user_ids) / elapsed if elapsed > 0 else 0.0
+        }
+    
+    async def _apply(self, chat_id: int, user_id: int, action: str, until_date: int) -> Optional[str]:
+        """对单个用户执行操作，成功返回None，失败返回错误信息"""
+        for attempt in range(self.max_retries + 1):
+            await self._wait_flood_control()
+            try:
+                if action == 'ban':
+                    await self.bot.ban_chat_member(chat_id=chat_id, user_id=user_id)
+                elif action == 'kick':
+                    # 踢出: 封禁后立即解封，用户可重新加入
+                    await self.bot.ban_chat_member(chat_id=chat_id, user_id=user_id)
+                    await self.bot.unban_chat_member(
+                        chat_id=chat_id,
+                        user_id=user_id,
+                        only_if_banned=True
+                    )
+                else:
+                    await self.bot.restrict_chat_member(
+                        chat_id=chat_id,
+                        user_id=user_id,
+                        permissions=MUTED_PERMISSIONS,
+                        until_date=until_date
+                    )
+                return None
+            except RetryAfter as e:
+                BULK_MODERATION_RETRY_AFTER.inc()
+                delay = retry_after_seconds(e)
+                self.logger.warning(f"批量操作触发限流，暂停{delay}秒")
+                loop = asyncio.get_running_loop()
+                self._resume_at = max(self._resume_at, loop.time() + delay)
+            except TelegramError as e:
+                self.logger.error(f"批量{action}用户 {user_id} 失败: {e}")
+                return str(e)
+        return "超过最大重试次数"
+    
+    async def _wait_flood_control(self):
+        """等待到限流解除"""
+        delay = self._resume_at - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+# 数据库模型
+class AdminAction(Base):
+    """管理操作日志表"""
+    __tablename__ = 'admin_actions'
+    __table_args__ = (
+        Index('ix_admin_actions_chat_target_ts', 'chat_id', 'target_id', 'timestamp'),
+        Index('ix_admin_actions_chat_ts', 'chat_id', 'timestamp'),
+        Index('ix_admin_actions_timestamp', 'timestamp'),
+        # 批次重试去重(旧数据action_id为NULL，不参与去重)
+        Index('uq_admin_actions_action_id', 'action_id', unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    action_id = Column(String(32))
+    chat_id = Column(BigInteger, nullable=False)
+    action = Column(String(32), nullable=False)
+    operator_id = Column(BigInteger, nullable=False)
+    target_id = Column(BigInteger, nullable=False)
+    reason = Column(String)
+    timestamp = Column(DateTime, default=datetime.now, nullable=False)
 
 # 工具函数
 async def parse_user_reference(message_text: str) -> Optional[int]:
@@ -1,102 +1,617 @@
+import asyncio
+import json
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, List
-from sqlalchemy import Column, Integer, String, DateTime, func
+import os
+import socket
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from sqlalchemy import Column, Integer, BigInteger, String, Date, DateTime, Index, func, select
 from src.checkin import Base
 from sqlalchemy.orm import Session
-from telegram import Update
+from telegram import Update, User
 from telegram.ext import ContextTypes
-from redis import Redis
+from src.user_profiles import profile_cache
+from src.utils.db import open_session, run_in_session, upsert_insert
+from src.utils.metrics import (
+    WRITE_BUFFER_DEPTH,
+    WRITE_BUFFER_FLUSHED,
+    WRITE_BUFFER_FAILURES,
+    MESSAGE_QUEUE_REDELIVERED
+)
+from src.utils.redis_client import redis_manager
+from src.utils.write_buffer import WriteBehindBuffer
 
-# Redis连接
-redis_conn = Redis(host='localhost', port=6379, db=2)
+# Redis连接(共享连接池，stats命名空间)
+redis_conn = redis_manager.namespace('stats')
+
+# 排行榜时间窗口(天数)，all为累计排行
+LEADERBOARD_WINDOWS = {'today': 1, '7d': 7, '30d': 30}
+
+# 按天分桶的活跃度在最长窗口之后自动过期
+DAY_BUCKET_TTL = (max(LEADERBOARD_WINDOWS.values()) + 1) * 86400
+
+def _day_key(chat_id: int, day: date) -> str:
+    """群组单日活跃度有序集合"""
+    return redis_conn.key(f"chat:{chat_id}:activity:{day:%Y%m%d}")
+
+# 待入库消息队列(Redis列表，进程崩溃不丢失)
+MESSAGE_QUEUE_KEY = redis_conn.key("message_queue")
+
+# 消费者心跳有效期(秒)，超时未续期的消费者的处理中列表会被放回队列
+CONSUMER_TTL = 60
+
+def _encode_message(message: Dict) -> str:
+    return json.dumps({**message, 'timestamp': message['timestamp'].isoformat()})
+
+def _decode_message(raw: bytes) -> Dict:
+    message = json.loads(raw)
+    message['timestamp'] = datetime.fromisoformat(message['timestamp'])
+    return message
 
 class MessageStats:
     """消息统计核心类"""
     
-    def __init__(self, session: Session):
+    def __init__(
+        self,
+        session,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_pending: int = 10000,
+        consumer: Optional[str] = None
+    ):
+        # 会话对象或会话工厂(同步/异步均可)
         self.session = session
         self.logger = logging.getLogger(__name__)
+        # 写后缓冲: 逐条消息先入内存队列，按批次写入Redis(计数 + 待入库队列)
+        self.buffer = WriteBehindBuffer(
+            'message_stats',
+            self._write_batch,
+            max_batch_size=batch_size,
+            flush_interval=flush_interval,
+            max_queue_size=max_pending
+        )
+        # 待随下一批次写出的用户资料(同一用户只保留最新的)
+        self._profiles: Dict[int, User] = {}
+        
+        # 入库阶段: 从Redis队列按块认领消息写入数据库，写入成功后才确认
+        self.drain_chunk_size = batch_size
+        self.drain_poll_interval = flush_interval
+        self.consumer = consumer or os.getenv('WORKER_ID') or socket.gethostname()
+        self.processing_key = redis_conn.key(f"message_queue:processing:{self.consumer}")
+        self.heartbeat_key = redis_conn.key(f"message_queue:consumer:{self.consumer}")
+        self._drainer: Optional[asyncio.Task] = None
+        self._draining = asyncio.Lock()
+        self._stopping = asyncio.Event()
 
-    async def record_message(self, update: Update):
+    async def start(self):
+        """启动后台批量写入与入库任务"""
+        self.buffer.start()
+        if self._drainer is None or self._drainer.done():
+            self._stopping.clear()
+            self._drainer = asyncio.create_task(self._drain_loop())
+
+    async def stop(self):
+        """关闭时写出缓冲区中的剩余消息并尽量入库"""
+        await self.buffer.stop()
+        if self._drainer is not None:
+            # 通知入库任务在当前块完成后退出，避免中途取消
+            self._stopping.set()
+            await self._drainer
+            self._drainer = None
+        try:
+            await self.drain()
+        except Exception as e:
+            # 未入库的消息保留在Redis中，下次启动继续处理
+            self.logger.error(f"关闭时消息入库失败: {e}")
+
+    async def record_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE = None):
         """记录用户消息"""
         try:
-            from src.monitoring.system_monitor import SystemMonitor
-            SystemMonitor.REQUEST_COUNT.inc()
-            
             user = update.effective_user
             chat_id = update.effective_chat.id
+            text = update.message.text if update.message else None
             
-            # Redis实时计数
-            redis_conn.zincrby(
-                f"chat:{chat_id}:activity",
-                1,
-                str(user.id)
-            )
-            
-            # 批量写入数据库
-            if self._should_flush():
-                self._flush_to_db()
+            # 仅入队，实际写入由缓冲区批量完成
+            await self.buffer.put({
+                'user_id': user.id,
+                'chat_id': chat_id,
+                # 入库去重键(重复投递时不会重复计入汇总)
+                'message_id': update.message.message_id if update.message else None,
+                'timestamp': datetime.now(),
+                'message_length': len(text) if isinstance(text, str) else 0
+            })
+            # 用户资料随批次一起写出，不在处理路径上访问Redis
+            self._profiles[user.id] = user
                 
         except Exception as e:
             self.logger.error(f"记录消息失败: {e}")
 
-    def _should_flush(self) -> bool:
-        """检查是否需要批量写入数据库"""
-        return redis_conn.llen("message_queue") > 100
+    async def _write_batch(self, messages: List[Dict]):
+        """写出一个批次: 一次Redis事务写入计数并追加到待入库队列"""
+        # 同一用户的多条消息合并为一次计数
+        counts = Counter((msg['chat_id'], msg['user_id']) for msg in messages)
+        day_counts = Counter(
+            (msg['chat_id'], msg['timestamp'].date(), msg['user_id']) for msg in messages
+        )
+        # 计数与入队在同一事务中，入库重试不会重复计数
+        async with redis_conn.pipeline(transaction=True) as pipe:
+            for (chat_id, user_id), count in counts.items():
+                pipe.zincrby(redis_conn.key(f"chat:{chat_id}:activity"), count, str(user_id))
+            for (chat_id, day, user_id), count in day_counts.items():
+                pipe.zincrby(_day_key(chat_id, day), count, str(user_id))
+            for chat_id, day in {(chat_id, day) for chat_id, day, _ in day_counts}:
+                pipe.expire(_day_key(chat_id, day), DAY_BUCKET_TTL)
+            pipe.rpush(MESSAGE_QUEUE_KEY, *[_encode_message(msg) for msg in messages])
+            await pipe.execute()
+        
+        # 顺带写出本批次见到的用户资料(未变化时不访问Redis，失败不影响计数)
+        users, self._profiles = self._profiles, {}
+        await profile_cache.remember_many(users.values())
+        
+        # 未启动入库任务时(脚本/测试)就地入库；失败时消息已在Redis中，
+        # 不能让缓冲区重试本批次(否则计数会重复)
+        if self._drainer is None:
+            try:
+                await self.drain()
+            except Exception as e:
+                self.logger.error(f"消息入库失败，保留在Redis队列中: {e}")
+
+    async def drain(self) -> int:
+        """将Redis队列中的消息全部入库，返回入库条数"""
+        total = 0
+        async with self._draining:
+            await redis_conn.set(self.heartbeat_key, 1, ex=CONSUMER_TTL)
+            # 先处理上次未确认的消息(进程崩溃或入库失败)
+            pending = await redis_conn.lrange(self.processing_key, 0, -1)
+            if pending:
+                MESSAGE_QUEUE_REDELIVERED.inc(len(pending))
+                total += await self._commit_chunk(pending)
+            while True:
+                chunk = await self._claim()
+                if not chunk:
+                    break
+                total += await self._commit_chunk(chunk)
+                await redis_conn.expire(self.heartbeat_key, CONSUMER_TTL)
+        return total
+
+    async def reclaim_stale(self) -> int:
+        """把心跳已过期的消费者(如重启后主机名变化的容器)的处理中列表放回队列头部"""
+        reclaimed = 0
+        prefix = redis_conn.key("message_queue:processing:")
+        async for key in redis_conn.scan_iter(match=prefix + "*"):
+            key = key.decode() if isinstance(key, bytes) else key
+            consumer = key[len(prefix):]
+            if key == self.processing_key or await redis_conn.exists(
+                redis_conn.key(f"message_queue:consumer:{consumer}")
+            ):
+                continue
+            # 逐条原子移动，多个实例同时回收也不会丢失或重复
+            moved = 0
+            while await redis_conn.lmove(key, MESSAGE_QUEUE_KEY, 'RIGHT', 'LEFT') is not None:
+                moved += 1
+            if moved:
+                self.logger.warning(f"回收消费者 {consumer} 未确认的{moved}条消息")
+            reclaimed += moved
+        if reclaimed:
+            MESSAGE_QUEUE_REDELIVERED.inc(reclaimed)
+        return reclaimed
 
-    def _flush_to_db(self):
+    async def _claim(self) -> List[bytes]:
+        """原子地从队列取出一块消息移入本消费者的处理中列表"""
+        size = min(await redis_conn.llen(MESSAGE_QUEUE_KEY), self.drain_chunk_size)
+        WRITE_BUFFER_DEPTH.labels(buffer='message_queue').set(size)
+        if size <= 0:
+            return []
+        async with redis_conn.pipeline(transaction=True) as pipe:
+            for _ in range(size):
+                pipe.lmove(MESSAGE_QUEUE_KEY, self.processing_key, 'LEFT', 'RIGHT')
+            moved = await pipe.execute()
+        return [raw for raw in moved if raw is not None]
+
+    async def _commit_chunk(self, chunk: List[bytes]) -> int:
+        """批量入库后确认(删除处理中列表)；失败时保留，等待重试"""
+        try:
+            await self._flush_to_db([_decode_message(raw) for raw in chunk])
+        except Exception:
+            WRITE_BUFFER_FAILURES.labels(buffer='message_queue').inc()
+            raise
+        await redis_conn.delete(self.processing_key)
+        WRITE_BUFFER_FLUSHED.labels(buffer='message_queue').inc(len(chunk))
+        return len(chunk)
+
+    async def _drain_loop(self):
+        """后台入库任务: 队列为空时按间隔轮询，失败后退避重试"""
+        delay = self.drain_poll_interval
+        next_reclaim = 0.0
+        loop = asyncio.get_running_loop()
+        while not self._stopping.is_set():
+            try:
+                if loop.time() >= next_reclaim:
+                    next_reclaim = loop.time() + CONSUMER_TTL
+                    await self.reclaim_stale()
+                drained = await self.drain()
+                delay = self.drain_poll_interval
+                if drained:
+                    continue
+            except Exception as e:
+                self.logger.error(f"消息入库失败，{delay}秒后重试: {e}")
+                delay = min(delay * 2, 60)
+            try:
+                await asyncio.wait_for(self._stopping.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _flush_to_db(self, messages: List[Dict]):
         """批量写入数据库"""
-        messages = []
-        while redis_conn.llen("message_queue") > 0:
-            msg_data = redis_conn.lpop("message_queue")
-            if msg_data:
-                messages.append(json.loads(msg_data))
+        if not messages:
+            return
         
-        if messages:
-            # 批量插入数据库
-            self.session.bulk_insert_mappings(MessageRecord, messages)
-            self.session.commit()
+        def insert(session: Session):
+            inserted = insert_new_records(session, messages)
+            # 同一事务内只按实际写入的消息增量更新小时/天汇总
+            for model, bucket_of in ROLLUPS:
+                upsert_rollup(session, model, rollup_rows(inserted, bucket_of))
+            session.commit()
+        
+        async with open_session(self.session) as session:
+            await run_in_session(session, insert)
+
+    async def get_leaderboard(self, chat_id: int, limit: int = 10, window: str = 'all') -> List[Dict]:
+        """获取活跃度排行榜
 
-    def get_leaderboard(self, chat_id: int, limit: int = 10) -> List[Dict]:
-        """获取活跃度排行榜"""
+        window 为 all(累计)、today、7d 或 30d；多日窗口由按天分桶的有序集合
+        ZUNIONSTORE 合并，结果短时缓存。
+        """
+        if window == 'all':
+            key = redis_conn.key(f"chat:{chat_id}:activity")
+        elif window in LEADERBOARD_WINDOWS:
+            key = await self._window_key(chat_id, window)
+        else:
+            raise ValueError(f"不支持的排行榜窗口: {window}")
+        
         # 从Redis获取实时排名
-        rankings = redis_conn.zrevrange(
-            f"chat:{chat_id}:activity",
-            0,
-            limit-1,
-            withscores=True
-        )
+        rankings = await redis_conn.zrevrange(key, 0, limit-1, withscores=True)
         
         return [
             {"user_id": int(uid.decode()), "count": int(count)}
             for uid, count in rankings
         ]
 
-    def generate_daily_report(self, chat_id: int):
+    async def _window_key(self, chat_id: int, window: str) -> str:
+        """返回窗口排行所在的键(必要时合并生成缓存)"""
+        today = date.today()
+        days = LEADERBOARD_WINDOWS[window]
+        if days == 1:
+            return _day_key(chat_id, today)
+        
+        key = redis_conn.key(f"chat:{chat_id}:activity:window:{window}")
+        if await redis_conn.exists(key):
+            return key
+        async with redis_conn.pipeline(transaction=True) as pipe:
+            pipe.zunionstore(key, [
+                _day_key(chat_id, today - timedelta(days=offset)) for offset in range(days)
+            ])
+            pipe.expire(key, int(os.getenv('LEADERBOARD_CACHE_TTL', '60')))
+            await pipe.execute()
+        return key
+
+    async def trim_activity(self, max_members: int, scan_count: int = 500) -> int:
+        """将各群活跃度有序集合裁剪为前max_members名，返回移除的成员数"""
+        removed = 0
+        keys = []
+        async for key in redis_conn.scan_iter(match=redis_conn.key("chat:*:activity"), count=scan_count):
+            keys.append(key)
+            if len(keys) >= scan_count:
+                removed += await self._trim_keys(keys, max_members)
+                keys = []
+        if keys:
+            removed += await self._trim_keys(keys, max_members)
+        return removed
+
+    async def _trim_keys(self, keys: List, max_members: int) -> int:
+        async with redis_conn.pipeline() as pipe:
+            for key in keys:
+                pipe.zremrangebyrank(key, 0, -(max_members + 1))
+            return sum(await pipe.execute())
+
+    async def iter_daily_reports(
+        self,
+        top_n: int = 10,
+        since: Optional[datetime] = None,
+        page_size: int = 500
+    ) -> AsyncIterator[List[Tuple[int, List[Tuple[int, int]]]]]:
+        """按群组分页生成所有群组的日报
+
+        每页一次查询取 page_size 个群组的前top_n名，完整读出并释放会话后
+        产出 [(chat_id, [(user_id, count), ...]), ...]；按chat_id翻页，
+        调用方发送期间不占用数据库连接和游标。
+        """
+        since = since or datetime.now() - timedelta(days=1)
+        after = None
+        while True:
+            statement = daily_top_users_statement(since, top_n, after=after, limit=page_size)
+            async with open_session(self.session) as session:
+                rows = await run_in_session(session, lambda s: s.execute(statement).all())
+            
+            page: List[Tuple[int, List[Tuple[int, int]]]] = []
+            for row in rows:
+                if not page or page[-1][0] != row.chat_id:
+                    page.append((row.chat_id, []))
+                page[-1][1].append((row.user_id, row.count))
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            after = page[-1][0]
+
+    async def generate_daily_report(self, chat_id: int):
         """生成每日报表"""
-        # 获取24小时数据
-        stats = self.session.query(
-            MessageRecord.user_id,
-            func.count(MessageRecord.id).label('count')
-        ).filter(
-            MessageRecord.chat_id == chat_id,
-            MessageRecord.timestamp >= datetime.now() - timedelta(days=1)
-        ).group_by(
-            MessageRecord.user_id
-        ).order_by(
-            func.count(MessageRecord.id).desc()
-        ).limit(10).all()
+        return await self.get_top_users(chat_id, datetime.now() - timedelta(days=1))
+
+    async def get_top_users(
+        self,
+        chat_id: int,
+        since: datetime,
+        until: Optional[datetime] = None,
+        limit: int = 10
+    ):
+        """任意时间窗口内的发言排行(读取汇总表)"""
+        model = rollup_for_window(since, until)
+        
+        def query(session: Session):
+            filters = [model.chat_id == chat_id, model.bucket >= model.bucket_of(since)]
+            if until is not None:
+                filters.append(model.bucket < model.bucket_of(until))
+            total = func.sum(model.message_count)
+            return session.query(
+                model.user_id,
+                total.label('count')
+            ).filter(
+                *filters
+            ).group_by(
+                model.user_id
+            ).order_by(
+                total.desc(),
+                model.user_id
+            ).limit(limit).all()
+        
+        async with open_session(self.session) as session:
+            return await run_in_session(session, query)
+
+    async def get_activity_trend(
+        self,
+        chat_id: int,
+        since: datetime,
+        granularity: str = 'hour'
+    ) -> List[Dict]:
+        """群组活跃度趋势(按小时或按天)"""
+        model = MessageRollupHourly if granularity == 'hour' else MessageRollupDaily
+        
+        def query(session: Session):
+            rows = session.query(
+                model.bucket,
+                func.sum(model.message_count),
+                func.sum(model.total_length)
+            ).filter(
+                model.chat_id == chat_id,
+                model.bucket >= model.bucket_of(since)
+            ).group_by(
+                model.bucket
+            ).order_by(
+                model.bucket
+            ).all()
+            return [
+                {'bucket': bucket, 'messages': int(count), 'total_length': int(length or 0)}
+                for bucket, count, length in rows
+            ]
         
-        return stats
+        async with open_session(self.session) as session:
+            return await run_in_session(session, query)
+
+def daily_top_users_statement(
+    since: datetime,
+    top_n: int,
+    after: Optional[int] = None,
+    limit: Optional[int] = None
+):
+    """各群组在since之后发言最多的前top_n名用户(按群组、名次排序，读取小时汇总)
+
+    after/limit 按chat_id分页：只取chat_id大于after的前limit个群组。
+    """
+    model = MessageRollupHourly
+    chats = select(model.chat_id).where(model.bucket >= model.bucket_of(since))
+    if after is not None:
+        chats = chats.where(model.chat_id > after)
+    chats = chats.group_by(model.chat_id).order_by(model.chat_id).limit(limit).subquery()
+    
+    counts = select(
+        model.chat_id,
+        model.user_id,
+        func.sum(model.message_count).label('count')
+    ).join(
+        chats, chats.c.chat_id == model.chat_id
+    ).where(
+        model.bucket >= model.bucket_of(since)
+    ).group_by(
+        model.chat_id,
+        model.user_id
+    ).subquery()
+    
+    ranked = select(
+        counts,
+        func.row_number().over(
+            partition_by=counts.c.chat_id,
+            order_by=(counts.c.count.desc(), counts.c.user_id)
+        ).label('rank')
+    ).subquery()
+    
+    return select(
+        ranked.c.chat_id,
+        ranked.c.user_id,
+        ranked.c.count
+    ).where(
+        ranked.c.rank <= top_n
+    ).order_by(
+        ranked.c.chat_id,
+        ranked.c.rank
+    )
 
 # 数据库模型
 class MessageRecord(Base):
     """消息记录表"""
     __tablename__ = 'message_stats'
+    __table_args__ = (
+        # 重复投递的消息不重复写入(旧数据message_id为NULL，不参与去重)
+        Index('uq_message_stats_chat_message', 'chat_id', 'message_id', unique=True),
+        # 查询已改读汇总表，原始记录只需按时间清理过期数据
+        Index('ix_message_stats_timestamp', 'timestamp'),
+        # 旧版本的查询索引，只增加写入开销，启动时删除
+        {'info': {'obsolete_indexes': ('ix_message_stats_chat_ts', 'ix_message_stats_ts_chat_user')}},
+    )
     
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, nullable=False)
-    chat_id = Column(Integer, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    message_id = Column(BigInteger)
     timestamp = Column(DateTime, default=datetime.now)
-    message_length = Column(Integer)
\ No newline at end of file
+    message_length = Column(Integer)
+
+class MessageRollupHourly(Base):
+    """消息小时汇总表(每个群每个用户每小时一行)"""
+    __tablename__ = 'message_rollups_hourly'
+    __table_args__ = (
+        Index('ix_message_rollups_hourly_bucket', 'bucket'),
+    )
+    
+    chat_id = Column(BigInteger, primary_key=True)
+    bucket = Column(DateTime, primary_key=True)  # 整点时间
+    user_id = Column(BigInteger, primary_key=True)
+    message_count = Column(Integer, nullable=False, default=0)
+    total_length = Column(Integer, nullable=False, default=0)
+    
+    @staticmethod
+    def bucket_of(timestamp: datetime) -> datetime:
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+
+class MessageRollupDaily(Base):
+    """消息天汇总表(每个群每个用户每天一行)"""
+    __tablename__ = 'message_rollups_daily'
+    __table_args__ = (
+        Index('ix_message_rollups_daily_bucket', 'bucket'),
+    )
+    
+    chat_id = Column(BigInteger, primary_key=True)
+    bucket = Column(Date, primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
+    message_count = Column(Integer, nullable=False, default=0)
+    total_length = Column(Integer, nullable=False, default=0)
+    
+    @staticmethod
+    def bucket_of(timestamp: datetime) -> date:
+        return timestamp.date() if isinstance(timestamp, datetime) else timestamp
+
+# (汇总表, 时间桶函数)
+ROLLUPS = (
+    (MessageRollupHourly, MessageRollupHourly.bucket_of),
+    (MessageRollupDaily, MessageRollupDaily.bucket_of),
+)
+
+# 超过该跨度的窗口读取天汇总表
+HOURLY_WINDOW_LIMIT = timedelta(days=7)
+
+def rollup_for_window(since: datetime, until: Optional[datetime] = None):
+    """按窗口跨度选择汇总粒度"""
+    span = (until or datetime.now()) - since
+    return MessageRollupHourly if span <= HOURLY_WINDOW_LIMIT else MessageRollupDaily
+
+def rollup_rows(messages: List[Dict], bucket_of) -> List[Dict]:
+    """将一批消息按(群, 时间桶, 用户)合并"""
+    totals: Dict[Tuple, List[int]] = {}
+    for msg in messages:
+        key = (msg['chat_id'], bucket_of(msg['timestamp']), msg['user_id'])
+        entry = totals.setdefault(key, [0, 0])
+        entry[0] += 1
+        entry[1] += msg.get('message_length') or 0
+    return [
+        {
+            'chat_id': chat_id,
+            'bucket': bucket,
+            'user_id': user_id,
+            'message_count': count,
+            'total_length': length
+        }
+        for (chat_id, bucket, user_id), (count, length) in totals.items()
+    ]
+
+def insert_new_records(session: Session, messages: List[Dict]) -> List[Dict]:
+    """写入原始消息(按群组+消息ID去重)，返回实际写入的消息"""
+    table = MessageRecord.__table__
+    statement = upsert_insert(session, table).on_conflict_do_nothing(
+        index_elements=['chat_id', 'message_id']
+    ).returning(
+        table.c.chat_id, table.c.user_id, table.c.timestamp, table.c.message_length
+    )
+    rows = [
+        {
+            'user_id': msg['user_id'],
+            'chat_id': msg['chat_id'],
+            'message_id': msg.get('message_id'),
+            'timestamp': msg['timestamp'],
+            'message_length': msg.get('message_length')
+        }
+        for msg in messages
+    ]
+    return [row._asdict() for row in session.execute(statement, rows)]
+
+def upsert_rollup(session: Session, model, rows: List[Dict]):
+    """累加写入汇总行(ON CONFLICT DO UPDATE)"""
+    if not rows:
+        return
+    statement = upsert_insert(session, model.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=['chat_id', 'bucket', 'user_id'],
+        set_={
+            'message_count': model.__table__.c.message_count + statement.excluded.message_count,
+            'total_length': model.__table__.c.total_length + statement.excluded.total_length
+        }
+    )
+    session.execute(statement, rows)
+
+def backfill_message_rollups(session: Session, chunk_size: int = 10000) -> int:
+    """根据原始消息记录重建汇总表，返回处理的消息数
+
+    原始记录只保留有限天数，天汇总永久保留；只重建最早一条原始记录
+    所在时间桶及之后的汇总，更早的历史汇总不受影响。
+    """
+    earliest = session.query(func.min(MessageRecord.timestamp)).scalar()
+    if earliest is None:
+        return 0
+    for model, bucket_of in ROLLUPS:
+        session.query(model).filter(model.bucket >= bucket_of(earliest)).delete()
+    
+    processed = 0
+    last_id = 0
+    while True:
+        rows = session.query(
+            MessageRecord.id,
+            MessageRecord.chat_id,
+            MessageRecord.user_id,
+            MessageRecord.timestamp,
+            MessageRecord.message_length
+        ).filter(
+            MessageRecord.id > last_id
+        ).order_by(
+            MessageRecord.id
+        ).limit(chunk_size).all()
+        if not rows:
+            break
+        messages = [row._asdict() for row in rows]
+        for model, bucket_of in ROLLUPS:
+            upsert_rollup(session, model, rollup_rows(messages, bucket_of))
+        processed += len(rows)
+        last_id = rows[-1].id
+    
+    session.commit()
+    return processed
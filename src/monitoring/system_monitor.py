@@ -6,6 +6,7 @@ from threading import Thread
 from prometheus_client import start_http_server, Gauge, Counter
 from telegram import Bot
 from datetime import datetime
+from src.outbox import outbox, PRIORITY_BULK
 
 class SystemMonitor:
     """系统监控核心类"""
@@ -13,7 +14,6 @@ class SystemMonitor:
     # 定义监控指标
     CPU_USAGE = Gauge('cpu_usage', 'CPU使用率百分比')
     MEMORY_USAGE = Gauge('memory_usage', '内存使用率百分比')
-    REQUEST_COUNT = Counter('http_requests_total', 'HTTP请求总数')
     ERROR_COUNT = Counter('errors_total', '系统错误总数')
 
     def __init__(self, telegram_token: str):
@@ -29,9 +29,12 @@ class SystemMonitor:
 
     def start(self):
         """启动监控系统"""
-        # 启动Prometheus指标服务器
-        start_http_server(self.prometheus_port)
-        self.logger.info(f"Prometheus指标服务器启动在 {self.prometheus_port} 端口")
+        # 启动Prometheus指标服务器(多进程模式下由主进程统一输出)
+        if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+            self.logger.info("Prometheus多进程模式，指标由主进程汇总输出")
+        else:
+            start_http_server(self.prometheus_port)
+            self.logger.info(f"Prometheus指标服务器启动在 {self.prometheus_port} 端口")
         
         # 启动监控线程
         self._running = True
@@ -104,10 +107,12 @@ class SystemMonitor:
                 self.logger.error(f"发送报警失败: {e}")
 
     def _send_telegram_alert(self, chat_id: str, message: str):
-        """发送Telegram报警"""
-        self.bot.send_message(
-            chat_id=chat_id,
-            text=f"🚨 系统报警\n{message}\n时间: {datetime.now()}"
+        """发送Telegram报警(监控线程中调用，经发送队列排在命令回复之后)"""
+        outbox.send_threadsafe(
+            self.bot,
+            chat_id,
+            f"🚨 系统报警\n{message}\n时间: {datetime.now()}",
+            priority=PRIORITY_BULK
         )
 
     def _send_email_alert(self, recipient: str, message: str, severity: str):
@@ -0,0 +1,355 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from telegram import Bot, Message, ReplyParameters
+from telegram.constants import ChatType
+from telegram.error import RetryAfter
+
+from src.utils.metrics import OUTBOX_PENDING, OUTBOX_SENT, OUTBOX_WAIT, OUTBOX_RETRY_AFTER
+from src.utils.rate_limit import ChatRateLimiter, retry_after_seconds
+
+# 发送优先级(数值越小越先发送)
+PRIORITY_INTERACTIVE = 0  # 命令回复
+PRIORITY_NORMAL = 1       # 欢迎语、管理通知
+PRIORITY_BULK = 2         # 日报、系统报警
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_NORMAL: 'normal',
+    PRIORITY_BULK: 'bulk'
+}
+
+# Telegram单条消息的最大长度
+MAX_MESSAGE_LENGTH = 4096
+
+# 合并消息之间的分隔
+MERGE_SEPARATOR = '\n\n'
+
+
+class OutboundMessage:
+    """待发送的消息"""
+
+    __slots__ = ('bot', 'chat_id', 'text', 'kwargs', 'priority', 'merge', 'future', 'seq',
+                 'enqueued_at', 'attempts')
+
+    def __init__(self, bot, chat_id, text, kwargs, priority, merge, future, seq):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.priority = priority
+        self.merge = merge
+        self.future = future
+        self.seq = seq
+        self.enqueued_at = time.perf_counter()
+        self.attempts = 0
+
+    def can_merge(self, other: 'OutboundMessage') -> bool:
+        """同一优先级、相同发送参数(含引用的消息)且不带按钮的文本消息可以合并"""
+        return (
+            self.merge and other.merge
+            and self.bot is other.bot
+            and self.priority == other.priority
+            and self.kwargs == other.kwargs
+            and 'reply_markup' not in self.kwargs
+        )
+
+
+class _ChatQueue:
+    """单个聊天的待发送消息(按优先级、入队顺序排列)"""
+
+    __slots__ = ('messages', 'busy')
+
+    def __init__(self):
+        self.messages: List[tuple] = []
+        # 发送中或等待限速时为True，同一聊天同时只发送一条
+        self.busy = False
+
+
+class Outbox:
+    """统一的消息发送队列
+
+    所有模块经此发送消息: 按Telegram全局与单聊天限速(令牌桶)放行，
+    命令回复优先于欢迎语，欢迎语优先于日报和报警；同一聊天排队中的
+    文本消息合并为一条发送；收到RetryAfter时暂停该聊天并自动重试。
+    未启动时(脚本/测试)直接调用Bot API。
+    """
+
+    def __init__(
+        self,
+        limiter: Optional[ChatRateLimiter] = None,
+        max_retries: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        drain_timeout: float = 10.0
+    ):
+        self.limiter = limiter or ChatRateLimiter()
+        self.max_retries = max_retries if max_retries is not None else int(
+            os.getenv('OUTBOX_MAX_RETRIES', '5')
+        )
+        self.concurrency = concurrency or int(os.getenv('OUTBOX_CONCURRENCY', '10'))
+        self.drain_timeout = drain_timeout
+        self._chats: Dict[Any, _ChatQueue] = {}
+        self._ready: List[tuple] = []
+        self._delayed: List[tuple] = []
+        self._seq = itertools.count()
+        self._pending = {priority: 0 for priority in PRIORITY_NAMES}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._deliveries = set()
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping = False
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done() and not self._stopping
+
+    def start(self):
+        """启动发送任务，需在事件循环内调用"""
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._stopping = False
+        self._task = asyncio.create_task(self._run(), name='outbox')
+
+    async def stop(self):
+        """停止接收新消息，在drain_timeout内发完已排队的消息"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), self.drain_timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            self.logger.warning("发送队列关闭超时，丢弃未发送的消息")
+        if self._deliveries:
+            await asyncio.wait(list(self._deliveries), timeout=self.drain_timeout)
+        self._fail_pending(RuntimeError("发送队列已关闭"))
+        self._task = None
+        self._loop = None
+
+    async def send_message(
+        self,
+        bot: Bot,
+        chat_id,
+        text: str,
+        priority: int = PRIORITY_NORMAL,
+        merge: bool = True,
+        **kwargs
+    ) -> Message:
+        """发送消息，返回发出的Message(合并发送时多条消息得到同一Message)
+
+        需要编辑返回消息的调用方应传 merge=False。
+        """
+        if not self.running:
+            return await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+        future = asyncio.get_running_loop().create_future()
+        self._submit(OutboundMessage(
+            bot, chat_id, text, kwargs, priority, merge, future, next(self._seq)
+        ))
+        return await future
+
+    async def reply(
+        self,
+        message: Message,
+        text: str,
+        priority: int = PRIORITY_INTERACTIVE,
+        merge: bool = True,
+        **kwargs
+    ) -> Message:
+        """回复消息所在的聊天(话题群中发到同一话题)
+
+        与 reply_text 一致，群组中默认引用被回复的消息(do_quote=False关闭)；
+        引用不同消息的回复带有不同的reply_parameters，不会被合并。
+        """
+        if not self.running:
+            return await message.reply_text(text, **kwargs)
+        do_quote = kwargs.pop('do_quote', None)
+        if do_quote is None:
+            do_quote = message.chat.type != ChatType.PRIVATE
+        if do_quote and 'reply_parameters' not in kwargs and 'reply_to_message_id' not in kwargs:
+            kwargs['reply_parameters'] = ReplyParameters(message.message_id)
+        if message.is_topic_message and message.message_thread_id:
+            kwargs.setdefault('message_thread_id', message.message_thread_id)
+        return await self.send_message(
+            message.get_bot(), message.chat_id, text, priority, merge, **kwargs
+        )
+
+    def send_threadsafe(self, bot: Bot, chat_id, text: str, priority: int = PRIORITY_BULK, **kwargs):
+        """从其他线程发送消息(不等待结果)"""
+        loop = self._loop
+        if self.running and loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._submit_detached, bot, chat_id, text, priority, kwargs)
+            return
+        result = bot.send_message(chat_id=chat_id, text=text, **kwargs)
+        if asyncio.iscoroutine(result):
+            asyncio.run(result)
+
+    def _submit_detached(self, bot, chat_id, text, priority, kwargs):
+        """不等待结果的消息，发送失败时记录日志"""
+        future = self._loop.create_future()
+        future.add_done_callback(self._log_detached_failure)
+        self._submit(OutboundMessage(
+            bot, chat_id, text, kwargs, priority, True, future, next(self._seq)
+        ))
+
+    def _log_detached_failure(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            self.logger.error(f"消息发送失败: {future.exception()}")
+
+    def _submit(self, message: OutboundMessage):
+        chat = self._chats.get(message.chat_id)
+        if chat is None:
+            chat = self._chats[message.chat_id] = _ChatQueue()
+        heapq.heappush(chat.messages, (message.priority, message.seq, message))
+        if not chat.busy:
+            heapq.heappush(self._ready, (message.priority, message.seq, message.chat_id))
+        self._set_pending(message.priority, 1)
+        self._wakeup.set()
+
+    def _set_pending(self, priority: int, delta: int):
+        self._pending[priority] = self._pending.get(priority, 0) + delta
+        OUTBOX_PENDING.labels(priority=PRIORITY_NAMES.get(priority, str(priority))).set(
+            self._pending[priority]
+        )
+
+    def _schedule(self, chat_id, chat: _ChatQueue):
+        """聊天空闲后按队首消息重新排入就绪队列"""
+        if chat.messages:
+            priority, seq, _ = chat.messages[0]
+            heapq.heappush(self._ready, (priority, seq, chat_id))
+        else:
+            del self._chats[chat_id]
+
+    async def _run(self):
+        """调度主循环: 挑选优先级最高且未被限速的聊天发送"""
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, chat_id = heapq.heappop(self._delayed)
+                chat = self._chats[chat_id]
+                chat.busy = False
+                self._schedule(chat_id, chat)
+
+            if not self._ready:
+                if self._stopping and not self._chats:
+                    return
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, seq, chat_id = heapq.heappop(self._ready)
+            chat = self._chats.get(chat_id)
+            # 跳过过期条目(聊天正在发送，或队首已变化)
+            if chat is None or chat.busy or not chat.messages or chat.messages[0][1] != seq:
+                continue
+
+            chat.busy = True
+            delay = self.limiter.chat_bucket(chat_id).try_acquire()
+            if delay > 0:
+                heapq.heappush(self._delayed, (now + delay, seq, chat_id))
+                continue
+
+            await self.limiter.global_bucket.acquire()
+            await self._slots.acquire()
+            batch = self._take(chat)
+            if not batch:
+                self._slots.release()
+                chat.busy = False
+                self._schedule(chat_id, chat)
+                continue
+            task = asyncio.create_task(self._deliver(chat_id, chat, batch))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+    def _take(self, chat: _ChatQueue) -> List[OutboundMessage]:
+        """取出队首消息及其后可合并的消息"""
+        batch = []
+        length = 0
+        while chat.messages:
+            message = chat.messages[0][2]
+            if message.future.done():
+                # 调用方已取消
+                heapq.heappop(chat.messages)
+                self._set_pending(message.priority, -1)
+                continue
+            if batch and not (
+                batch[0].can_merge(message)
+                and length + len(MERGE_SEPARATOR) + len(message.text) <= MAX_MESSAGE_LENGTH
+            ):
+                break
+            heapq.heappop(chat.messages)
+            length += (len(MERGE_SEPARATOR) if batch else 0) + len(message.text)
+            batch.append(message)
+        return batch
+
+    async def _deliver(self, chat_id, chat: _ChatQueue, batch: List[OutboundMessage]):
+        """发送一批(合并后的)消息"""
+        head = batch[0]
+        priority = PRIORITY_NAMES.get(head.priority, str(head.priority))
+        try:
+            result = await head.bot.send_message(
+                chat_id=chat_id,
+                text=MERGE_SEPARATOR.join(message.text for message in batch),
+                **head.kwargs
+            )
+        except RetryAfter as e:
+            OUTBOX_RETRY_AFTER.inc()
+            self.limiter.retry_after(chat_id, retry_after_seconds(e))
+            for message in batch:
+                message.attempts += 1
+                if message.attempts > self.max_retries:
+                    self._finish(message, priority, 'failed', error=e)
+                else:
+                    # 保留原序号，重试时仍在队首
+                    heapq.heappush(chat.messages, (message.priority, message.seq, message))
+        except Exception as e:
+            self.logger.error(f"向 {chat_id} 发送消息失败: {e}")
+            for message in batch:
+                self._finish(message, priority, 'failed', error=e)
+        else:
+            for index, message in enumerate(batch):
+                self._finish(message, priority, 'merged' if index else 'sent', result=result)
+        finally:
+            self._slots.release()
+            chat.busy = False
+            self._schedule(chat_id, chat)
+            self._wakeup.set()
+
+    def _finish(self, message: OutboundMessage, priority: str, outcome: str, result=None, error=None):
+        self._set_pending(message.priority, -1)
+        OUTBOX_SENT.labels(priority=priority, result=outcome).inc()
+        if outcome != 'failed':
+            OUTBOX_WAIT.labels(priority=priority).observe(time.perf_counter() - message.enqueued_at)
+        if message.future.done():
+            return
+        if error is not None:
+            message.future.set_exception(error)
+        else:
+            message.future.set_result(result)
+
+    def _fail_pending(self, error: Exception):
+        """关闭时让仍在排队的调用方收到异常"""
+        for chat in self._chats.values():
+            for _, _, message in chat.messages:
+                self._finish(message, PRIORITY_NAMES.get(message.priority, ''), 'failed', error=error)
+        self._chats.clear()
+        self._ready.clear()
+        self._delayed.clear()
+
+
+# 全局共享实例
+outbox = Outbox()
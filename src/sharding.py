@@ -0,0 +1,142 @@
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import os
+import socket
+from typing import Iterable, List, Optional
+
+from telegram import Bot, Update
+
+from src.utils.metrics import SHARD_FORWARDED, WEBHOOK_QUEUE_DEPTH
+from src.utils.redis_client import redis_manager
+
+# Redis连接(共享连接池，shards命名空间)
+redis_conn = redis_manager.namespace('shards')
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """一致性哈希环
+
+    每个节点在环上放置 replicas 个虚拟节点，节点增减时只有约 1/N 的键改变归属。
+    """
+
+    def __init__(self, nodes: Iterable[str], replicas: int = 100):
+        self.replicas = replicas
+        self._hashes: List[int] = []
+        self._nodes: List[str] = []
+        points = sorted(
+            (_hash(f"{node}#{i}"), node)
+            for node in nodes
+            for i in range(replicas)
+        )
+        for point, node in points:
+            self._hashes.append(point)
+            self._nodes.append(node)
+
+    def node_for(self, key) -> str:
+        """键所属的节点"""
+        if not self._nodes:
+            raise ValueError("哈希环为空")
+        index = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._nodes[index]
+
+
+def routing_key(update: Update) -> int:
+    """更新的分片键: 优先群组，其次用户(私聊之外的内联查询等)"""
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return update.update_id
+
+
+class ShardRouter:
+    """按群组把更新路由到所属工作进程
+
+    群组经一致性哈希固定到某个工作进程，同一群组的状态(防抖、缓存、顺序)
+    只在一个进程中处理。收到其他分片的更新时写入对方的Redis收件箱，
+    各进程从自己的收件箱取出更新放入本地分发队列。
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        update_queue: asyncio.Queue,
+        index: Optional[int] = None,
+        count: Optional[int] = None,
+        group: Optional[str] = None
+    ):
+        self.bot = bot
+        self.update_queue = update_queue
+        self.index = index if index is not None else int(os.getenv('WORKER_INDEX', '0'))
+        self.count = count or int(os.getenv('WORKER_COUNT', '1'))
+        # 同一台机器上的一组工作进程共享收件箱前缀
+        self.group = group or os.getenv('WORKER_GROUP') or socket.gethostname()
+        self.ring = HashRing(str(i) for i in range(self.count))
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self.logger = logging.getLogger(__name__)
+
+    def inbox_key(self, shard: int) -> str:
+        return redis_conn.key(f"inbox:{self.group}:{shard}")
+
+    def shard_for(self, chat_id: int) -> int:
+        """群组所属的分片序号"""
+        return int(self.ring.node_for(chat_id))
+
+    def owns(self, chat_id: int) -> bool:
+        return self.shard_for(chat_id) == self.index
+
+    async def dispatch(self, update: Update):
+        """本分片的更新直接入队(队列满时抛出QueueFull)，其他分片的更新转发"""
+        shard = self.shard_for(routing_key(update))
+        if shard == self.index:
+            self.update_queue.put_nowait(update)
+            return
+        await redis_conn.rpush(self.inbox_key(shard), json.dumps(update.to_dict()))
+        SHARD_FORWARDED.labels(shard=str(shard)).inc()
+
+    def start(self):
+        """启动收件箱消费任务，需在事件循环内调用"""
+        if self.count > 1 and (self._task is None or self._task.done()):
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._consume())
+
+    async def stop(self):
+        """停止消费收件箱(未取出的更新保留在Redis中)"""
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+
+    async def _consume(self):
+        """从本分片收件箱取出转发来的更新(本地队列满时等待，形成背压)"""
+        inbox = self.inbox_key(self.index)
+        delay = 1.0
+        while not self._stopping.is_set():
+            try:
+                item = await redis_conn.blpop([inbox], timeout=1)
+                delay = 1.0
+            except Exception as e:
+                self.logger.error(f"读取分片收件箱失败: {e}")
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * 2, 30)
+                continue
+            if item is None:
+                continue
+            try:
+                update = Update.de_json(json.loads(item[1]), self.bot)
+            except (ValueError, TypeError, KeyError) as e:
+                self.logger.warning(f"无法解析转发的更新: {e}")
+                continue
+            await self.update_queue.put(update)
+            WEBHOOK_QUEUE_DEPTH.set(self.update_queue.qsize())
@@ -1,40 +1,129 @@
 import asyncio
+import functools
 import logging
+import os
+import time as _time
 from datetime import time, datetime, timedelta
-from typing import Callable, Dict, Any
+from typing import Callable, Dict, List, Optional, Tuple
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.executors.asyncio import AsyncIOExecutor
 from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.events import (
+    EVENT_JOB_SUBMITTED,
+    EVENT_JOB_MISSED,
+    EVENT_JOB_MAX_INSTANCES
+)
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
 from telegram.ext import Application
-from src.utils.metrics import TaskMetrics
+from src.utils.metrics import TaskMetrics, TASK_START_DELAY, TASK_SKIPPED
+from src.utils.metrics import RETENTION_ROWS_DELETED, RETENTION_DURATION
+from src.utils.leader import LeaderElection
+from src.outbox import outbox, PRIORITY_BULK
+from src.user_profiles import profile_cache
+from src.utils.rate_limit import retry_after_seconds
+from src.utils.retention import RetentionPolicy, RetentionEngine
+
+def _retention_days(name: str, default: int) -> Optional[timedelta]:
+    """读取保留天数配置，0表示永久保留"""
+    days = int(os.getenv(name, str(default)))
+    return timedelta(days=days) if days > 0 else None
+
+def default_retention_policies():
+    """各表默认保留策略(天数可通过环境变量调整)"""
+    from src.checkin import UserCheckIn
+    from src.member_management import AdminAction
+    from src.message_stats import MessageRecord, MessageRollupHourly, MessageRollupDaily
+    return [
+        RetentionPolicy(MessageRecord, 'timestamp', _retention_days('RETENTION_MESSAGE_DAYS', 30)),
+        RetentionPolicy(
+            MessageRollupHourly, 'bucket',
+            _retention_days('RETENTION_HOURLY_ROLLUP_DAYS', 90)
+        ),
+        RetentionPolicy(
+            MessageRollupDaily, 'bucket',
+            _retention_days('RETENTION_DAILY_ROLLUP_DAYS', 0),
+            time_step=timedelta(days=30)
+        ),
+        RetentionPolicy(UserCheckIn, 'checkin_date', _retention_days('RETENTION_CHECKIN_DAYS', 0)),
+        RetentionPolicy(AdminAction, 'timestamp', _retention_days('RETENTION_ADMIN_ACTION_DAYS', 180))
+    ]
+
+async def format_report(report: List[Tuple[int, int]]) -> str:
+    """日报文本: 每行一名用户(显示名取自用户资料缓存)"""
+    names = await profile_cache.display_names(user_id for user_id, _ in report)
+    lines = ["📊 今日发言排行:"]
+    for i, (user_id, count) in enumerate(report, 1):
+        lines.append(f"{i}. {names[user_id]}: {count}条")
+    return "\n".join(lines)
 
 class TaskScheduler:
-    """定时任务调度系统"""
+    """定时任务调度系统
+
+    async_mode(默认开启，SCHEDULER_ASYNC=0 关闭)使用 AsyncIOScheduler，
+    协程任务直接在 Application 的事件循环中执行，与机器人共享Redis/数据库连接池；
+    关闭时使用 BackgroundScheduler 在线程池中执行任务，默认任务(协程)
+    经 run_coroutine_threadsafe 提交回 Application 的事件循环运行。
+    两种模式都需在事件循环内(post_init)调用 start()。
+    每个任务通过 max_instances 限制并发，默认任务同一时刻只运行一个实例。
+    多实例部署时传入 leader，默认任务只在集群领导者上执行。
+    """
     
-    def __init__(self, application: Application):
+    def __init__(
+        self,
+        application: Application,
+        session_factory=None,
+        async_mode: Optional[bool] = None,
+        leader: Optional[LeaderElection] = None
+    ):
         # 初始化监控
         self.metrics = TaskMetrics()
         self.application = application
+        # 数据库会话工厂(同步/异步均可)
+        self.session_factory = session_factory or getattr(application, 'session', None)
         self.logger = logging.getLogger(__name__)
         
+        if async_mode is None:
+            async_mode = os.getenv('SCHEDULER_ASYNC', '1') == '1'
+        self.async_mode = async_mode
+        self.leader = leader
+        # Application的事件循环(start()时记录)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        
+        # 日报并发与重试(发送限速由发送队列负责)
+        self.report_concurrency = int(os.getenv('REPORT_CONCURRENCY', '10'))
+        self.report_max_retries = 3
+        
         # 配置任务存储
+        # 默认任务是绑定方法，无法序列化，放在内存存储中(每次启动重新注册)
         jobstores = {
             'default': SQLAlchemyJobStore(
                 url='sqlite:///../db/scheduled_jobs.db',
                 tablename='scheduled_tasks'
-            )
+            ),
+            'memory': MemoryJobStore()
         }
         
-        # 配置执行器
-        executors = {
-            'default': ThreadPoolExecutor(5)
-        }
+        # 配置执行器并创建调度器
+        if async_mode:
+            self.scheduler = AsyncIOScheduler(
+                jobstores=jobstores,
+                executors={'default': AsyncIOExecutor()},
+                timezone='Asia/Shanghai'
+            )
+        else:
+            self.scheduler = BackgroundScheduler(
+                jobstores=jobstores,
+                executors={'default': ThreadPoolExecutor(5)},
+                timezone='Asia/Shanghai'
+            )
         
-        # 创建调度器
-        self.scheduler = BackgroundScheduler(
-            jobstores=jobstores,
-            executors=executors,
-            timezone='Asia/Shanghai'
+        # 调度延迟与跳过次数
+        self.scheduler.add_listener(
+            self._on_job_event,
+            EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES
         )
         
         # 注册默认任务
@@ -44,81 +133,144 @@ class TaskScheduler:
         """注册系统默认任务"""
         # 每日统计报表
         self.scheduler.add_job(
-            self._generate_daily_report,
+            self._leader_only('daily_report', self._generate_daily_report),
             'cron',
             hour=23,
             minute=59,
-            id='daily_report'
+            id='daily_report',
+            jobstore='memory',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
         )
         
         # 每周数据清理
         self.scheduler.add_job(
-            self._cleanup_old_data,
+            self._leader_only('weekly_cleanup', self._cleanup_old_data),
             'cron',
             day_of_week='sun',
             hour=2,
-            id='weekly_cleanup'
+            id='weekly_cleanup',
+            jobstore='memory',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
         )
 
-    async def _generate_daily_report(self, retry_count=0):
+    def _leader_only(self, job_id: str, func: Callable):
+        """包装为只在领导者实例上执行的任务(未配置leader时总是执行)"""
+        @functools.wraps(func)
+        async def run():
+            if self.leader is not None and not self.leader.is_leader:
+                TASK_SKIPPED.labels(job_id=job_id, reason='not_leader').inc()
+                self.logger.info(f"非领导者实例，跳过任务 {job_id}")
+                return None
+            return await func()
+        if self.async_mode:
+            return run
+        return self._in_loop(run)
+
+    def _in_loop(self, func: Callable):
+        """同步模式: 线程池中的任务把协程提交到Application的事件循环并等待完成"""
+        @functools.wraps(func)
+        def run():
+            if self.loop is None or self.loop.is_closed():
+                raise RuntimeError("调度器未在事件循环内启动")
+            return asyncio.run_coroutine_threadsafe(func(), self.loop).result()
+        return run
+
+    def _on_job_event(self, event):
+        """记录任务从计划时间到提交执行的延迟，以及被跳过的情况"""
+        if event.code == EVENT_JOB_SUBMITTED:
+            now = datetime.now(self.scheduler.timezone)
+            for run_time in event.scheduled_run_times:
+                TASK_START_DELAY.labels(job_id=event.job_id).observe(
+                    max((now - run_time).total_seconds(), 0)
+                )
+        elif event.code == EVENT_JOB_MISSED:
+            TASK_SKIPPED.labels(job_id=event.job_id, reason='missed').inc()
+        else:
+            TASK_SKIPPED.labels(job_id=event.job_id, reason='max_instances').inc()
+
+    async def _generate_daily_report(self):
         """生成每日统计报表
-        Args:
-            retry_count: 当前重试次数
+
+        按页读取各群组的日报(每页读完即释放数据库连接)，并发发送
+        (上限 report_concurrency)，每个群组独立重试，单个群组失败不影响
+        其他群组。只累计成功/失败数，内存占用不随群组数增长。
         """
         with self.metrics.track_task('daily_report'):
-            self.logger.info(f"开始生成日报(重试次数:{retry_count})")
-            self.metrics.task_retries.labels(
-                task_name='daily_report'
-            ).inc()
-        
-        try:
-            # 获取消息统计
-            from src.message_stats import MessageStats
-            stats = MessageStats(self.application.session)
-
-            # 获取所有活跃群组
-            active_chats = self._get_active_chats()
-            if not active_chats:
+            self.logger.info("开始生成日报")
+            
+            semaphore = asyncio.Semaphore(self.report_concurrency)
+            sent = failed = 0
+            
+            async def report(chat_id, data):
+                async with semaphore:
+                    return await self._report_chat(chat_id, data)
+            
+            async for page in self._iter_reports():
+                results = await asyncio.gather(*(report(chat_id, data) for chat_id, data in page))
+                failed += results.count(False)
+                sent += len(results)
+            
+            if not sent:
                 self.logger.warning("没有活跃群组需要生成报表")
                 return
+            
+            self.logger.info(f"日报发送完成: 成功{sent - failed}个群组，失败{failed}个")
 
-            # 强制触发重试测试
-            if retry_count == 0:
-                raise Exception("模拟首次失败")
+    def _iter_reports(self):
+        """按页产出各群组的日报数据"""
+        from src.message_stats import MessageStats
+        return MessageStats(self.session_factory).iter_daily_reports()
 
-            for chat_id in active_chats:
-                report = stats.generate_daily_report(chat_id)
-                await self._send_report(chat_id, report)
+    async def _report_chat(self, chat_id: int, report) -> bool:
+        """发送单个群组的日报
 
-        except Exception as e:
-            self.logger.error(f"生成日报失败: {e}")
-            
-            if retry_count <= 3:  # 0(首次)+3次重试
-                wait_time = min(2 ** retry_count * 5, 60)  # 最大60秒
-                self.logger.info(f"将在{wait_time}秒后重试(第{retry_count+1}次尝试)...")
+        网络错误指数退避重试，RetryAfter按要求等待后重试；机器人被移出、
+        群组不存在等永久错误(Forbidden/BadRequest)及其他异常不重试，
+        避免失效群组在每次日报中占用并发名额。
+        """
+        for attempt in range(self.report_max_retries + 1):
+            try:
+                await self._send_report(chat_id, report)
+                return True
+            except (Forbidden, BadRequest) as e:
+                self._log_task_failure("daily_report", f"群组 {chat_id} 无法发送: {e}")
+                return False
+            except Exception as e:
+                self.logger.error(f"群组 {chat_id} 日报失败(第{attempt + 1}次): {e}")
+                if not isinstance(e, (RetryAfter, NetworkError)) or attempt >= self.report_max_retries:
+                    break
+                self.metrics.task_retries.labels(task_name='daily_report').inc()
+                if isinstance(e, RetryAfter):
+                    wait_time = retry_after_seconds(e)
+                else:
+                    wait_time = min(2 ** attempt * 5, 60)  # 最大60秒
                 await asyncio.sleep(wait_time)
-                return await self._generate_daily_report(retry_count + 1)
-            
-            self._log_task_failure("daily_report", str(e))
+        
+        self._log_task_failure("daily_report", f"群组 {chat_id} 发送失败")
+        return False
 
     def _log_task_failure(self, task_name: str, error: str):
         """记录任务失败日志"""
         self.logger.error(f"任务失败 - {task_name}: {error}")
         # 可以扩展为写入数据库或发送通知
 
-    def _get_active_chats(self) -> list:
-        """获取活跃群组列表"""
-        # 简单实现: 返回空列表，实际应从数据库获取
-        return []
-
-    async def _send_report(self, chat_id: int, report_data: Any):
-        """发送报表到指定群组"""
+    async def _send_report(self, chat_id: int, report_data: List[Tuple[int, int]]):
+        """发送报表到指定群组(经发送队列限速，优先级低于命令回复)"""
         with self.metrics.track_task('send_report'):
             try:
-                await self.application.bot.send_message(
-                    chat_id=chat_id,
-                    text=f"每日报表:\n{report_data}"
+                await outbox.send_message(
+                    self.application.bot,
+                    chat_id,
+                    await format_report(report_data),
+                    priority=PRIORITY_BULK
                 )
+            except RetryAfter:
+                # 发送队列重试耗尽，交给_report_chat稍后重试
+                raise
             except Exception as e:
                 self._log_task_failure("send_report", str(e))
                 raise
@@ -126,18 +278,40 @@ class TaskScheduler:
     async def _cleanup_old_data(self):
         """清理过期数据"""
         with self.metrics.track_task('weekly_cleanup'):
-            # 实现数据清理逻辑
             self.logger.info("开始清理过期数据")
-            # TODO: 实现实际清理逻辑
+            from src import checkin
+            from src.message_stats import MessageStats
+            
+            engine = RetentionEngine(checkin.db_manager.engine, default_retention_policies())
+            result = await engine.run()
+            
+            # Redis: 活跃度排行只保留前N名
+            start = _time.perf_counter()
+            trimmed = await MessageStats(self.session_factory).trim_activity(
+                int(os.getenv('ACTIVITY_MAX_MEMBERS', '1000'))
+            )
+            RETENTION_ROWS_DELETED.labels(target='redis:activity').inc(trimmed)
+            RETENTION_DURATION.labels(target='redis:activity').observe(
+                _time.perf_counter() - start
+            )
+            result['redis:activity'] = trimmed
+            
+            self.logger.info(f"过期数据清理完成: {result}")
+            return result
 
     def start(self):
-        """启动任务调度"""
+        """启动任务调度，需在Application的事件循环内调用"""
+        self.loop = asyncio.get_running_loop()
         self.scheduler.start()
         self.logger.info("定时任务系统已启动")
 
     def shutdown(self):
         """关闭任务调度"""
-        self.scheduler.shutdown()
+        if not self.scheduler.running:
+            return
+        # 任务都在事件循环上运行(同步模式经线程提交回事件循环)，
+        # 在事件循环内关闭时不能阻塞等待任务结束
+        self.scheduler.shutdown(wait=False)
         self.logger.info("定时任务系统已关闭")
 
     def add_job(
@@ -149,9 +323,9 @@ class TaskScheduler:
         """添加自定义定时任务
         
         Args:
-            func: 要执行的任务函数
+            func: 要执行的任务函数(异步模式下可以是协程函数)
             trigger: 触发器类型(cron/interval/date)
-            **trigger_args: 触发器参数
+            **trigger_args: 触发器参数，可包含 max_instances 等任务选项
             
         Returns:
             任务ID
@@ -0,0 +1,96 @@
+import logging
+import os
+from typing import Dict, Iterable, Optional
+from telegram import User
+from src.utils.cache import TTLCache
+from src.utils.redis_client import redis_manager
+
+# Redis连接(共享连接池，profiles命名空间)
+redis_conn = redis_manager.namespace('profiles')
+
+# Redis中的资料在最后一次见到用户后保留的时间
+PROFILE_TTL = 30 * 86400
+
+class UserProfileCache:
+    """用户资料缓存(id -> 显示名、用户名)
+
+    从机器人已收到的更新中被动采集，本地LRU缓存 + Redis持久化，
+    渲染排行榜时无需调用 get_chat_member。
+    """
+
+    def __init__(self, maxsize: Optional[int] = None, ttl: float = 3600):
+        self.cache = TTLCache(
+            'user_profiles',
+            maxsize=maxsize or int(os.getenv('PROFILE_CACHE_SIZE', '10000')),
+            ttl=ttl
+        )
+        self.logger = logging.getLogger(__name__)
+
+    async def remember(self, user: Optional[User]):
+        """记录用户资料(未变化时不写Redis)"""
+        await self.remember_many([user])
+
+    async def remember_many(self, users: Iterable[Optional[User]]):
+        """批量记录用户资料，一次管道写入有变化的用户"""
+        changed = {}
+        for user in users:
+            if user is None:
+                continue
+            profile = {'name': str(user.full_name or ''), 'username': str(user.username or '')}
+            if self.cache.get(user.id) != profile:
+                changed[user.id] = profile
+        if not changed:
+            return
+
+        try:
+            async with redis_conn.pipeline() as pipe:
+                for user_id, profile in changed.items():
+                    key = redis_conn.key(f"user:{user_id}")
+                    pipe.hset(key, mapping=profile)
+                    pipe.expire(key, PROFILE_TTL)
+                await pipe.execute()
+        except Exception as e:
+            # 资料缓存失败不影响业务处理
+            self.logger.warning(f"写入用户资料失败: {e}")
+            return
+        for user_id, profile in changed.items():
+            self.cache.set(user_id, profile)
+
+    async def get_many(self, user_ids: Iterable[int]) -> Dict[int, Dict[str, str]]:
+        """批量读取用户资料，本地未命中的一次管道从Redis读取"""
+        profiles = {}
+        missing = []
+        for user_id in user_ids:
+            profile = self.cache.get(user_id)
+            if profile is None:
+                missing.append(user_id)
+            else:
+                profiles[user_id] = profile
+
+        if missing:
+            async with redis_conn.pipeline() as pipe:
+                for user_id in missing:
+                    pipe.hgetall(redis_conn.key(f"user:{user_id}"))
+                results = await pipe.execute()
+            for user_id, data in zip(missing, results):
+                if not data:
+                    continue
+                profile = {k.decode(): v.decode() for k, v in data.items()}
+                self.cache.set(user_id, profile)
+                profiles[user_id] = profile
+        return profiles
+
+    async def display_names(self, user_ids: Iterable[int]) -> Dict[int, str]:
+        """批量获取显示名称(未知用户显示ID)"""
+        user_ids = list(user_ids)
+        profiles = await self.get_many(user_ids)
+        return {user_id: display_name(user_id, profiles.get(user_id)) for user_id in user_ids}
+
+def display_name(user_id: int, profile: Optional[Dict[str, str]]) -> str:
+    """用户的显示名称(优先昵称；不加@，避免排行榜提醒到每个人)"""
+    if profile:
+        return profile.get('name') or profile.get('username') or f"用户 {user_id}"
+    return f"用户 {user_id}"
+
+# 全局共享实例
+profile_cache = UserProfileCache()
@@ -0,0 +1,63 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from src.utils.metrics import CACHE_HITS, CACHE_MISSES
+
+_MISSING = object()
+
+
+class TTLCache:
+    """进程内LRU缓存
+
+    容量达到 maxsize 时淘汰最久未使用的条目，条目写入 ttl 秒后过期。
+    命中/未命中次数按缓存名称上报Prometheus。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int = 1024,
+        ttl: float = 300.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """读取条目，过期或不存在时返回default"""
+        entry = self._data.get(key, _MISSING)
+        if entry is not _MISSING:
+            expires_at, value = entry
+            if expires_at > self._clock():
+                self._data.move_to_end(key)
+                CACHE_HITS.labels(cache=self.name).inc()
+                return value
+            del self._data[key]
+        CACHE_MISSES.labels(cache=self.name).inc()
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """写入条目"""
+        self._data[key] = (self._clock() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        """删除单个条目"""
+        self._data.pop(key, None)
+
+    def clear(self):
+        """清空缓存"""
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > self._clock()
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -1,24 +1,99 @@
+import os
 import logging
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+import time
+from sqlalchemy import BigInteger, Integer, create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, scoped_session
 from sqlalchemy.exc import SQLAlchemyError
-from contextlib import contextmanager
+from contextlib import contextmanager, asynccontextmanager
+from src.utils.metrics import DB_POOL_SIZE, DB_POOL_CHECKED_OUT, DB_POOL_OVERFLOW
+from src.utils.metrics import current_handler, record_dependency
 
 logger = logging.getLogger(__name__)
 
+# 同步方言对应的异步驱动
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'mysql': 'mysql+aiomysql'
+}
+
+def to_async_url(db_url: str) -> str:
+    """将数据库地址转换为异步驱动地址"""
+    url = make_url(db_url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"不支持异步模式的数据库: {backend}")
+    return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+def pool_options(db_url: str, pool_size=None, max_overflow=None) -> dict:
+    """连接池参数，默认值可通过环境变量配置"""
+    url = make_url(db_url)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # 内存数据库使用单连接池，不支持容量配置
+        return {}
+    return {
+        'pool_size': pool_size or int(os.getenv('DB_POOL_SIZE', '5')),
+        'max_overflow': max_overflow if max_overflow is not None else int(
+            os.getenv('DB_MAX_OVERFLOW', '10')
+        ),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', '30')),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '3600'))
+    }
+
+# 支持 INSERT ... ON CONFLICT ... RETURNING 的方言
+UPSERT_DIALECTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert
+}
+
+def upsert_insert(session, table):
+    """按会话绑定的方言构造支持ON CONFLICT的insert语句"""
+    dialect = session.get_bind().dialect.name
+    if dialect not in UPSERT_DIALECTS:
+        raise ValueError(f"数据库不支持ON CONFLICT写入: {dialect}")
+    return UPSERT_DIALECTS[dialect](table)
+
 class DatabaseManager:
-    """数据库连接管理器"""
-    
-    def __init__(self, db_url="sqlite:///db/telegram_bot.db"):
-        self.engine = create_engine(
-            db_url,
-            pool_size=5,
-            max_overflow=10,
-            pool_timeout=30,
-            pool_recycle=3600
-        )
+    """数据库连接管理器
+
+    async_mode 开启时额外创建 AsyncEngine，get_async_session() 提供与
+    get_session() 相同语义(提交/回滚/关闭)的异步会话。
+    """
+
+    def __init__(
+        self,
+        db_url="sqlite:///db/telegram_bot.db",
+        async_mode=None,
+        pool_size=None,
+        max_overflow=None
+    ):
+        if async_mode is None:
+            async_mode = os.getenv('DB_ASYNC', '0') == '1'
+        options = pool_options(db_url, pool_size, max_overflow)
+
+        self.engine = create_engine(db_url, **options)
         self.session_factory = sessionmaker(bind=self.engine)
         self.Session = scoped_session(self.session_factory)
+        self._watch_pool(self.engine, 'sync')
+        self._watch_queries(self.engine)
+
+        self.async_engine = None
+        self.async_session_factory = None
+        if async_mode:
+            self.async_engine = create_async_engine(to_async_url(db_url), **options)
+            self.async_session_factory = async_sessionmaker(
+                self.async_engine,
+                expire_on_commit=False
+            )
+            self._watch_pool(self.async_engine.sync_engine, 'async')
+            self._watch_queries(self.async_engine.sync_engine)
+
+    @property
+    def is_async(self) -> bool:
+        return self.async_engine is not None
 
     @contextmanager
     def get_session(self):
@@ -34,15 +109,210 @@ class DatabaseManager:
         finally:
             session.close()
 
+    @asynccontextmanager
+    async def get_async_session(self):
+        """获取异步数据库会话"""
+        if not self.is_async:
+            raise RuntimeError("DatabaseManager未启用异步模式")
+        session = self.async_session_factory()
+        try:
+            yield session
+            await session.commit()
+        except SQLAlchemyError as e:
+            await session.rollback()
+            logger.error(f"数据库操作失败: {e}")
+            raise
+        finally:
+            await session.close()
+
+    def _watch_pool(self, engine, name: str):
+        """监听连接借出/归还，更新连接池指标"""
+        pool = engine.pool
+        if not hasattr(pool, 'checkedout'):
+            return
+
+        def report():
+            DB_POOL_SIZE.labels(engine=name).set(pool.size())
+            DB_POOL_OVERFLOW.labels(engine=name).set(max(pool.overflow(), 0))
+
+        def on_checkout(*args):
+            DB_POOL_CHECKED_OUT.labels(engine=name).inc()
+            report()
+
+        def on_checkin(*args):
+            DB_POOL_CHECKED_OUT.labels(engine=name).dec()
+            report()
+
+        event.listen(engine, 'checkout', on_checkout)
+        event.listen(engine, 'checkin', on_checkin)
+        report()
+
+    def _watch_queries(self, engine):
+        """处理器内执行的SQL耗时计入该处理器的sql依赖耗时"""
+        def before_execute(conn, cursor, statement, parameters, context, executemany):
+            if current_handler() is not None:
+                conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+        def after_execute(conn, cursor, statement, parameters, context, executemany):
+            starts = conn.info.get('query_start')
+            if starts and current_handler() is not None:
+                record_dependency('sql', time.perf_counter() - starts.pop())
+
+        def on_error(context):
+            # 执行失败时不会触发after_cursor_execute
+            if context.connection is not None:
+                starts = context.connection.info.get('query_start')
+                if starts and current_handler() is not None:
+                    record_dependency('sql', time.perf_counter() - starts.pop())
+
+        event.listen(engine, 'before_cursor_execute', before_execute)
+        event.listen(engine, 'after_cursor_execute', after_execute)
+        event.listen(engine, 'handle_error', on_error)
+
+    async def dispose(self):
+        """释放全部连接"""
+        if self.async_engine is not None:
+            await self.async_engine.dispose()
+        self.engine.dispose()
+
     def health_check(self):
         """数据库健康检查"""
         try:
             conn = self.engine.connect()
-            conn.execute("SELECT 1")
+            conn.execute(text("SELECT 1"))
             return True
         except Exception as e:
             logger.error(f"数据库健康检查失败: {e}")
             return False
         finally:
             if 'conn' in locals():
-                conn.close()
\ No newline at end of file
+                conn.close()
+
+def add_missing_columns(metadata, engine):
+    """为已存在的表补加模型中新增的列(create_all不修改已有表)
+
+    非空列必须带server_default，已有行取该默认值；主键列无法补加。
+    """
+    inspector = inspect(engine)
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if column.primary_key or (not column.nullable and column.server_default is None):
+                logger.warning(f"无法为 {table.name} 补加列 {column.name}，需要手动迁移")
+                continue
+            ddl = (
+                f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                f"{column.type.compile(engine.dialect)}"
+            )
+            if column.server_default is not None:
+                default = column.server_default.arg
+                ddl += f" DEFAULT {default if hasattr(default, 'text') else repr(str(default))}"
+            if not column.nullable:
+                ddl += " NOT NULL"
+            with engine.begin() as conn:
+                conn.execute(text(ddl))
+            logger.info(f"已为 {table.name} 补加列 {column.name}")
+
+def widen_statement(dialect: str, table: str, column) -> str:
+    """把已有整数列改为BIGINT的DDL"""
+    if dialect == 'mysql':
+        return (
+            f"ALTER TABLE {table} MODIFY {column.name} BIGINT"
+            f"{'' if column.nullable else ' NOT NULL'}"
+        )
+    return f"ALTER TABLE {table} ALTER COLUMN {column.name} TYPE BIGINT"
+
+def widen_integer_columns(metadata, engine):
+    """把已有表中模型已改为BigInteger的INTEGER列改为BIGINT
+
+    超级群chat_id(-100…)和新用户ID超出int4范围；SQLite的INTEGER本身就是64位，无需修改。
+    """
+    if engine.dialect.name == 'sqlite':
+        return
+    inspector = inspect(engine)
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name']: column['type'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            current = existing.get(column.name)
+            if (
+                not isinstance(column.type, BigInteger)
+                or not isinstance(current, Integer)
+                or isinstance(current, BigInteger)
+            ):
+                continue
+            with engine.begin() as conn:
+                conn.execute(text(widen_statement(engine.dialect.name, table.name, column)))
+            logger.info(f"已将 {table.name}.{column.name} 改为BIGINT")
+
+def create_missing_indexes(metadata, engine):
+    """为已存在的表补建模型中新增的索引(create_all只创建缺失的表)
+
+    唯一索引是 ON CONFLICT 写入的前提，创建失败时抛出异常终止启动；
+    普通索引失败只记录警告。
+    """
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(engine, checkfirst=True)
+            except SQLAlchemyError as e:
+                if index.unique:
+                    logger.error(f"创建唯一索引 {index.name} 失败: {e}")
+                    raise
+                logger.warning(f"创建索引 {index.name} 失败: {e}")
+
+def drop_obsolete_indexes(metadata, engine):
+    """删除已有表上模型不再使用的索引(表的info['obsolete_indexes']中列出)"""
+    inspector = inspect(engine)
+    for table in metadata.sorted_tables:
+        names = table.info.get('obsolete_indexes', ())
+        if not names or not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for name in names:
+            if name not in existing:
+                continue
+            try:
+                ddl = f"DROP INDEX {name}"
+                if engine.dialect.name == 'mysql':
+                    ddl += f" ON {table.name}"
+                with engine.begin() as conn:
+                    conn.execute(text(ddl))
+                logger.info(f"已删除 {table.name} 的索引 {name}")
+            except SQLAlchemyError as e:
+                logger.warning(f"删除索引 {name} 失败: {e}")
+
+async def run_in_session(session, fn):
+    """在会话中执行同步写法的数据库操作
+
+    AsyncSession 经 run_sync 在异步驱动上执行，不阻塞事件循环；
+    普通 Session 直接执行(兼容同步模式)。
+    """
+    if isinstance(session, AsyncSession):
+        return await session.run_sync(fn)
+    return fn(session)
+
+@asynccontextmanager
+async def open_session(source):
+    """统一获取会话
+
+    source 可以是会话对象，也可以是返回会话/同步或异步上下文管理器的工厂。
+    """
+    if isinstance(source, (Session, AsyncSession)):
+        yield source
+        return
+
+    scope = source()
+    if isinstance(scope, (Session, AsyncSession)):
+        yield scope
+    elif hasattr(scope, '__enter__'):
+        with scope as session:
+            yield session
+    else:
+        async with scope as session:
+            yield session
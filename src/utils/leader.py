@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Optional
+
+from redis.exceptions import RedisError, WatchError
+
+from src.utils.metrics import LEADER_STATUS
+from src.utils.redis_client import redis_manager
+
+# Redis连接(共享连接池，leader命名空间)
+redis_conn = redis_manager.namespace('leader')
+
+
+class LeaderElection:
+    """基于Redis租约的单领导者选举
+
+    SET NX PX 抢占租约，领导者每 ttl/3 续期一次(WATCH校验持有者后PEXPIRE)。
+    续期失败或Redis不可用时，本地在租约到期前主动放弃领导权，
+    保证同一时刻最多只有一个实例认为自己是领导者。
+    """
+
+    def __init__(self, name: str, ttl: Optional[float] = None, owner: Optional[str] = None):
+        self.name = name
+        self.ttl = ttl or float(os.getenv('LEADER_LEASE_TTL', '30'))
+        self.owner = owner or os.getenv('WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}"
+        self.key = redis_conn.key(name)
+        self._expires_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def is_leader(self) -> bool:
+        """当前是否持有未过期的租约(预留1/10租期应对时钟与网络延迟)"""
+        return time.monotonic() < self._expires_at - self.ttl / 10
+
+    async def try_acquire(self) -> bool:
+        """抢占或续期租约，返回是否为领导者"""
+        was_leader = self.is_leader
+        started = time.monotonic()
+        ttl_ms = int(self.ttl * 1000)
+        try:
+            acquired = await redis_conn.set(self.key, self.owner, nx=True, px=ttl_ms)
+            if not acquired:
+                acquired = await self._renew(ttl_ms)
+        except RedisError as e:
+            self.logger.warning(f"领导者租约 {self.name} 续期失败: {e}")
+            acquired = False
+
+        if acquired:
+            self._expires_at = started + self.ttl
+        elif was_leader:
+            self._expires_at = 0.0
+        if acquired != was_leader:
+            self.logger.info(f"{self.owner} {'成为' if acquired else '不再是'} {self.name} 的领导者")
+        LEADER_STATUS.labels(name=self.name).set(1 if acquired else 0)
+        return acquired
+
+    async def _renew(self, ttl_ms: int) -> bool:
+        """租约仍由本实例持有时续期"""
+        async with redis_conn.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(self.key)
+                holder = await pipe.get(self.key)
+                if holder is None or holder.decode() != self.owner:
+                    return False
+                pipe.multi()
+                pipe.pexpire(self.key, ttl_ms)
+                await pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    async def release(self):
+        """主动释放租约(仅当仍由本实例持有)"""
+        self._expires_at = 0.0
+        LEADER_STATUS.labels(name=self.name).set(0)
+        try:
+            async with redis_conn.pipeline(transaction=True) as pipe:
+                await pipe.watch(self.key)
+                holder = await pipe.get(self.key)
+                if holder is not None and holder.decode() == self.owner:
+                    pipe.multi()
+                    pipe.delete(self.key)
+                    await pipe.execute()
+        except (RedisError, WatchError) as e:
+            self.logger.warning(f"释放领导者租约 {self.name} 失败: {e}")
+
+    def start(self):
+        """启动后台选举/续期任务，需在事件循环内调用"""
+        if self._task is None or self._task.done():
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止续期并释放租约，便于其他实例立即接任"""
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+        await self.release()
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            await self.try_acquire()
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.ttl / 3)
+            except asyncio.TimeoutError:
+                pass
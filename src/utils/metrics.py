@@ -1,32 +1,51 @@
-from prometheus_client import Counter, Histogram, Gauge
-from typing import Optional
+from prometheus_client import Counter, Histogram, Gauge, CollectorRegistry, start_http_server
+from prometheus_client import multiprocess
+from contextvars import ContextVar
+from typing import Dict, List, Optional
 import time
 
+# 定时任务指标(模块级注册，多个调度器实例共享)
+TASK_RETRIES = Counter(
+    'task_retries_total',
+    '任务重试次数',
+    ['task_name']
+)
+TASK_DURATION = Histogram(
+    'task_duration_seconds',
+    '任务执行耗时',
+    ['task_name'],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60)
+)
+TASK_FAILURES = Counter(
+    'task_failures_total',
+    '任务失败次数',
+    ['task_name', 'error_type']
+)
+ACTIVE_TASKS = Gauge(
+    'active_tasks',
+    '当前活跃任务数'
+)
+TASK_START_DELAY = Histogram(
+    'task_start_delay_seconds',
+    '任务计划时间到实际提交执行的延迟',
+    ['job_id'],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+)
+TASK_SKIPPED = Counter(
+    'task_skipped_total',
+    '任务被跳过的次数(错过执行时间/达到并发上限)',
+    ['job_id', 'reason']
+)
+
 class TaskMetrics:
     """任务监控指标收集"""
     
     def __init__(self):
-        # 定义Prometheus指标
-        self.task_retries = Counter(
-            'task_retries_total',
-            '任务重试次数',
-            ['task_name']
-        )
-        self.task_duration = Histogram(
-            'task_duration_seconds',
-            '任务执行耗时',
-            ['task_name'],
-            buckets=(0.1, 0.5, 1, 5, 10, 30, 60)
-        )
-        self.task_failures = Counter(
-            'task_failures_total',
-            '任务失败次数',
-            ['task_name', 'error_type']
-        )
-        self.active_tasks = Gauge(
-            'active_tasks',
-            '当前活跃任务数'
-        )
+        # Prometheus指标
+        self.task_retries = TASK_RETRIES
+        self.task_duration = TASK_DURATION
+        self.task_failures = TASK_FAILURES
+        self.active_tasks = ACTIVE_TASKS
 
     def track_task(self, task_name: str):
         """任务执行跟踪上下文"""
@@ -61,4 +80,275 @@ class TaskTracker:
             ).inc()
             
         self.metrics.active_tasks.dec()
-        return False
\ No newline at end of file
+        return False
+
+
+# 写缓冲区指标(按缓冲区名称区分)
+WRITE_BUFFER_DEPTH = Gauge(
+    'write_buffer_queue_depth',
+    '写缓冲区排队条目数',
+    ['buffer']
+)
+WRITE_BUFFER_FLUSH_SECONDS = Histogram(
+    'write_buffer_flush_seconds',
+    '写缓冲区批量写出耗时',
+    ['buffer'],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+)
+WRITE_BUFFER_FLUSHED = Counter(
+    'write_buffer_items_flushed_total',
+    '写缓冲区已写出条目数',
+    ['buffer']
+)
+WRITE_BUFFER_FAILURES = Counter(
+    'write_buffer_flush_failures_total',
+    '写缓冲区批量写出失败次数',
+    ['buffer']
+)
+
+# 消息入库队列中被重新投递(上次未确认)的消息数
+MESSAGE_QUEUE_REDELIVERED = Counter(
+    'message_queue_redelivered_total',
+    '重新投递的待入库消息数'
+)
+
+# 数据库连接池指标(engine: sync/async)
+DB_POOL_SIZE = Gauge(
+    'db_pool_size',
+    '数据库连接池容量',
+    ['engine']
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    'db_pool_checked_out',
+    '数据库连接池已借出连接数',
+    ['engine']
+)
+DB_POOL_OVERFLOW = Gauge(
+    'db_pool_overflow',
+    '数据库连接池溢出连接数',
+    ['engine']
+)
+
+# 进程内缓存指标(按缓存名称区分)
+CACHE_HITS = Counter(
+    'cache_hits_total',
+    '缓存命中次数',
+    ['cache']
+)
+CACHE_MISSES = Counter(
+    'cache_misses_total',
+    '缓存未命中次数',
+    ['cache']
+)
+
+# 批量管理操作指标
+BULK_MODERATION_ACTIONS = Counter(
+    'bulk_moderation_actions_total',
+    '批量管理操作处理的用户数',
+    ['action', 'result']
+)
+BULK_MODERATION_RETRY_AFTER = Counter(
+    'bulk_moderation_retry_after_total',
+    '批量管理操作收到RetryAfter的次数'
+)
+
+# 入群验证指标
+PENDING_VERIFICATIONS = Gauge(
+    'pending_verifications',
+    '等待验证的新成员数'
+)
+PENDING_VERIFICATIONS_MEMORY = Gauge(
+    'pending_verifications_memory_bytes',
+    '待验证索引占用的Redis内存(字节)'
+)
+VERIFICATION_SWEEP_SECONDS = Histogram(
+    'verification_sweep_duration_seconds',
+    '验证超时清理耗时'
+)
+VERIFICATION_TIMEOUTS = Counter(
+    'verification_timeouts_total',
+    '验证超时被处理的成员数',
+    ['action']
+)
+
+# 数据保留指标
+RETENTION_ROWS_DELETED = Counter(
+    'retention_rows_deleted_total',
+    '数据保留任务删除的行/条目数',
+    ['target']
+)
+RETENTION_DURATION = Histogram(
+    'retention_duration_seconds',
+    '数据保留任务各目标耗时',
+    ['target'],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300)
+)
+RETENTION_BYTES_RECLAIMED = Counter(
+    'retention_bytes_reclaimed_total',
+    '压缩回收的数据库字节数'
+)
+
+# Webhook接入指标
+WEBHOOK_REQUESTS = Counter(
+    'webhook_requests_total',
+    'Webhook收到的请求数',
+    ['status']
+)
+WEBHOOK_REQUEST_SECONDS = Histogram(
+    'webhook_request_duration_seconds',
+    'Webhook请求处理耗时(解析并入队)',
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5)
+)
+WEBHOOK_QUEUE_DEPTH = Gauge(
+    'webhook_update_queue_depth',
+    '等待分发的更新数'
+)
+
+# 集群指标
+LEADER_STATUS = Gauge(
+    'leader_status',
+    '本实例是否为领导者(1/0)',
+    ['name']
+)
+SHARD_FORWARDED = Counter(
+    'shard_updates_forwarded_total',
+    '转发给其他工作进程的更新数',
+    ['shard']
+)
+
+def start_multiprocess_metrics_server(port: int):
+    """由主进程汇总输出各工作进程的指标(Prometheus多进程模式)
+
+    需在工作进程启动前设置 PROMETHEUS_MULTIPROC_DIR；计数器与直方图跨进程求和，
+    仪表盘按 pid 标签区分工作进程。
+    """
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    start_http_server(port, registry=registry)
+
+# 更新分发指标
+UPDATE_LANES_ACTIVE = Gauge(
+    'update_lanes_active',
+    '有待处理更新的群组通道数'
+)
+UPDATE_LANE_PENDING = Gauge(
+    'update_lane_pending',
+    '各群组通道中已接收、尚未处理完成的更新数'
+)
+UPDATE_LANE_DEPTH = Histogram(
+    'update_lane_depth',
+    '更新进入通道时该通道的排队深度(含自身)',
+    buckets=(1, 2, 5, 10, 20, 50, 100)
+)
+UPDATE_LANE_WAIT = Histogram(
+    'update_lane_wait_seconds',
+    '更新从进入通道到开始处理的等待时间',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+)
+
+# 处理器指标(handler: /命令名或回调名；outcome: ok/stopped/error)
+HANDLER_DURATION = Histogram(
+    'handler_duration_seconds',
+    '各处理器回调耗时',
+    ['handler', 'outcome'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+HANDLER_CALLS = Counter(
+    'handler_calls_total',
+    '各处理器回调次数',
+    ['handler', 'outcome']
+)
+HANDLER_ERRORS = Counter(
+    'handler_errors_total',
+    '处理器回调抛出的异常数',
+    ['handler', 'error_type']
+)
+HANDLER_IN_FLIGHT = Gauge(
+    'handler_in_flight',
+    '正在执行的处理器回调数',
+    ['handler'],
+    multiprocess_mode='livesum'
+)
+HANDLER_DEPENDENCY_SECONDS = Histogram(
+    'handler_dependency_seconds',
+    '单次处理器回调中等待依赖(dependency: redis/sql)的累计耗时',
+    ['handler', 'dependency'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+HANDLER_DEPENDENCY_CALLS = Counter(
+    'handler_dependency_calls_total',
+    '处理器回调中的依赖调用次数',
+    ['handler', 'dependency']
+)
+
+# 当前正在执行的处理器(处理器内创建的任务与run_sync中的查询继承同一跟踪对象)
+_current_handler: ContextVar[Optional['HandlerTracker']] = ContextVar('current_handler', default=None)
+
+class HandlerTracker:
+    """单次处理器回调跟踪: 耗时、在途数、结果，以及Redis/SQL调用的累计耗时"""
+    
+    def __init__(self, handler: str):
+        self.handler = handler
+        self.outcome = 'ok'
+        self.dependencies: Dict[str, List[float]] = {}
+        self.start_time = None
+        self._token = None
+        
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        HANDLER_IN_FLIGHT.labels(handler=self.handler).inc()
+        self._token = _current_handler.set(self)
+        return self
+        
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _current_handler.reset(self._token)
+        duration = time.perf_counter() - self.start_time
+        HANDLER_IN_FLIGHT.labels(handler=self.handler).dec()
+        
+        if exc_type is not None and self.outcome == 'ok':
+            self.outcome = 'error'
+            HANDLER_ERRORS.labels(handler=self.handler, error_type=exc_type.__name__).inc()
+        HANDLER_DURATION.labels(handler=self.handler, outcome=self.outcome).observe(duration)
+        HANDLER_CALLS.labels(handler=self.handler, outcome=self.outcome).inc()
+        
+        for dependency, (seconds, calls) in self.dependencies.items():
+            HANDLER_DEPENDENCY_SECONDS.labels(handler=self.handler, dependency=dependency).observe(seconds)
+            HANDLER_DEPENDENCY_CALLS.labels(handler=self.handler, dependency=dependency).inc(calls)
+        return False
+
+    def add_dependency(self, dependency: str, seconds: float):
+        totals = self.dependencies.setdefault(dependency, [0.0, 0])
+        totals[0] += seconds
+        totals[1] += 1
+
+def current_handler() -> Optional[HandlerTracker]:
+    """当前上下文中正在执行的处理器(不在处理器内时为None)"""
+    return _current_handler.get()
+
+def record_dependency(dependency: str, seconds: float):
+    """把一次Redis/SQL调用的耗时计入当前处理器"""
+    tracker = _current_handler.get()
+    if tracker is not None:
+        tracker.add_dependency(dependency, seconds)
+
+# 发送队列指标(priority: interactive/normal/bulk)
+OUTBOX_PENDING = Gauge(
+    'outbox_pending_messages',
+    '发送队列中等待发送的消息数',
+    ['priority']
+)
+OUTBOX_SENT = Counter(
+    'outbox_messages_total',
+    '发送队列处理的消息数(result: sent/merged/failed)',
+    ['priority', 'result']
+)
+OUTBOX_WAIT = Histogram(
+    'outbox_wait_seconds',
+    '消息从入队到发出的等待时间',
+    ['priority'],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60)
+)
+OUTBOX_RETRY_AFTER = Counter(
+    'outbox_retry_after_total',
+    '发送队列收到RetryAfter的次数'
+)
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import time
+import warnings
+from datetime import timedelta
+from typing import Callable, Hashable, Optional
+from telegram.error import RetryAfter
+from telegram.warnings import PTBDeprecationWarning
+from src.utils.cache import TTLCache
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """读取RetryAfter要求的等待秒数(兼容int与timedelta两种返回类型)"""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', PTBDeprecationWarning)
+        delay = error.retry_after
+    if isinstance(delay, timedelta):
+        return delay.total_seconds()
+    return float(delay)
+
+class TokenBucket:
+    """令牌桶限速
+
+    按 rate(个/秒)补充令牌，最多积累 capacity 个；acquire() 在令牌不足时等待。
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """尝试取令牌，成功返回0，否则返回需要等待的秒数"""
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1.0):
+        """取令牌，不足时等待(按到达顺序排队)"""
+        async with self._lock:
+            while True:
+                delay = self.try_acquire(tokens)
+                if delay <= 0:
+                    return
+                await asyncio.sleep(delay)
+
+    def penalize(self, seconds: float):
+        """收到RetryAfter时清空令牌，seconds秒内不再放行"""
+        self._refill()
+        self._tokens = -seconds * self.rate
+
+
+class ChatRateLimiter:
+    """Telegram发送限速: 全局桶 + 每个聊天一个桶
+
+    默认全局约30条/秒(多进程部署时按WORKER_COUNT平分)，单个群约20条/分钟(允许少量突发)。
+    长时间空闲的聊天桶会被淘汰，再次使用时按满桶重建。
+    """
+
+    def __init__(
+        self,
+        global_rate: Optional[float] = None,
+        per_chat_rate: Optional[float] = None,
+        per_chat_burst: float = 3.0
+    ):
+        if global_rate is None:
+            # 多个工作进程共用同一个Bot令牌，全局限额在进程间平分
+            workers = max(int(os.getenv('WORKER_COUNT', '1')), 1)
+            global_rate = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30')) / workers
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate or float(os.getenv('TELEGRAM_CHAT_RATE', str(20 / 60)))
+        self.per_chat_burst = per_chat_burst
+        # 空闲超过回满时间的桶与新桶等价，可以淘汰(保留至少10分钟以免丢失RetryAfter惩罚)
+        idle = max(per_chat_burst / self.per_chat_rate, 600.0)
+        self._chat_buckets = TTLCache('rate_limit_buckets', maxsize=100000, ttl=idle)
+
+    def chat_bucket(self, chat_id: Hashable) -> TokenBucket:
+        """获取聊天对应的令牌桶"""
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        # 每次使用都续期，避免活跃聊天的桶被淘汰
+        self._chat_buckets.set(chat_id, bucket)
+        return bucket
+
+    async def acquire(self, chat_id: Hashable):
+        """等待直到可以向该聊天发送一条消息"""
+        await self.chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+
+    def retry_after(self, chat_id: Hashable, seconds: float):
+        """记录Telegram返回的限流等待"""
+        self.chat_bucket(chat_id).penalize(seconds)
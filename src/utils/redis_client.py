@@ -0,0 +1,169 @@
+import os
+import logging
+import functools
+import inspect
+import time
+from typing import Dict, Iterable, Optional
+from redis.asyncio import Redis, ConnectionPool
+from src.utils.metrics import current_handler, record_dependency
+
+logger = logging.getLogger(__name__)
+
+
+class RedisNamespace:
+    """Redis命名空间视图
+
+    key() 生成带命名空间前缀的键，其余命令原样转发到共享客户端。
+    在处理器内发出的命令(含管道execute)耗时计入该处理器的redis依赖耗时。
+    """
+
+    def __init__(self, manager: 'RedisManager', name: str):
+        self._manager = manager
+        self.name = name
+
+    def key(self, key: str) -> str:
+        """生成带命名空间前缀的键"""
+        return f"{self.name}:{key}"
+
+    def pipeline(self, transaction: bool = False):
+        """创建命令管道(默认非事务)，多条命令一次往返"""
+        pipe = self._manager.client.pipeline(transaction=transaction)
+        if current_handler() is not None:
+            pipe.execute = _timed_command(pipe.execute)
+        return pipe
+
+    def __getattr__(self, item):
+        attr = getattr(self._manager.client, item)
+        # 只在处理器内包装，其他调用方拿到的是客户端原方法
+        if callable(attr) and current_handler() is not None:
+            return _timed_command(attr)
+        return attr
+
+
+def _timed_command(func):
+    """记录命令往返耗时(非协程结果原样返回)"""
+    @functools.wraps(func)
+    def call(*args, **kwargs):
+        result = func(*args, **kwargs)
+        if not inspect.isawaitable(result):
+            return result
+        return _await_timed(result)
+    return call
+
+
+async def _await_timed(awaitable):
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        record_dependency('redis', time.perf_counter() - start)
+
+
+class RedisManager:
+    """Redis连接管理器
+
+    所有子系统共享同一个异步连接池，通过键前缀区分命名空间，
+    取代各模块各自创建的同步连接(db 1/2/3)。
+    REDIS_URL 设为 fakeredis:// 时使用本地替身，无需Redis服务。
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        max_connections: Optional[int] = None,
+        client: Optional[Redis] = None
+    ):
+        self.url = url or os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+        self.max_connections = max_connections or int(
+            os.getenv('REDIS_MAX_CONNECTIONS', '50')
+        )
+        self._client = client
+        self._namespaces: Dict[str, RedisNamespace] = {}
+
+    @property
+    def client(self) -> Redis:
+        """共享客户端(首次使用时创建)"""
+        if self._client is None:
+            self._client = self._create_client()
+        return self._client
+
+    def _create_client(self) -> Redis:
+        if self.url.startswith('fakeredis://'):
+            from fakeredis import FakeAsyncRedis
+            logger.info("使用fakeredis作为Redis替身")
+            return FakeAsyncRedis()
+
+        pool = ConnectionPool.from_url(
+            self.url,
+            max_connections=self.max_connections
+        )
+        return Redis(connection_pool=pool)
+
+    def use_client(self, client: Optional[Redis]):
+        """替换共享客户端(测试时注入fakeredis)"""
+        self._client = client
+
+    def namespace(self, name: str) -> RedisNamespace:
+        """获取命名空间视图"""
+        if name not in self._namespaces:
+            self._namespaces[name] = RedisNamespace(self, name)
+        return self._namespaces[name]
+
+    async def close(self):
+        """关闭连接池"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# 旧版本各模块独占的库 -> (命名空间, 需要迁移的键)
+# 其余旧键(admin_actions、new_members:*)格式已变化或为临时数据，不迁移
+LEGACY_DATABASES = {
+    1: ('members', ['mute:*']),
+    2: ('stats', ['chat:*:activity']),
+    3: ('welcome', ['welcome:*', 'verified_chats']),
+}
+
+# 旧库中记录已迁移键的集合，重复执行时跳过
+LEGACY_MIGRATED_KEY = 'legacy_migrated'
+
+
+async def migrate_legacy_keys(source: Redis, namespace: RedisNamespace, patterns: Iterable[str]) -> int:
+    """把旧库(db 1/2/3)中的键复制到共享库的命名空间下，返回迁移的键数
+
+    切换后新库可能已有数据: 字符串保留新值，集合取并集，
+    有序集合(活跃度计数)累加。已迁移的键记入旧库，重复执行不会重复累加。
+    """
+    migrated = 0
+    for pattern in patterns:
+        async for raw_key in source.scan_iter(match=pattern):
+            if await source.sismember(LEGACY_MIGRATED_KEY, raw_key):
+                continue
+            key = raw_key.decode()
+            target = namespace.key(key)
+            key_type = (await source.type(raw_key)).decode()
+            if key_type == 'string':
+                value = await source.get(raw_key)
+                ttl = await source.pttl(raw_key)
+                if value is None:
+                    continue
+                await namespace.set(target, value, px=ttl if ttl > 0 else None, nx=True)
+            elif key_type == 'set':
+                members = await source.smembers(raw_key)
+                if members:
+                    await namespace.sadd(target, *members)
+            elif key_type == 'zset':
+                async with namespace.pipeline(transaction=True) as pipe:
+                    for member, score in await source.zrange(raw_key, 0, -1, withscores=True):
+                        pipe.zincrby(target, score, member)
+                    await pipe.execute()
+            else:
+                logger.warning(f"跳过不支持的旧键 {key} ({key_type})")
+                continue
+            await source.sadd(LEGACY_MIGRATED_KEY, raw_key)
+            migrated += 1
+    return migrated
+
+
+# 全局共享实例
+redis_manager = RedisManager()
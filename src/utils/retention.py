@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+from sqlalchemy import Date, Integer, delete, func, select, text
+from sqlalchemy.engine import Engine
+
+from src.utils.metrics import (
+    RETENTION_ROWS_DELETED,
+    RETENTION_DURATION,
+    RETENTION_BYTES_RECLAIMED
+)
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionPolicy:
+    """单表保留策略
+
+    删除 column 早于 max_age 的行。单一整数主键的表按主键区间分块删除，
+    其余表(复合主键的汇总表)按时间列区间分块删除，每块单独提交。
+    """
+
+    def __init__(
+        self,
+        model,
+        column: str,
+        max_age: Optional[timedelta],
+        chunk_size: int = 5000,
+        time_step: timedelta = timedelta(days=1)
+    ):
+        self.model = model
+        self.table = model.__table__
+        self.column = self.table.c[column]
+        self.max_age = max_age
+        self.chunk_size = chunk_size
+        self.time_step = time_step
+
+        primary_key = list(self.table.primary_key.columns)
+        self.id_column = None
+        if len(primary_key) == 1 and isinstance(primary_key[0].type, Integer):
+            self.id_column = primary_key[0]
+
+    @property
+    def name(self) -> str:
+        return self.table.name
+
+    def cutoff(self, now: datetime):
+        """早于该值的行将被删除"""
+        cutoff = now - self.max_age
+        if isinstance(self.column.type, Date):
+            return cutoff.date()
+        return cutoff
+
+
+class RetentionEngine:
+    """数据保留引擎
+
+    按策略分块删除过期数据，避免长时间持有写锁(SQLite整库锁)；
+    删除后对开启增量回收的SQLite执行incremental_vacuum，并上报删除行数、
+    耗时与回收字节数。
+    数据库操作在线程中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, engine: Engine, policies: Iterable[RetentionPolicy]):
+        self.engine = engine
+        self.policies = list(policies)
+        self.logger = logging.getLogger(__name__)
+
+    async def run(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """执行全部策略，返回各表删除行数及回收字节数"""
+        now = now or datetime.now()
+        result = {}
+        for policy in self.policies:
+            if not policy.max_age:
+                continue
+            start = time.perf_counter()
+            deleted = await self.purge(policy, policy.cutoff(now))
+            RETENTION_DURATION.labels(target=policy.name).observe(time.perf_counter() - start)
+            result[policy.name] = deleted
+            self.logger.info(f"数据保留: {policy.name} 删除 {deleted} 行")
+
+        if any(result.values()):
+            result['bytes_reclaimed'] = await asyncio.to_thread(self.compact)
+        return result
+
+    async def purge(self, policy: RetentionPolicy, cutoff) -> int:
+        """分块删除早于cutoff的行"""
+        if policy.id_column is not None:
+            chunks = self._id_chunks(policy, cutoff)
+        else:
+            chunks = self._time_chunks(policy, cutoff)
+
+        deleted = 0
+        for condition in await asyncio.to_thread(lambda: list(chunks)):
+            count = await asyncio.to_thread(self._delete, policy, condition, cutoff)
+            deleted += count
+            RETENTION_ROWS_DELETED.labels(target=policy.name).inc(count)
+        return deleted
+
+    def _id_chunks(self, policy: RetentionPolicy, cutoff):
+        """过期行的主键范围，按chunk_size切分"""
+        with self.engine.connect() as conn:
+            low, high = conn.execute(
+                select(func.min(policy.id_column), func.max(policy.id_column))
+                .where(policy.column < cutoff)
+            ).one()
+        if low is None:
+            return
+        for start in range(low, high + 1, policy.chunk_size):
+            yield (policy.id_column >= start) & (policy.id_column < start + policy.chunk_size)
+
+    def _time_chunks(self, policy: RetentionPolicy, cutoff):
+        """过期行的时间范围，按time_step切分"""
+        with self.engine.connect() as conn:
+            low = conn.execute(
+                select(func.min(policy.column)).where(policy.column < cutoff)
+            ).scalar()
+        while low is not None and low < cutoff:
+            high = min(low + policy.time_step, cutoff)
+            yield (policy.column >= low) & (policy.column < high)
+            low = high
+
+    def _delete(self, policy: RetentionPolicy, condition, cutoff) -> int:
+        """删除单个区块(独立事务)"""
+        with self.engine.begin() as conn:
+            return conn.execute(
+                delete(policy.table).where(condition, policy.column < cutoff)
+            ).rowcount
+
+    def compact(self) -> int:
+        """回收SQLite空闲页，返回回收的字节数(其他数据库交由自身的autovacuum)
+
+        只在 auto_vacuum=INCREMENTAL 时回收；完整VACUUM会重写整个库并长时间
+        锁库，不在运行中执行，空闲页留给后续写入复用。
+        """
+        if self.engine.dialect.name != 'sqlite':
+            return 0
+
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            if conn.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+                self.logger.warning(
+                    "SQLite未开启增量回收(auto_vacuum=INCREMENTAL)，跳过空间回收，"
+                    "需在维护窗口手动执行VACUUM"
+                )
+                return 0
+            before = self._database_size(conn)
+            conn.execute(text("PRAGMA incremental_vacuum"))
+            reclaimed = max(before - self._database_size(conn), 0)
+
+        RETENTION_BYTES_RECLAIMED.inc(reclaimed)
+        return reclaimed
+
+    @staticmethod
+    def _database_size(conn) -> int:
+        page_count = conn.execute(text("PRAGMA page_count")).scalar()
+        page_size = conn.execute(text("PRAGMA page_size")).scalar()
+        return page_count * page_size
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Optional
+
+from src.utils.metrics import (
+    WRITE_BUFFER_DEPTH,
+    WRITE_BUFFER_FLUSH_SECONDS,
+    WRITE_BUFFER_FLUSHED,
+    WRITE_BUFFER_FAILURES
+)
+
+logger = logging.getLogger(__name__)
+
+# 停止信号
+_STOP = object()
+
+
+class WriteBehindBuffer:
+    """异步写后缓冲区
+
+    将高频的单条写入放入有界队列，由后台任务按数量/时间切分成批次，
+    交给 flush_callback 一次性写出。队列写满时 put() 会等待，形成背压。
+    写出失败时按指数退避重试同一批次，不丢弃数据；只有关闭(或未启动后台任务)
+    时重试 stop_retries 次仍失败才放弃。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        flush_callback: Callable[[List[Any]], Awaitable[None]],
+        max_batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_queue_size: int = 10000,
+        retry_delay: float = 0.5,
+        max_retry_delay: float = 30.0,
+        stop_retries: int = 3
+    ):
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self._flush_callback = flush_callback
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.stop_retries = stop_retries
+        self._stop_requested = asyncio.Event()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def qsize(self) -> int:
+        """当前排队条目数"""
+        return self._queue.qsize()
+
+    async def put(self, item: Any):
+        """写入一条记录，队列满时等待(背压)"""
+        await self._queue.put(item)
+        WRITE_BUFFER_DEPTH.labels(buffer=self.name).set(self._queue.qsize())
+
+        # 未启动后台任务时(脚本/测试)，达到批量阈值即就地写出
+        if not self.running and self._queue.qsize() >= self.max_batch_size:
+            await self.flush()
+
+    def start(self):
+        """启动后台批量写出任务，需在事件循环内调用"""
+        if self.running:
+            return
+        self._stop_requested.clear()
+        self._task = asyncio.create_task(self._run(), name=f"write-buffer-{self.name}")
+        logger.info(f"写缓冲区 {self.name} 已启动")
+
+    async def stop(self):
+        """停止后台任务并写出全部剩余数据"""
+        if self.running:
+            self._stop_requested.set()
+            await self._queue.put(_STOP)
+            await self._task
+        self._task = None
+        await self.flush()
+        logger.info(f"写缓冲区 {self.name} 已关闭")
+
+    async def flush(self):
+        """立即写出队列中的全部数据"""
+        while True:
+            batch = self._drain_nowait(self.max_batch_size)
+            if not batch:
+                return
+            await self._flush_with_retry(batch)
+
+    async def _run(self):
+        """后台主循环: 收集批次 -> 写出"""
+        while True:
+            batch, stopping = await self._collect()
+            if batch:
+                await self._flush_with_retry(batch)
+            if stopping:
+                return
+
+    async def _collect(self):
+        """收集一个批次，达到数量上限或时间窗口到期即返回"""
+        item = await self._queue.get()
+        if item is _STOP:
+            return [], True
+
+        batch = [item]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.max_batch_size:
+            # 先取走已就绪的数据，避免逐条等待
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _drain_nowait(self, limit: int) -> List[Any]:
+        """非阻塞地取出至多limit条数据"""
+        batch = []
+        while len(batch) < limit:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+        return batch
+
+    async def _flush_with_retry(self, batch: List[Any]):
+        """写出批次，失败时退避重试(重试期间新数据留在有界队列中，形成背压)"""
+        delay = self.retry_delay
+        failures = 0
+        while not await self._flush(batch):
+            failures += 1
+            if self._stop_requested.is_set() or not self.running:
+                if failures > self.stop_retries:
+                    logger.error(f"写缓冲区 {self.name} 关闭时仍无法写出，丢弃{len(batch)}条")
+                    return
+                await asyncio.sleep(self.retry_delay)
+                continue
+            try:
+                # 等待期间收到关闭信号时提前进入有限重试
+                await asyncio.wait_for(self._stop_requested.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, self.max_retry_delay)
+
+    async def _flush(self, batch: List[Any]) -> bool:
+        """写出单个批次并记录指标，返回是否成功"""
+        start = time.perf_counter()
+        async with self._flush_lock:
+            try:
+                await self._flush_callback(batch)
+                WRITE_BUFFER_FLUSHED.labels(buffer=self.name).inc(len(batch))
+                return True
+            except Exception as e:
+                logger.error(f"写缓冲区 {self.name} 批量写出失败({len(batch)}条)，稍后重试: {e}")
+                WRITE_BUFFER_FAILURES.labels(buffer=self.name).inc()
+                return False
+            finally:
+                WRITE_BUFFER_FLUSH_SECONDS.labels(buffer=self.name).observe(
+                    time.perf_counter() - start
+                )
+                WRITE_BUFFER_DEPTH.labels(buffer=self.name).set(self._queue.qsize())
@@ -0,0 +1,317 @@
+import asyncio
+import glob
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import tempfile
+import time
+from multiprocessing.connection import wait
+from typing import Callable, Dict, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+import h11
+from prometheus_client import multiprocess
+from redis.exceptions import RedisError
+from telegram import Bot, Update
+from telegram.ext import BaseUpdateProcessor
+
+from src.sharding import ShardRouter
+from src.utils.metrics import (
+    WEBHOOK_REQUESTS,
+    WEBHOOK_REQUEST_SECONDS,
+    WEBHOOK_QUEUE_DEPTH,
+    start_multiprocess_metrics_server
+)
+
+logger = logging.getLogger(__name__)
+
+# Telegram携带密钥的请求头
+SECRET_HEADER = b'x-telegram-bot-api-secret-token'
+
+# 单个更新的最大请求体(Telegram更新远小于该值)
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class WebhookServer:
+    """Webhook接入服务
+
+    基于asyncio流与h11的轻量HTTP服务(h11随python-telegram-bot的httpx依赖安装)，
+    校验密钥后将更新放入有界队列，由Application的分发循环消费。
+    队列已满时返回503，Telegram会稍后重试，从而形成背压而不是无限堆积。
+    reuse_port 开启时多个进程可监听同一端口，由内核分配连接；
+    配合 router 将其他分片的群组更新转发给所属进程。
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        update_queue: asyncio.Queue,
+        listen: Optional[str] = None,
+        port: Optional[int] = None,
+        path: Optional[str] = None,
+        secret_token: Optional[str] = None,
+        reuse_port: bool = False,
+        idle_timeout: float = 75.0,
+        router: Optional[ShardRouter] = None,
+        update_processor: Optional[BaseUpdateProcessor] = None
+    ):
+        self.bot = bot
+        self.update_queue = update_queue
+        self.listen = listen or os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+        self.port = port if port is not None else int(os.getenv('WEBHOOK_PORT', '8443'))
+        self.path = path or webhook_path()
+        self.secret_token = secret_token if secret_token is not None else os.getenv(
+            'WEBHOOK_SECRET_TOKEN', ''
+        )
+        self.reuse_port = reuse_port
+        self.idle_timeout = idle_timeout
+        self.router = router
+        self.update_processor = update_processor
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Dict[asyncio.Task, asyncio.StreamWriter] = {}
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def bound_port(self) -> int:
+        """实际监听的端口(port=0时由系统分配)"""
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self):
+        """开始监听"""
+        self._server = await asyncio.start_server(
+            self._handle_connection,
+            self.listen,
+            self.port,
+            reuse_port=self.reuse_port or None,
+            backlog=1024
+        )
+        if self.router is not None:
+            self.router.start()
+        self.logger.info(f"Webhook服务监听 {self.listen}:{self.bound_port}{self.path}")
+
+    async def stop(self):
+        """停止接收新连接并关闭现有连接"""
+        if self._server is None:
+            return
+        self._server.close()
+        # 关闭空闲的keep-alive连接，处理中的请求会先完成应答
+        for writer in self._connections.values():
+            writer.transport.close()
+        if self._connections:
+            await asyncio.wait(list(self._connections), timeout=5)
+        await self._server.wait_closed()
+        self._server = None
+        if self.router is not None:
+            await self.router.stop()
+
+    async def handle_request(
+        self,
+        method: bytes,
+        target: bytes,
+        headers: Sequence[Tuple[bytes, bytes]],
+        body: bytes
+    ) -> Tuple[int, dict]:
+        """处理单个请求，返回(状态码, 额外响应头)"""
+        if target.split(b'?', 1)[0].decode('latin-1') != self.path:
+            return 404, {}
+        if method != b'POST':
+            return 405, {'Allow': 'POST'}
+
+        if self.secret_token:
+            token = next((value for name, value in headers if name == SECRET_HEADER), b'')
+            if not hmac.compare_digest(token, self.secret_token.encode()):
+                return 403, {}
+
+        try:
+            update = Update.de_json(json.loads(body), self.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            self.logger.warning(f"无法解析Webhook更新: {e}")
+            return 400, {}
+
+        if self._saturated():
+            return 503, {'Retry-After': '1'}
+        try:
+            if self.router is not None:
+                await self.router.dispatch(update)
+            else:
+                self.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            return 503, {'Retry-After': '1'}
+        except RedisError as e:
+            self.logger.error(f"转发更新失败: {e}")
+            return 503, {'Retry-After': '1'}
+        WEBHOOK_QUEUE_DEPTH.set(self.update_queue.qsize())
+        return 200, {}
+
+    def _saturated(self) -> bool:
+        """并发处理模式下分发循环会立即取空队列，改以处理器的在途更新数判断是否过载"""
+        processor = self.update_processor
+        return processor is not None and (
+            processor.current_concurrent_updates >= processor.max_concurrent_updates
+        )
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """处理单个连接(支持keep-alive，Telegram会复用连接)"""
+        conn = h11.Connection(h11.SERVER)
+        request = None
+        body = bytearray()
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                event = conn.next_event()
+                if event is h11.NEED_DATA:
+                    data = await asyncio.wait_for(reader.read(65536), self.idle_timeout)
+                    conn.receive_data(data)
+                elif isinstance(event, h11.Request):
+                    request = event
+                    body.clear()
+                elif isinstance(event, h11.Data):
+                    body += event.data
+                    if len(body) > MAX_BODY_SIZE:
+                        await self._respond(conn, writer, 413, {})
+                        break
+                elif isinstance(event, h11.EndOfMessage):
+                    start = time.perf_counter()
+                    status, headers = await self.handle_request(
+                        request.method, request.target, request.headers, bytes(body)
+                    )
+                    WEBHOOK_REQUEST_SECONDS.observe(time.perf_counter() - start)
+                    await self._respond(conn, writer, status, headers)
+                    if conn.our_state is h11.MUST_CLOSE:
+                        break
+                    conn.start_next_cycle()
+                else:
+                    # ConnectionClosed 或 PAUSED
+                    break
+        except h11.RemoteProtocolError:
+            if conn.our_state in (h11.IDLE, h11.SEND_RESPONSE):
+                await self._respond(conn, writer, 400, {})
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+    async def _respond(self, conn: h11.Connection, writer: asyncio.StreamWriter, status: int, headers: dict):
+        """发送无响应体的应答"""
+        WEBHOOK_REQUESTS.labels(status=str(status)).inc()
+        headers = [(name, value) for name, value in headers.items()]
+        headers.append(('Content-Length', '0'))
+        writer.write(conn.send(h11.Response(status_code=status, headers=headers)))
+        writer.write(conn.send(h11.EndOfMessage()))
+        await writer.drain()
+
+
+def webhook_path() -> str:
+    """监听路径，默认取 WEBHOOK_URL 的路径部分"""
+    path = os.getenv('WEBHOOK_PATH') or urlsplit(os.getenv('WEBHOOK_URL', '')).path
+    return path or '/webhook'
+
+
+async def register_webhook(bot: Bot, url: str, secret_token: str = '', max_connections: Optional[int] = None):
+    """向Telegram注册Webhook地址(订阅全部更新类型)"""
+    await bot.set_webhook(
+        url,
+        secret_token=secret_token or None,
+        max_connections=max_connections or int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40')),
+        allowed_updates=Update.ALL_TYPES
+    )
+    logger.info(f"已注册Webhook: {url}")
+
+
+async def serve_application(application, server: WebhookServer, stop_signals=(signal.SIGINT, signal.SIGTERM)):
+    """以Webhook方式运行Application
+
+    与 run_polling 相同的生命周期: initialize -> post_init -> start -> 等待停止信号
+    -> stop -> post_stop -> shutdown -> post_shutdown。
+    """
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in stop_signals:
+        loop.add_signal_handler(sig, stopping.set)
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await server.start()
+        await application.start()
+        await stopping.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def run_workers(target: Callable[[], None], count: int, metrics_port: Optional[int] = None):
+    """启动count个工作进程运行target，并监督其退出
+
+    每个子进程设置 WORKER_INDEX/WORKER_COUNT/WORKER_GROUP(分片路由)，
+    并在 WORKER_ID(默认主机名)后追加序号，使各进程的消息入库队列互不干扰。
+    指定 metrics_port 时开启Prometheus多进程模式，由本进程汇总输出各工作进程的指标。
+    任一子进程退出时停止其余进程，交由外部进程管理器整体重启。
+    """
+    context = multiprocessing.get_context('spawn')
+    base_id = os.getenv('WORKER_ID') or socket.gethostname()
+    os.environ['WORKER_COUNT'] = str(count)
+    os.environ['WORKER_GROUP'] = base_id
+
+    if metrics_port:
+        metrics_dir = os.environ.setdefault(
+            'PROMETHEUS_MULTIPROC_DIR', tempfile.mkdtemp(prefix='bot-metrics-')
+        )
+        # 清理上次运行残留的指标文件
+        for stale in glob.glob(os.path.join(metrics_dir, '*.db')):
+            os.remove(stale)
+        start_multiprocess_metrics_server(metrics_port)
+        logger.info(f"Prometheus多进程指标服务启动在 {metrics_port} 端口")
+
+    processes = []
+    for index in range(count):
+        process = context.Process(
+            target=_worker_main,
+            args=(target, index, f"{base_id}-{index}"),
+            name=f"worker-{index}"
+        )
+        process.start()
+        processes.append(process)
+    logger.info(f"已启动 {count} 个工作进程")
+
+    def terminate(*args):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        wait([process.sentinel for process in processes])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        terminate()
+        for process in processes:
+            process.join()
+            if metrics_port:
+                multiprocess.mark_process_dead(process.pid)
+
+    failed = [p.name for p in processes if p.exitcode not in (0, -signal.SIGTERM)]
+    if failed:
+        logger.error(f"工作进程异常退出: {', '.join(failed)}")
+    return 1 if failed else 0
+
+
+def _worker_main(target: Callable[[], None], index: int, worker_id: str):
+    """工作进程入口"""
+    os.environ['WORKER_INDEX'] = str(index)
+    os.environ['WORKER_ID'] = worker_id
+    target()
@@ -1,13 +1,73 @@
+import asyncio
 import logging
+import os
+import time
 from datetime import datetime
-from typing import Optional, Dict
+from string import Formatter
+from typing import Optional, Dict, List, Tuple
 from telegram import Update, Message, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, CallbackContext
 from sqlalchemy.orm import Session
-from redis import Redis
+from redis.exceptions import ResponseError
+from src.member_management import BulkModerator
+from src.outbox import outbox, PRIORITY_NORMAL
+from src.user_profiles import profile_cache
+from src.utils.cache import TTLCache
+from src.utils.leader import LeaderElection
+from src.utils.metrics import (
+    PENDING_VERIFICATIONS,
+    PENDING_VERIFICATIONS_MEMORY,
+    VERIFICATION_SWEEP_SECONDS,
+    VERIFICATION_TIMEOUTS
+)
+from src.utils.redis_client import redis_manager
 
-# Redis连接
-redis_conn = Redis(host='localhost', port=6379, db=3)
+# Redis连接(共享连接池，welcome命名空间)
+redis_conn = redis_manager.namespace('welcome')
+
+# 群配置变更通知频道，各实例收到后失效本地缓存
+CONFIG_CHANNEL = redis_conn.key("config_changed")
+
+# 有待验证成员的群集合(供超时清理遍历)
+PENDING_CHATS_KEY = redis_conn.key("pending_chats")
+
+def _pending_key(chat_id: int) -> str:
+    """待验证成员有序集合(按入群时间排序)"""
+    return redis_conn.key(f"pending_verify:{chat_id}")
+
+def _batch_key(chat_id: int, message_id: int) -> str:
+    """合并欢迎消息中尚未验证的成员集合"""
+    return redis_conn.key(f"verify_batch:{chat_id}:{message_id}")
+
+class WelcomeTemplate:
+    """预解析的欢迎语模板
+
+    解析结果随群配置一起缓存，渲染时不再重复解析格式串；
+    含下标/属性等复杂字段时退回 str.format。
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self._parts = list(Formatter().parse(text))
+        self._simple = all(
+            field is None or field.isidentifier()
+            for _, field, _, _ in self._parts
+        )
+
+    def render(self, **fields) -> str:
+        """渲染模板"""
+        if not self._simple:
+            return self.text.format(**fields)
+        
+        formatter = Formatter()
+        chunks = []
+        for literal, field, spec, conversion in self._parts:
+            chunks.append(literal)
+            if field is None:
+                continue
+            value = formatter.convert_field(fields[field], conversion)
+            chunks.append(format(value, spec or ''))
+        return ''.join(chunks)
 
 class WelcomeSystem:
     """新人欢迎系统"""
@@ -20,80 +80,333 @@ class WelcomeSystem:
         "3. 遵守法律法规"
     )
 
-    def __init__(self, session: Session):
+    # 单条欢迎消息最多合并的成员数(避免超出消息长度限制)
+    MAX_MEMBERS_PER_MESSAGE = 50
+
+    def __init__(
+        self,
+        session: Session,
+        debounce_seconds: Optional[float] = None,
+        cache_ttl: Optional[float] = None
+    ):
         self.session = session
         self.logger = logging.getLogger(__name__)
+        
+        # 群配置缓存: chat_id -> (预解析模板, 是否启用验证)
+        self.config_cache = TTLCache(
+            'welcome_config',
+            maxsize=int(os.getenv('WELCOME_CACHE_SIZE', '4096')),
+            ttl=cache_ttl if cache_ttl is not None else float(
+                os.getenv('WELCOME_CACHE_TTL', '300')
+            )
+        )
+        self._listener: Optional[asyncio.Task] = None
+        
+        # 验证超时: 超时未验证的成员按 verify_timeout_action 处理(kick/mute/ban/none)
+        self.verify_timeout = int(os.getenv('VERIFY_TIMEOUT', '600'))
+        self.verify_timeout_action = os.getenv('VERIFY_TIMEOUT_ACTION', 'kick')
+        self.sweep_interval = float(os.getenv('VERIFY_SWEEP_INTERVAL', '60'))
+        self.sweep_batch_size = 200
+        self._sweeper: Optional[asyncio.Task] = None
+        self.leader: Optional[LeaderElection] = None
+        
+        # 防抖窗口: 大于0时，窗口内同一群的入群成员合并为一条欢迎消息
+        if debounce_seconds is None:
+            debounce_seconds = float(os.getenv('WELCOME_DEBOUNCE_SECONDS', '0'))
+        self.debounce_seconds = debounce_seconds
+        self._pending: Dict[int, List] = {}
+        self._pending_tasks: Dict[int, asyncio.Task] = {}
 
     async def handle_new_member(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理新成员加入事件"""
         try:
-            from src.monitoring.system_monitor import SystemMonitor
-            SystemMonitor.REQUEST_COUNT.inc()
-            
             if not update.message or not update.message.new_chat_members:
                 return
 
             chat_id = update.effective_chat.id
-            for new_member in update.message.new_chat_members:
-                # 获取群组自定义欢迎语
-                welcome_text = self._get_welcome_message(chat_id)
-                
-                # 替换模板变量
-                formatted_text = welcome_text.format(
-                    username=new_member.username or new_member.full_name,
-                    user_id=new_member.id
-                )
-                
-                # 发送欢迎消息
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=formatted_text,
-                    reply_markup=self._get_welcome_buttons(chat_id)
-                )
-                
-                # 记录新人加入
-                self._log_new_member(chat_id, new_member.id)
+            new_members = list(update.message.new_chat_members)
+            
+            # 一次管道写入全部新人
+            await self._log_new_members(chat_id, [member.id for member in new_members])
+            await profile_cache.remember_many(new_members)
+            
+            if self.debounce_seconds > 0:
+                self._schedule_welcome(chat_id, new_members, context.bot)
+            else:
+                await self._send_welcome(chat_id, new_members, context.bot)
+
+        except Exception as e:
+            self.logger.error(f"欢迎新成员失败: {e}")
 
+    def _schedule_welcome(self, chat_id: int, new_members: List, bot):
+        """将新人加入防抖窗口，窗口结束后统一欢迎"""
+        self._pending.setdefault(chat_id, []).extend(new_members)
+        if chat_id not in self._pending_tasks:
+            self._pending_tasks[chat_id] = asyncio.create_task(
+                self._flush_pending(chat_id, bot)
+            )
+
+    async def _flush_pending(self, chat_id: int, bot):
+        """防抖窗口结束，发送合并后的欢迎消息"""
+        try:
+            await asyncio.sleep(self.debounce_seconds)
+            new_members = self._pending.pop(chat_id, [])
+            self._pending_tasks.pop(chat_id, None)
+            await self._send_welcome(chat_id, new_members, bot)
         except Exception as e:
             self.logger.error(f"欢迎新成员失败: {e}")
 
-    def _get_welcome_message(self, chat_id: int) -> str:
+    async def _send_welcome(self, chat_id: int, new_members: List, bot):
+        """按群配置发送欢迎消息，多名新人合并为一条"""
+        if not new_members:
+            return
+        
+        # 群配置每次只读取一次
+        template, verified = await self._get_chat_config(chat_id)
+        reply_markup = self._verify_markup(chat_id) if verified else None
+        
+        for start in range(0, len(new_members), self.MAX_MEMBERS_PER_MESSAGE):
+            chunk = new_members[start:start + self.MAX_MEMBERS_PER_MESSAGE]
+            formatted_text = template.render(
+                username="、".join(
+                    member.username or member.full_name for member in chunk
+                ),
+                user_id=", ".join(str(member.id) for member in chunk)
+            )
+            message = await outbox.send_message(
+                bot,
+                chat_id,
+                formatted_text,
+                priority=PRIORITY_NORMAL,
+                reply_markup=reply_markup
+            )
+            if reply_markup is not None and message is not None:
+                # 记录这条消息对应的待验证成员，全部验证后才移除按钮
+                key = _batch_key(chat_id, message.message_id)
+                async with redis_conn.pipeline() as pipe:
+                    pipe.sadd(key, *[member.id for member in chunk])
+                    pipe.expire(key, self.verify_timeout * 2)
+                    await pipe.execute()
+
+    async def _get_chat_config(self, chat_id: int) -> Tuple[WelcomeTemplate, bool]:
+        """读取群欢迎语模板和验证开关(优先本地缓存，未命中时一次往返)"""
+        config = self.config_cache.get(chat_id)
+        if config is not None:
+            return config
+        
+        async with redis_conn.pipeline() as pipe:
+            pipe.get(redis_conn.key(f"welcome:{chat_id}"))
+            pipe.sismember(redis_conn.key("verified_chats"), chat_id)
+            custom_msg, verified = await pipe.execute()
+        
+        welcome_text = custom_msg.decode() if custom_msg else self.DEFAULT_WELCOME
+        config = (WelcomeTemplate(welcome_text), bool(verified))
+        self.config_cache.set(chat_id, config)
+        return config
+
+    @staticmethod
+    def _verify_markup(chat_id: int) -> InlineKeyboardMarkup:
+        """验证按钮"""
+        keyboard = [
+            [InlineKeyboardButton("我已阅读群规", callback_data=f"verify_{chat_id}")]
+        ]
+        return InlineKeyboardMarkup(keyboard)
+
+    async def _get_welcome_message(self, chat_id: int) -> str:
         """获取群组欢迎语"""
-        custom_msg = redis_conn.get(f"welcome:{chat_id}")
-        return custom_msg.decode() if custom_msg else self.DEFAULT_WELCOME
+        template, _ = await self._get_chat_config(chat_id)
+        return template.text
 
-    def _get_welcome_buttons(self, chat_id: int) -> Optional[InlineKeyboardMarkup]:
+    async def _get_welcome_buttons(self, chat_id: int) -> Optional[InlineKeyboardMarkup]:
         """获取欢迎按钮"""
         # 检查是否启用验证
-        if redis_conn.sismember("verified_chats", chat_id):
-            keyboard = [
-                [InlineKeyboardButton("我已阅读群规", callback_data=f"verify_{chat_id}")]
-            ]
-            return InlineKeyboardMarkup(keyboard)
-        return None
-
-    def _log_new_member(self, chat_id: int, user_id: int):
+        _, verified = await self._get_chat_config(chat_id)
+        return self._verify_markup(chat_id) if verified else None
+
+    async def _log_new_member(self, chat_id: int, user_id: int):
         """记录新成员"""
-        redis_conn.hset(
-            f"new_members:{chat_id}",
-            str(user_id),
-            str(datetime.now())
-        )
+        await self._log_new_members(chat_id, [user_id])
+
+    async def _log_new_members(self, chat_id: int, user_ids: List[int]):
+        """批量记录待验证新成员(一次管道)"""
+        if not user_ids:
+            return
+        joined_at = datetime.now().timestamp()
+        key = _pending_key(chat_id)
+        async with redis_conn.pipeline() as pipe:
+            pipe.zadd(key, {str(user_id): joined_at for user_id in user_ids})
+            # 清理任务停止时的兜底过期
+            pipe.expire(key, self.verify_timeout * 2)
+            pipe.sadd(PENDING_CHATS_KEY, chat_id)
+            await pipe.execute()
 
     async def verify_member(self, update: Update, context: CallbackContext):
-        """处理新人验证"""
+        """处理新人验证
+
+        合并欢迎消息的按钮由多名新人共用，单人验证成功只弹出提示，
+        消息中的全部成员都验证后才把消息改为验证成功(移除按钮)。
+        """
         query = update.callback_query
-        await query.answer()
-        
         chat_id = int(query.data.split("_")[1])
         user_id = query.from_user.id
         
-        # 验证是新成员
-        if redis_conn.hexists(f"new_members:{chat_id}", str(user_id)):
-            # 标记为已验证
-            redis_conn.hdel(f"new_members:{chat_id}", str(user_id))
+        # 验证是新成员，移出待验证集合即标记为已验证
+        if not await redis_conn.zrem(_pending_key(chat_id), str(user_id)):
+            await query.answer()
+            return
+        
+        key = _batch_key(chat_id, query.message.message_id)
+        async with redis_conn.pipeline(transaction=True) as pipe:
+            pipe.srem(key, user_id)
+            pipe.scard(key)
+            _, remaining = await pipe.execute()
+        
+        await query.answer("✅ 验证成功，欢迎加入群聊！", show_alert=False)
+        if not remaining:
             await query.edit_message_text("✅ 验证成功，欢迎加入群聊！")
 
-    def set_welcome_message(self, chat_id: int, message: str):
+    async def set_welcome_message(self, chat_id: int, message: str):
         """设置自定义欢迎语"""
-        redis_conn.set(f"welcome:{chat_id}", message)
\ No newline at end of file
+        await redis_conn.set(redis_conn.key(f"welcome:{chat_id}"), message)
+        await self._config_changed(chat_id)
+
+    async def set_verification(self, chat_id: int, enabled: bool):
+        """开启/关闭入群验证"""
+        key = redis_conn.key("verified_chats")
+        if enabled:
+            await redis_conn.sadd(key, chat_id)
+        else:
+            await redis_conn.srem(key, chat_id)
+        await self._config_changed(chat_id)
+
+    async def _config_changed(self, chat_id: int):
+        """失效本地缓存并通知其他实例"""
+        self.config_cache.invalidate(chat_id)
+        await redis_conn.publish(CONFIG_CHANNEL, str(chat_id))
+
+    async def start(self, bot=None, leader: Optional[LeaderElection] = None):
+        """订阅群配置变更通知；传入bot时同时启动验证超时清理
+
+        多实例部署时传入 leader，清理只在领导者上执行，避免重复踢出/解禁。
+        """
+        self.leader = leader
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        if bot is not None and (self._sweeper is None or self._sweeper.done()):
+            self._sweeper = asyncio.create_task(self._sweep_loop(bot))
+
+    async def stop(self):
+        """停止订阅和清理任务"""
+        for task in (self._listener, self._sweeper):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._listener = None
+        self._sweeper = None
+
+    async def _sweep_loop(self, bot):
+        """定期清理验证超时的成员"""
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            if self.leader is not None and not self.leader.is_leader:
+                continue
+            try:
+                await self.sweep_pending(bot)
+            except Exception as e:
+                self.logger.error(f"验证超时清理失败: {e}")
+
+    async def sweep_pending(self, bot) -> Dict:
+        """清理超时未验证的成员
+
+        启用验证的群按 verify_timeout_action 分批处理超时成员，
+        其余群只移除过期记录。
+        """
+        start = time.perf_counter()
+        cutoff = datetime.now().timestamp() - self.verify_timeout
+        expired_total = 0
+        moderated_total = 0
+        pending_total = 0
+        memory_total = 0
+        
+        for raw_chat_id in await redis_conn.smembers(PENDING_CHATS_KEY):
+            chat_id = int(raw_chat_id)
+            key = _pending_key(chat_id)
+            _, verified = await self._get_chat_config(chat_id)
+            moderate = verified and self.verify_timeout_action != 'none'
+            
+            while True:
+                expired = await redis_conn.zrangebyscore(
+                    key, '-inf', cutoff, start=0, num=self.sweep_batch_size
+                )
+                if not expired:
+                    break
+                if moderate:
+                    result = await BulkModerator(bot).run(
+                        chat_id,
+                        [int(user_id) for user_id in expired],
+                        action=self.verify_timeout_action
+                    )
+                    moderated_total += len(result['succeeded'])
+                    VERIFICATION_TIMEOUTS.labels(
+                        action=self.verify_timeout_action
+                    ).inc(len(result['succeeded']))
+                await redis_conn.zrem(key, *expired)
+                expired_total += len(expired)
+            
+            remaining = await redis_conn.zcard(key)
+            if remaining:
+                pending_total += remaining
+                memory_total += await self._memory_usage(key)
+            else:
+                await redis_conn.srem(PENDING_CHATS_KEY, chat_id)
+        
+        PENDING_VERIFICATIONS.set(pending_total)
+        PENDING_VERIFICATIONS_MEMORY.set(memory_total)
+        VERIFICATION_SWEEP_SECONDS.observe(time.perf_counter() - start)
+        return {
+            'expired': expired_total,
+            'moderated': moderated_total,
+            'pending': pending_total
+        }
+
+    async def _memory_usage(self, key: str) -> int:
+        """键占用的内存(部分Redis实现不支持MEMORY命令时返回0)"""
+        try:
+            return await redis_conn.memory_usage(key) or 0
+        except ResponseError:
+            return 0
+
+    async def _listen(self):
+        """接收变更通知，失效对应群的缓存；连接断开时清空缓存后重连"""
+        while True:
+            pubsub = redis_conn.pubsub()
+            try:
+                await pubsub.subscribe(CONFIG_CHANNEL)
+                async for message in pubsub.listen():
+                    if message['type'] != 'message':
+                        continue
+                    try:
+                        self.config_cache.invalidate(int(message['data']))
+                    except ValueError:
+                        self.config_cache.clear()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 断线期间可能错过通知，整体失效
+                self.logger.error(f"欢迎配置订阅中断: {e}")
+                self.config_cache.clear()
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+async def recent_joiners(chat_id: int, within_seconds: Optional[int] = None) -> List[int]:
+    """获取最近入群且尚未验证的成员ID"""
+    cutoff = '-inf'
+    if within_seconds is not None:
+        cutoff = datetime.now().timestamp() - within_seconds
+    entries = await redis_conn.zrangebyscore(_pending_key(chat_id), cutoff, '+inf')
+    return [int(user_id) for user_id in entries]
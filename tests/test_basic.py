@@ -16,7 +16,21 @@ class TestBasicFunctions(unittest.IsolatedAsyncioTestCase):
         await start(update, context)
         
         # 验证回复是否正确
-        update.message.reply_text.assert_awaited_once_with('欢迎使用群管机器人!')
+        update.message.reply_text.assert_awaited_once_with(
+            '欢迎使用群管机器人!\n\n'
+            '可用命令:\n'
+            '/start - 显示帮助\n'
+            '/checkin - 每日签到\n'
+            '/profile - 签到信息\n'
+            '/rank [today|7d|30d] - 活跃度排行\n'
+            '/pointsrank - 签到积分排行\n'
+            '/setwelcome - 设置欢迎语\n'
+            '/ban - 封禁用户\n'
+            '/mute - 禁言用户\n'
+            '/unban - 解封用户\n'
+            '/bulkban - 批量封禁\n'
+            '/bulkmute - 批量禁言'
+        )
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,61 @@
+import unittest
+
+from src.utils.cache import TTLCache
+from src.utils.metrics import CACHE_HITS, CACHE_MISSES
+
+class FakeClock:
+    """可手动推进的时钟"""
+    
+    def __init__(self):
+        self.now = 0.0
+    
+    def __call__(self):
+        return self.now
+
+class TestTTLCache(unittest.TestCase):
+    """测试进程内LRU/TTL缓存"""
+    
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TTLCache('test_cache', maxsize=2, ttl=10, clock=self.clock)
+    
+    def test_expiry(self):
+        """测试条目过期"""
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        
+        self.clock.now = 11
+        self.assertIsNone(self.cache.get('a'))
+        self.assertNotIn('a', self.cache)
+    
+    def test_lru_eviction(self):
+        """测试超出容量时淘汰最久未使用条目"""
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')  # a变为最近使用
+        self.cache.set('c', 3)
+        
+        self.assertIn('a', self.cache)
+        self.assertNotIn('b', self.cache)
+        self.assertEqual(len(self.cache), 2)
+    
+    def test_invalidate(self):
+        """测试主动失效"""
+        self.cache.set('a', 1)
+        self.cache.invalidate('a')
+        self.assertIsNone(self.cache.get('a'))
+    
+    def test_hit_miss_metrics(self):
+        """测试命中/未命中计数"""
+        hits = CACHE_HITS.labels(cache='test_cache')._value.get()
+        misses = CACHE_MISSES.labels(cache='test_cache')._value.get()
+        
+        self.cache.set('a', 1)
+        self.cache.get('a')
+        self.cache.get('b')
+        
+        self.assertEqual(CACHE_HITS.labels(cache='test_cache')._value.get(), hits + 1)
+        self.assertEqual(CACHE_MISSES.labels(cache='test_cache')._value.get(), misses + 1)
+
+if __name__ == '__main__':
+    unittest.main()
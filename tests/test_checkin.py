@@ -1,10 +1,17 @@
 import unittest
 from datetime import datetime, timedelta
 from unittest.mock import AsyncMock, MagicMock, patch
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect
 from sqlalchemy.orm import sessionmaker
 
-from src.checkin import UserCheckIn, calculate_level, handle_checkin, Base
+from fakeredis import FakeAsyncRedis, FakeServer
+
+from src.checkin import (
+    UserCheckIn, UserCheckInSummary, calculate_level, handle_checkin, handle_profile,
+    backfill_checkin_summaries, get_points_leaderboard, get_points_rank,
+    Base, _apply_checkin, redis_conn
+)
+from src.utils.redis_client import redis_manager
 
 class TestCheckInSystem(unittest.IsolatedAsyncioTestCase):
     """测试签到系统"""
@@ -14,6 +21,13 @@ class TestCheckInSystem(unittest.IsolatedAsyncioTestCase):
         self.engine = create_engine('sqlite:///:memory:')
         Base.metadata.create_all(self.engine)
         self.Session = sessionmaker(bind=self.engine)
+        
+        # 使用fakeredis替代Redis服务
+        redis_manager.use_client(FakeAsyncRedis(server=FakeServer()))
+    
+    def tearDown(self):
+        redis_manager.use_client(None)
+        self.engine.dispose()
     
     async def test_first_checkin(self):
         """测试首次签到"""
@@ -27,6 +41,7 @@ class TestCheckInSystem(unittest.IsolatedAsyncioTestCase):
         
         update = MagicMock()
         update.effective_user = user
+        update.effective_chat.id = 456
         update.message = AsyncMock()
         
         # 调用签到处理
@@ -49,6 +64,7 @@ class TestCheckInSystem(unittest.IsolatedAsyncioTestCase):
         # 添加昨天的签到记录
         yesterday = datetime.now().date() - timedelta(days=1)
         session.add(UserCheckIn(
+            chat_id=456,
             user_id=user.id,
             username=user.username,
             checkin_date=yesterday,
@@ -61,6 +77,7 @@ class TestCheckInSystem(unittest.IsolatedAsyncioTestCase):
         
         update = MagicMock()
         update.effective_user = user
+        update.effective_chat.id = 456
         update.message = AsyncMock()
         
         # 调用签到处理
@@ -83,6 +100,7 @@ class TestCheckInSystem(unittest.IsolatedAsyncioTestCase):
         session = self.Session()
         # 添加今天的签到记录
         session.add(UserCheckIn(
+            chat_id=456,
             user_id=user.id,
             username=user.username,
             checkin_date=datetime.now().date(),
@@ -95,6 +113,7 @@ class TestCheckInSystem(unittest.IsolatedAsyncioTestCase):
         
         update = MagicMock()
         update.effective_user = user
+        update.effective_chat.id = 456
         update.message = AsyncMock()
         
         # 调用签到处理
@@ -105,6 +124,191 @@ class TestCheckInSystem(unittest.IsolatedAsyncioTestCase):
             f'@{user.username} 今天已经签到过了哦~'
         )
 
+    def test_unique_index(self):
+        """测试(chat_id, user_id, checkin_date)唯一索引"""
+        indexes = inspect(self.engine).get_indexes('user_checkins')
+        index = next(i for i in indexes if i['name'] == 'uq_user_checkins_chat_user_date')
+        self.assertEqual(index['column_names'], ['chat_id', 'user_id', 'checkin_date'])
+        self.assertTrue(index['unique'])
+
+    def test_streak_across_month_boundary(self):
+        """测试跨月连续签到"""
+        user = MagicMock()
+        user.id = 123
+        user.username = 'test_user'
+        session = self.Session()
+        
+        _apply_checkin(session, 456, user, datetime(2024, 2, 29).date())
+        result = _apply_checkin(session, 456, user, datetime(2024, 3, 1).date())
+        self.assertEqual(result['streak_days'], 2)
+        self.assertEqual(result['points'], 20)
+
+    async def test_double_tap_checkin(self):
+        """测试连续两次签到只记录一次"""
+        user = MagicMock()
+        user.id = 123
+        user.username = 'test_user'
+        session = self.Session()
+        
+        update = MagicMock()
+        update.effective_user = user
+        update.effective_chat.id = 456
+        update.message = AsyncMock()
+        factory = MagicMock(return_value=session)
+        
+        await handle_checkin(update, None, factory)
+        await handle_checkin(update, None, factory)
+        
+        self.assertEqual(session.query(UserCheckIn).count(), 1)
+        update.message.reply_text.assert_awaited_with(f'@{user.username} 今天已经签到过了哦~')
+
+    def test_summary_accumulates_points(self):
+        """测试汇总表累计积分与等级"""
+        user = MagicMock()
+        user.id = 123
+        user.username = 'test_user'
+        session = self.Session()
+        start = datetime(2024, 1, 1).date()
+        
+        for day in range(5):  # 10+20+30+40+50
+            result = _apply_checkin(session, 456, user, start + timedelta(days=day))
+        
+        self.assertEqual(result['total_points'], 150)
+        self.assertEqual(result['level'], calculate_level(150))
+        summary = session.get(UserCheckInSummary, (456, 123))
+        self.assertEqual(summary.streak_days, 5)
+        self.assertEqual(summary.last_checkin_date, start + timedelta(days=4))
+        
+        # 其他群独立统计
+        self.assertEqual(_apply_checkin(session, 789, user, start)['total_points'], 10)
+
+    def test_backfill_summaries(self):
+        """测试根据历史记录重建汇总表"""
+        session = self.Session()
+        start = datetime(2024, 1, 1).date()
+        for day, streak in enumerate([1, 2, 3]):
+            session.add(UserCheckIn(
+                chat_id=456, user_id=123, username='test_user',
+                checkin_date=start + timedelta(days=day),
+                streak_days=streak, total_points=streak * 10
+            ))
+        session.commit()
+        
+        self.assertEqual(backfill_checkin_summaries(session), 1)
+        summary = session.get(UserCheckInSummary, (456, 123))
+        self.assertEqual(summary.total_points, 60)
+        self.assertEqual(summary.streak_days, 3)
+        self.assertEqual(summary.last_checkin_date, start + timedelta(days=2))
+        
+        # 重复执行结果不变
+        backfill_checkin_summaries(session)
+        session.expire_all()
+        self.assertEqual(session.get(UserCheckInSummary, (456, 123)).total_points, 60)
+        
+        # 明细被保留策略清理后重建不扣减累计积分
+        session.query(UserCheckIn).filter(UserCheckIn.checkin_date < start + timedelta(days=2)).delete()
+        session.commit()
+        backfill_checkin_summaries(session)
+        session.expire_all()
+        summary = session.get(UserCheckInSummary, (456, 123))
+        self.assertEqual(summary.total_points, 60)
+        self.assertEqual(summary.level, 1)
+
+    async def test_profile(self):
+        """测试个人签到信息读取汇总表"""
+        user = MagicMock()
+        user.id = 123
+        user.username = 'test_user'
+        session = self.Session()
+        update = MagicMock()
+        update.effective_user = user
+        update.effective_chat.id = 456
+        update.message = AsyncMock()
+        factory = MagicMock(return_value=session)
+        
+        await handle_checkin(update, None, factory)
+        await handle_profile(update, None, factory)
+        
+        text = update.message.reply_text.call_args[0][0]
+        self.assertIn('连续签到: 1天', text)
+        self.assertIn('累计积分: 10', text)
+
+    async def test_points_leaderboard(self):
+        """测试签到积分排行随签到更新"""
+        session = self.Session()
+        factory = MagicMock(return_value=session)
+        for user_id, streak in [(1, 1), (2, 4)]:
+            session.add(UserCheckIn(
+                chat_id=456, user_id=user_id,
+                checkin_date=datetime.now().date() - timedelta(days=1),
+                streak_days=streak, total_points=streak * 10
+            ))
+        session.commit()
+        backfill_checkin_summaries(session)
+        
+        user = MagicMock()
+        user.id = 1
+        user.username = 'user_1'
+        update = MagicMock()
+        update.effective_user = user
+        update.effective_chat.id = 456
+        update.message = AsyncMock()
+        await handle_checkin(update, None, factory)  # 10 + 今日20
+        
+        rankings = await get_points_leaderboard(456, 10, factory)
+        self.assertEqual(rankings, [
+            {"user_id": 2, "points": 40},
+            {"user_id": 1, "points": 30}
+        ])
+        self.assertEqual(await get_points_rank(456, 1, factory), {"rank": 2, "points": 30})
+        self.assertIsNone(await get_points_rank(456, 999, factory))
+
+    async def test_points_leaderboard_rebuild(self):
+        """测试排行集合缺失时从数据库重建"""
+        session = self.Session()
+        factory = MagicMock(return_value=session)
+        start = datetime(2024, 1, 1).date()
+        user = MagicMock()
+        for user_id, days in [(1, 1), (2, 2)]:
+            user.id = user_id
+            user.username = f'user_{user_id}'
+            for day in range(days):
+                _apply_checkin(session, 456, user, start + timedelta(days=day))
+        
+        await redis_conn.delete(redis_conn.key("points:456"))
+        
+        rankings = await get_points_leaderboard(456, 10, factory)
+        self.assertEqual(rankings, [
+            {"user_id": 2, "points": 30},
+            {"user_id": 1, "points": 10}
+        ])
+        self.assertEqual(await get_points_rank(456, 1, factory), {"rank": 2, "points": 10})
+
+    async def test_async_session_checkin(self):
+        """测试异步会话下的签到"""
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+        
+        engine = create_async_engine('sqlite+aiosqlite:///:memory:')
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        AsyncSession = async_sessionmaker(engine, expire_on_commit=False)
+        
+        user = MagicMock()
+        user.id = 123
+        user.username = 'test_user'
+        update = MagicMock()
+        update.effective_user = user
+        update.effective_chat.id = 456
+        update.message = AsyncMock()
+        
+        async with AsyncSession() as session:
+            await handle_checkin(update, None, MagicMock(return_value=session))
+            count = await session.run_sync(lambda s: s.query(UserCheckIn).count())
+        
+        self.assertEqual(count, 1)
+        self.assertIn('签到成功', update.message.reply_text.call_args[0][0])
+        await engine.dispose()
+
     def test_level_calculation(self):
         """测试等级计算"""
         self.assertEqual(calculate_level(50), 1)
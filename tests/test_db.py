@@ -0,0 +1,176 @@
+import os
+import tempfile
+import unittest
+from sqlalchemy import text, inspect
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.utils.db import DatabaseManager, to_async_url, pool_options, open_session, run_in_session
+from src.utils.db import add_missing_columns, create_missing_indexes, drop_obsolete_indexes, widen_statement
+from src.utils.metrics import DB_POOL_CHECKED_OUT
+from src.checkin import Base, UserCheckIn
+
+class TestDatabaseManager(unittest.IsolatedAsyncioTestCase):
+    """测试数据库连接管理器"""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_url = f"sqlite:///{os.path.join(self.tmpdir.name, 'test.db')}"
+    
+    async def asyncTearDown(self):
+        self.tmpdir.cleanup()
+    
+    def test_async_url(self):
+        """测试异步驱动地址转换"""
+        self.assertEqual(to_async_url('sqlite:///db/a.db'), 'sqlite+aiosqlite:///db/a.db')
+        self.assertEqual(
+            to_async_url('postgresql://u:p@host/db'),
+            'postgresql+asyncpg://u:p@host/db'
+        )
+        with self.assertRaises(ValueError):
+            to_async_url('oracle://host/db')
+    
+    def test_pool_options_from_env(self):
+        """测试连接池参数读取环境变量"""
+        os.environ['DB_POOL_SIZE'] = '7'
+        try:
+            options = pool_options(self.db_url)
+        finally:
+            del os.environ['DB_POOL_SIZE']
+        self.assertEqual(options['pool_size'], 7)
+        self.assertEqual(pool_options('sqlite:///:memory:'), {})
+    
+    async def test_async_session(self):
+        """测试异步会话提交"""
+        manager = DatabaseManager(self.db_url, async_mode=True)
+        Base.metadata.create_all(manager.engine)
+        
+        async with manager.get_async_session() as session:
+            await run_in_session(session, lambda s: s.add(UserCheckIn(
+                user_id=1,
+                checkin_date=__import__('datetime').date.today()
+            )))
+        
+        async with manager.get_async_session() as session:
+            count = await session.scalar(text("SELECT count(*) FROM user_checkins"))
+        self.assertEqual(count, 1)
+        await manager.dispose()
+    
+    async def test_sync_manager_rejects_async_session(self):
+        """测试未启用异步模式时获取异步会话报错"""
+        manager = DatabaseManager(self.db_url, async_mode=False)
+        with self.assertRaises(RuntimeError):
+            async with manager.get_async_session():
+                pass
+        await manager.dispose()
+    
+    async def test_pool_metrics(self):
+        """测试连接池指标随借出/归还更新"""
+        manager = DatabaseManager(self.db_url, async_mode=False)
+        gauge = DB_POOL_CHECKED_OUT.labels(engine='sync')
+        before = gauge._value.get()
+        with manager.engine.connect():
+            self.assertEqual(gauge._value.get(), before + 1)
+        self.assertEqual(gauge._value.get(), before)
+        await manager.dispose()
+    
+    async def test_open_session_sources(self):
+        """测试open_session兼容会话对象与上下文管理器工厂"""
+        manager = DatabaseManager(self.db_url, async_mode=False)
+        session = manager.Session()
+        async with open_session(session) as s:
+            self.assertIs(s, session)
+        async with open_session(manager.get_session) as s:
+            self.assertEqual(s.execute(text("SELECT 1")).scalar(), 1)
+        session.close()
+        await manager.dispose()
+
+    async def test_create_missing_indexes(self):
+        """测试为已存在的表补建索引并删除废弃索引"""
+        from src.message_stats import MessageRecord
+        manager = DatabaseManager(self.db_url, async_mode=False)
+        Base.metadata.create_all(manager.engine)
+        with manager.engine.begin() as conn:
+            conn.execute(text("DROP INDEX ix_message_stats_timestamp"))
+            # 旧版本遗留的索引
+            conn.execute(text("CREATE INDEX ix_message_stats_chat_ts ON message_stats (chat_id, timestamp)"))
+        
+        create_missing_indexes(Base.metadata, manager.engine)
+        drop_obsolete_indexes(Base.metadata, manager.engine)
+        
+        indexes = {i['name'] for i in inspect(manager.engine).get_indexes('message_stats')}
+        self.assertIn('ix_message_stats_timestamp', indexes)
+        self.assertNotIn('ix_message_stats_chat_ts', indexes)
+        await manager.dispose()
+
+    async def test_add_missing_columns(self):
+        """测试旧版user_checkins补加chat_id后可以建唯一索引"""
+        manager = DatabaseManager(self.db_url, async_mode=False)
+        with manager.engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE user_checkins (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+                "username VARCHAR, checkin_date DATE NOT NULL, streak_days INTEGER, total_points INTEGER)"
+            ))
+            conn.execute(text(
+                "INSERT INTO user_checkins (user_id, username, checkin_date, streak_days, total_points) "
+                "VALUES (1, 'a', '2024-01-01', 1, 10)"
+            ))
+        Base.metadata.create_all(manager.engine)
+        
+        add_missing_columns(Base.metadata, manager.engine)
+        add_missing_columns(Base.metadata, manager.engine)
+        create_missing_indexes(Base.metadata, manager.engine)
+        
+        indexes = {i['name'] for i in inspect(manager.engine).get_indexes('user_checkins')}
+        self.assertIn('uq_user_checkins_chat_user_date', indexes)
+        with manager.get_session() as session:
+            record = session.query(UserCheckIn).one()
+            self.assertEqual(record.chat_id, 0)
+            session.add(UserCheckIn(chat_id=5, user_id=2, checkin_date=record.checkin_date))
+        await manager.dispose()
+
+    def test_widen_statement(self):
+        """测试旧INTEGER的ID列改为BIGINT的DDL"""
+        from src.message_stats import MessageRecord
+        chat_id = MessageRecord.__table__.c.chat_id
+        self.assertEqual(
+            widen_statement('postgresql', 'message_stats', chat_id),
+            "ALTER TABLE message_stats ALTER COLUMN chat_id TYPE BIGINT"
+        )
+        self.assertEqual(
+            widen_statement('mysql', 'message_stats', chat_id),
+            "ALTER TABLE message_stats MODIFY chat_id BIGINT NOT NULL"
+        )
+
+    async def test_unique_index_on_legacy_duplicates(self):
+        """测试旧表中的重复签到在建唯一索引前被清理，建索引失败时终止启动"""
+        from src.checkin import remove_duplicate_checkins
+        manager = DatabaseManager(self.db_url, async_mode=False)
+        with manager.engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE user_checkins (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+                "username VARCHAR, checkin_date DATE NOT NULL, streak_days INTEGER, total_points INTEGER)"
+            ))
+            for user_id, day in ((1, '2024-01-01'), (1, '2024-01-01'), (1, '2024-01-02'), (2, '2024-01-01')):
+                conn.execute(text(
+                    "INSERT INTO user_checkins (user_id, username, checkin_date, streak_days, total_points) "
+                    f"VALUES ({user_id}, 'a', '{day}', 1, 10)"
+                ))
+        Base.metadata.create_all(manager.engine)
+        add_missing_columns(Base.metadata, manager.engine)
+        
+        # 未清理重复时唯一索引无法创建
+        with self.assertRaises(SQLAlchemyError):
+            create_missing_indexes(Base.metadata, manager.engine)
+        
+        self.assertEqual(remove_duplicate_checkins(manager.engine), 1)
+        create_missing_indexes(Base.metadata, manager.engine)
+        self.assertEqual(remove_duplicate_checkins(manager.engine), 0)
+        
+        indexes = {i['name'] for i in inspect(manager.engine).get_indexes('user_checkins')}
+        self.assertIn('uq_user_checkins_chat_user_date', indexes)
+        with manager.get_session() as session:
+            self.assertEqual(sorted(row.id for row in session.query(UserCheckIn)), [1, 3, 4])
+        await manager.dispose()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock
+
+from fakeredis import FakeAsyncRedis, FakeServer
+from sqlalchemy import text
+from telegram import Bot, Update
+from telegram.ext import (
+    ApplicationBuilder,
+    ApplicationHandlerStop,
+    CommandHandler,
+    MessageHandler,
+    filters
+)
+
+from src.dispatch import ChatLaneProcessor, instrument_handlers
+from src.utils.db import DatabaseManager
+from src.utils.metrics import (
+    HANDLER_DURATION,
+    HANDLER_CALLS,
+    HANDLER_ERRORS,
+    HANDLER_IN_FLIGHT,
+    HANDLER_DEPENDENCY_SECONDS,
+    HANDLER_DEPENDENCY_CALLS
+)
+from src.utils.redis_client import redis_manager
+
+def make_update(update_id: int, chat_id: int) -> Update:
+    return Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'supergroup'},
+            'from': {'id': 1, 'is_bot': False, 'first_name': 'test'},
+            'text': 'hello'
+        }
+    }, Bot('123:abc'))
+
+class TestChatLaneProcessor(unittest.IsolatedAsyncioTestCase):
+    """测试按群组串行、跨群组并发的更新处理"""
+    
+    async def test_ordering_and_concurrency(self):
+        """测试慢群组不阻塞其他群组，群组内保持顺序"""
+        processor = ChatLaneProcessor(concurrency=4)
+        release = asyncio.Event()
+        done = []
+        
+        async def handle(update, slow=False):
+            if slow:
+                await release.wait()
+            done.append(update.update_id)
+        
+        slow_chat = [make_update(1, -1), make_update(2, -1), make_update(3, -1)]
+        other_chat = [make_update(4, -2), make_update(5, -2)]
+        tasks = [asyncio.create_task(processor.process_update(slow_chat[0], handle(slow_chat[0], True)))]
+        tasks += [
+            asyncio.create_task(processor.process_update(update, handle(update)))
+            for update in slow_chat[1:] + other_chat
+        ]
+        await asyncio.sleep(0.05)
+        
+        # 群组-2已处理完，群组-1的后续更新仍在等待队首
+        self.assertEqual(done, [4, 5])
+        self.assertEqual(processor.lane_count, 1)
+        
+        release.set()
+        await asyncio.gather(*tasks)
+        self.assertEqual(done, [4, 5, 1, 2, 3])
+        self.assertEqual(processor.lane_count, 0)
+    
+    async def test_concurrency_limit(self):
+        """测试同时处理的群组数不超过执行槽位"""
+        processor = ChatLaneProcessor(concurrency=2)
+        running = 0
+        peak = 0
+        
+        async def handle():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+        
+        await asyncio.gather(*(
+            processor.process_update(make_update(i, -i), handle()) for i in range(1, 9)
+        ))
+        self.assertEqual(peak, 2)
+
+class TestInstrumentHandlers(unittest.IsolatedAsyncioTestCase):
+    """测试处理器耗时统计"""
+    
+    async def test_handler_latency(self):
+        """测试按命令/回调名记录耗时，且不会重复包装"""
+        async def ban(update, context):
+            return 'banned'
+        
+        application = ApplicationBuilder().token('123:abc').build()
+        application.add_handler(CommandHandler('ban', ban))
+        application.add_handler(MessageHandler(filters.TEXT, lambda u, c: None))
+        instrument_handlers(application)
+        instrument_handlers(application)
+        
+        handler = application.handlers[0][0]
+        histogram = HANDLER_DURATION.labels(handler='/ban', outcome='ok')
+        before = sum(b.get() for b in histogram._buckets)
+        
+        self.assertEqual(await handler.callback(MagicMock(), MagicMock()), 'banned')
+        self.assertEqual(sum(b.get() for b in histogram._buckets), before + 1)
+        self.assertIs(handler.callback.__wrapped__, ban)
+    
+    async def test_handler_outcomes(self):
+        """测试在途数与按结果统计的调用/错误次数"""
+        gate = asyncio.Event()
+        
+        async def slow(update, context):
+            await gate.wait()
+            if context.args:
+                raise ValueError(context.args[0])
+        
+        async def stop(update, context):
+            raise ApplicationHandlerStop()
+        
+        application = ApplicationBuilder().token('123:abc').build()
+        application.add_handler(CommandHandler('slow', slow))
+        application.add_handler(CommandHandler('stop', stop), group=1)
+        instrument_handlers(application)
+        slow_cb = application.handlers[0][0].callback
+        stop_cb = application.handlers[1][0].callback
+        
+        in_flight = HANDLER_IN_FLIGHT.labels(handler='/slow')
+        ok = HANDLER_CALLS.labels(handler='/slow', outcome='ok')
+        failed = HANDLER_CALLS.labels(handler='/slow', outcome='error')
+        errors = HANDLER_ERRORS.labels(handler='/slow', error_type='ValueError')
+        stopped = HANDLER_CALLS.labels(handler='/stop', outcome='stopped')
+        before = [m._value.get() for m in (ok, failed, errors, stopped)]
+        
+        tasks = [
+            asyncio.create_task(slow_cb(MagicMock(), MagicMock(args=[]))),
+            asyncio.create_task(slow_cb(MagicMock(), MagicMock(args=['boom'])))
+        ]
+        await asyncio.sleep(0.01)
+        self.assertEqual(in_flight._value.get(), 2)
+        
+        gate.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        self.assertIsInstance(results[1], ValueError)
+        with self.assertRaises(ApplicationHandlerStop):
+            await stop_cb(MagicMock(), MagicMock())
+        
+        self.assertEqual(in_flight._value.get(), 0)
+        after = [m._value.get() for m in (ok, failed, errors, stopped)]
+        self.assertEqual([a - b for a, b in zip(after, before)], [1, 1, 1, 1])
+    
+    async def test_dependency_timing(self):
+        """测试处理器内的Redis命令与SQL语句计入该处理器"""
+        redis_manager.use_client(FakeAsyncRedis(server=FakeServer()))
+        self.addCleanup(redis_manager.use_client, None)
+        db = DatabaseManager('sqlite://', async_mode=False)
+        conn = redis_manager.namespace('test')
+        
+        async def lookup(update, context):
+            await conn.set(conn.key('a'), 1)
+            async with conn.pipeline() as pipe:
+                pipe.get(conn.key('a'))
+                pipe.get(conn.key('b'))
+                await pipe.execute()
+            with db.get_session() as session:
+                session.execute(text('SELECT 1'))
+        
+        application = ApplicationBuilder().token('123:abc').build()
+        application.add_handler(CommandHandler('lookup', lookup))
+        instrument_handlers(application)
+        
+        redis_calls = HANDLER_DEPENDENCY_CALLS.labels(handler='/lookup', dependency='redis')
+        sql_calls = HANDLER_DEPENDENCY_CALLS.labels(handler='/lookup', dependency='sql')
+        redis_seconds = HANDLER_DEPENDENCY_SECONDS.labels(handler='/lookup', dependency='redis')
+        
+        await application.handlers[0][0].callback(MagicMock(), MagicMock())
+        self.assertEqual(redis_calls._value.get(), 2)
+        self.assertEqual(sql_calls._value.get(), 1)
+        self.assertEqual(sum(b.get() for b in redis_seconds._buckets), 1)
+        
+        # 处理器之外的调用不计入
+        await conn.get(conn.key('a'))
+        self.assertEqual(redis_calls._value.get(), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import asyncio
+import unittest
+
+from fakeredis import FakeAsyncRedis, FakeServer
+
+from src.utils.leader import LeaderElection, redis_conn
+from src.utils.redis_client import redis_manager
+
+class TestLeaderElection(unittest.IsolatedAsyncioTestCase):
+    """测试Redis租约选举"""
+    
+    def setUp(self):
+        redis_manager.use_client(FakeAsyncRedis(server=FakeServer()))
+    
+    def tearDown(self):
+        redis_manager.use_client(None)
+    
+    async def test_single_leader(self):
+        """测试同一时刻只有一个领导者，续期不改变持有者"""
+        first = LeaderElection('test', ttl=30, owner='a')
+        second = LeaderElection('test', ttl=30, owner='b')
+        
+        self.assertTrue(await first.try_acquire())
+        self.assertFalse(await second.try_acquire())
+        self.assertTrue(await first.try_acquire())
+        
+        self.assertTrue(first.is_leader)
+        self.assertFalse(second.is_leader)
+        self.assertEqual(await redis_conn.get(first.key), b'a')
+    
+    async def test_release_hands_over(self):
+        """测试释放租约后其他实例接任"""
+        first = LeaderElection('test', ttl=30, owner='a')
+        second = LeaderElection('test', ttl=30, owner='b')
+        first.start()
+        for _ in range(50):
+            if first.is_leader:
+                break
+            await asyncio.sleep(0.01)
+        self.assertTrue(first.is_leader)
+        
+        await first.stop()
+        self.assertFalse(first.is_leader)
+        self.assertTrue(await second.try_acquire())
+    
+    async def test_lost_lease(self):
+        """测试租约被他人持有后不再认为自己是领导者"""
+        first = LeaderElection('test', ttl=30, owner='a')
+        self.assertTrue(await first.try_acquire())
+        
+        await redis_conn.set(first.key, 'b')
+        self.assertFalse(await first.try_acquire())
+        self.assertFalse(first.is_leader)
+        
+        # 不会释放他人的租约
+        await first.release()
+        self.assertEqual(await redis_conn.get(first.key), b'b')
+
+if __name__ == '__main__':
+    unittest.main()
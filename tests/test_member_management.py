@@ -1,11 +1,17 @@
+import asyncio
 import unittest
 from unittest.mock import AsyncMock, MagicMock, patch
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect
 from sqlalchemy.orm import sessionmaker
 
-from src.member_management import MemberManager
+from fakeredis import FakeAsyncRedis, FakeServer
+
+from telegram.error import BadRequest, RetryAfter
+
+from src.member_management import MemberManager, BulkModerator, AdminAction, redis_conn
 from src.checkin import Base
+from src.utils.redis_client import redis_manager
 
 class TestMemberManagement(unittest.IsolatedAsyncioTestCase):
     """测试成员管理功能"""
@@ -16,9 +22,8 @@ class TestMemberManagement(unittest.IsolatedAsyncioTestCase):
         Base.metadata.create_all(self.engine)
         self.Session = sessionmaker(bind=self.engine)
         
-        # Mock Redis连接
-        self.redis_patch = patch('src.member_management.redis_conn')
-        self.mock_redis = self.redis_patch.start()
+        # 使用fakeredis替代Redis服务
+        redis_manager.use_client(FakeAsyncRedis(server=FakeServer()))
         
         # 创建测试用户
         self.user = MagicMock()
@@ -36,7 +41,7 @@ class TestMemberManagement(unittest.IsolatedAsyncioTestCase):
         self.context.bot = AsyncMock()
         
     def tearDown(self):
-        self.redis_patch.stop()
+        redis_manager.use_client(None)
         self.engine.dispose()
     
     async def test_ban_member_success(self):
@@ -76,6 +81,38 @@ class TestMemberManagement(unittest.IsolatedAsyncioTestCase):
         self.assertFalse(result)
         self.update.message.reply_text.assert_awaited_with("❌ 需要管理员权限")
         
+    async def test_command_invalid_args(self):
+        """测试命令参数无效时回复用法，不调用Bot API"""
+        manager = MemberManager(self.Session())
+        for action, args in (('ban', []), ('unban', ['abc']), ('mute', ['-5'])):
+            self.context.args = args
+            self.assertIsNone(await manager.handle_command(self.update, self.context, action))
+            self.update.message.reply_text.assert_awaited_with(f"用法: /{action} <用户ID>")
+        
+        # 批量操作的分钟数无效
+        admin = MagicMock()
+        admin.user.id = self.user.id
+        self.update.effective_chat.get_administrators = AsyncMock(return_value=[admin])
+        for args in (['recent', 'abc'], ['-5'], ['0'], ['789', 'abc']):
+            self.context.args = args
+            self.assertIsNone(await manager.bulk_moderate(self.update, self.context, 'ban'))
+            self.update.message.reply_text.assert_awaited_with("请提供用户ID列表，或使用 recent [分钟]")
+        self.context.bot.ban_chat_member.assert_not_awaited()
+        self.context.bot.restrict_chat_member.assert_not_awaited()
+
+    async def test_unban_command(self):
+        """测试解除封禁命令"""
+        admin = MagicMock()
+        admin.user.id = self.user.id
+        self.update.effective_chat.get_administrators = AsyncMock(return_value=[admin])
+        self.context.args = ['789']
+        
+        manager = MemberManager(self.Session())
+        self.assertTrue(await manager.handle_command(self.update, self.context, 'unban'))
+        self.context.bot.unban_chat_member.assert_awaited_once_with(
+            chat_id=456, user_id=789, only_if_banned=True
+        )
+
     async def test_mute_member(self):
         """测试禁言功能"""
         # 设置管理员权限
@@ -96,7 +133,176 @@ class TestMemberManagement(unittest.IsolatedAsyncioTestCase):
         
         self.assertTrue(result)
         self.context.bot.restrict_chat_member.assert_awaited_once()
-        self.mock_redis.setex.assert_called_once()
+        self.assertEqual(
+            await redis_conn.get(redis_conn.key("mute:456:789")),
+            "测试禁言".encode()
+        )
+        self.assertGreater(await redis_conn.ttl(redis_conn.key("mute:456:789")), 0)
+
+    async def test_admin_cache(self):
+        """测试管理员列表缓存，重复操作只请求一次"""
+        admin = MagicMock()
+        admin.user.id = self.user.id
+        self.update.effective_chat.get_administrators = AsyncMock(
+            return_value=[admin]
+        )
+        
+        manager = MemberManager(self.Session())
+        await manager.ban_member(self.update, self.context, user_id=789)
+        await manager.mute_member(self.update, self.context, user_id=790)
+        
+        self.update.effective_chat.get_administrators.assert_awaited_once()
+        
+    async def test_admin_cache_concurrent_miss(self):
+        """测试并发未命中共享一次API调用"""
+        admin = MagicMock()
+        admin.user.id = self.user.id
+        
+        async def slow_admins():
+            await asyncio.sleep(0.01)
+            return [admin]
+        
+        self.update.effective_chat.get_administrators = AsyncMock(side_effect=slow_admins)
+        manager = MemberManager(self.Session())
+        results = await asyncio.gather(*[
+            manager._check_admin_permission(self.update) for _ in range(10)
+        ])
+        
+        self.assertTrue(all(results))
+        self.update.effective_chat.get_administrators.assert_awaited_once()
+        
+    async def test_admin_cache_invalidated_by_member_update(self):
+        """测试管理员变更事件使缓存失效"""
+        self.update.effective_chat.get_administrators = AsyncMock(return_value=[])
+        manager = MemberManager(self.Session())
+        self.assertFalse(await manager._check_admin_permission(self.update))
+        
+        # 用户被提升为管理员
+        admin = MagicMock()
+        admin.user.id = self.user.id
+        self.update.effective_chat.get_administrators = AsyncMock(return_value=[admin])
+        member_update = MagicMock()
+        member_update.chat_member.chat.id = 456
+        member_update.chat_member.old_chat_member.status = 'member'
+        member_update.chat_member.new_chat_member.status = 'administrator'
+        await manager.handle_chat_member_update(member_update, self.context)
+        
+        self.assertTrue(await manager._check_admin_permission(self.update))
+
+    async def test_bulk_moderator_concurrency(self):
+        """测试批量封禁并发上限"""
+        running = 0
+        peak = 0
+        
+        async def ban_chat_member(chat_id, user_id):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.001)
+            running -= 1
+        
+        bot = MagicMock()
+        bot.ban_chat_member = AsyncMock(side_effect=ban_chat_member)
+        progress = AsyncMock()
+        
+        result = await BulkModerator(bot, concurrency=3).run(
+            456, range(20), progress_callback=progress
+        )
+        
+        self.assertEqual(len(result['succeeded']), 20)
+        self.assertLessEqual(peak, 3)
+        self.assertEqual(progress.await_count, 20)
+        progress.assert_awaited_with(20, 20)
+        
+    async def test_bulk_moderator_retry_after(self):
+        """测试收到RetryAfter后暂停并重试"""
+        bot = MagicMock()
+        bot.restrict_chat_member = AsyncMock(side_effect=[
+            RetryAfter(1), None, BadRequest("User not found")
+        ])
+        
+        with patch('asyncio.sleep', new_callable=AsyncMock) as mock_sleep:
+            result = await BulkModerator(bot, concurrency=1).run(
+                456, [1, 2], action='mute'
+            )
+        
+        self.assertEqual(result['succeeded'], [1])
+        self.assertIn(2, result['failed'])
+        self.assertEqual(bot.restrict_chat_member.await_count, 3)
+        self.assertGreater(mock_sleep.await_args_list[0][0][0], 0.5)
+        
+    async def test_bulk_ban_recent_joiners(self):
+        """测试批量封禁最近入群成员"""
+        from src.welcome_system import redis_conn as welcome_redis
+        await welcome_redis.zadd(welcome_redis.key("pending_verify:456"), {
+            "1001": datetime.now().timestamp(),
+            "1002": (datetime.now() - timedelta(hours=2)).timestamp()
+        })
+        admin = MagicMock()
+        admin.user.id = self.user.id
+        self.update.effective_chat.get_administrators = AsyncMock(return_value=[admin])
+        self.context.args = ['recent', '30']
+        
+        manager = MemberManager(self.Session())
+        result = await manager.bulk_moderate(self.update, self.context, 'ban')
+        
+        self.assertEqual(result['succeeded'], [1001])
+        self.context.bot.ban_chat_member.assert_awaited_once_with(chat_id=456, user_id=1001)
+
+    async def test_admin_actions_batched_to_db_and_redis(self):
+        """测试管理操作日志批量写入数据库并限制Redis窗口"""
+        manager = MemberManager(self.Session, action_window=3)
+        for target in range(5):
+            await manager._log_action('ban', 123, target, 'spam', chat_id=456)
+        await manager._log_action('mute', 123, 1, None, chat_id=789)
+        
+        # 尚未写出
+        session = self.Session()
+        self.assertEqual(session.query(AdminAction).count(), 0)
+        
+        await manager.stop()
+        
+        self.assertEqual(session.query(AdminAction).count(), 6)
+        recent = await manager.get_recent_actions(456)
+        self.assertEqual([entry['target_id'] for entry in recent], [4, 3, 2])
+        self.assertEqual(await redis_conn.llen(redis_conn.key("admin_actions:789")), 1)
+        
+    async def test_admin_actions_retry_not_duplicated(self):
+        """测试Redis写入失败后整批重试不重复插入数据库"""
+        manager = MemberManager(self.Session)
+        manager.action_buffer.retry_delay = 0.01
+        await manager._log_action('ban', 123, 789, None, chat_id=456)
+        
+        pipeline = redis_conn.pipeline
+        failures = [ConnectionError("redis down")] * 2
+        
+        def flaky_pipeline(*args, **kwargs):
+            if failures:
+                raise failures.pop()
+            return pipeline(*args, **kwargs)
+        
+        with patch.object(redis_conn, 'pipeline', side_effect=flaky_pipeline):
+            await manager.action_buffer.flush()
+        
+        self.assertEqual(self.Session().query(AdminAction).count(), 1)
+        self.assertEqual(await redis_conn.llen(redis_conn.key("admin_actions:456")), 1)
+        
+    async def test_get_user_actions(self):
+        """测试按群和目标用户查询操作记录"""
+        manager = MemberManager(self.Session)
+        await manager._log_action('mute', 123, 789, 'flood', chat_id=456)
+        await manager._log_action('ban', 123, 789, 'spam', chat_id=456)
+        await manager._log_action('ban', 123, 789, 'spam', chat_id=999)
+        await manager._log_action('ban', 123, 111, 'spam', chat_id=456)
+        await manager.stop()
+        
+        actions = await manager.get_user_actions(456, 789)
+        
+        self.assertEqual(len(actions), 2)
+        self.assertTrue(all(a['target_id'] == 789 for a in actions))
+        self.assertGreaterEqual(actions[0]['timestamp'], actions[1]['timestamp'])
+        indexes = {i['name'] for i in inspect(self.engine).get_indexes('admin_actions')}
+        self.assertIn('ix_admin_actions_chat_target_ts', indexes)
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
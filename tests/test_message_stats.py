@@ -1,11 +1,20 @@
+import asyncio
+import itertools
 import unittest
-from unittest.mock import AsyncMock, MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, PropertyMock, patch
 from datetime import datetime, timedelta
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-from src.message_stats import MessageStats, MessageRecord
+from fakeredis import FakeAsyncRedis, FakeServer
+
+from src.message_stats import MessageStats, MessageRecord, MessageRollupHourly, MessageRollupDaily, redis_conn
+from src.message_stats import backfill_message_rollups
 from src.checkin import Base
+from src.utils.db import DatabaseManager
+from src.utils.metrics import MESSAGE_QUEUE_REDELIVERED
+from src.utils.redis_client import redis_manager
+from src.user_profiles import redis_conn as profiles_redis
 
 class TestMessageStats(unittest.IsolatedAsyncioTestCase):
     """测试消息统计功能"""
@@ -16,11 +25,8 @@ class TestMessageStats(unittest.IsolatedAsyncioTestCase):
         Base.metadata.create_all(self.engine)
         self.Session = sessionmaker(bind=self.engine)
         
-        # Mock Redis连接
-        self.redis_patch = patch('src.message_stats.redis_conn')
-        self.mock_redis = self.redis_patch.start()
-        self.mock_redis.zincrby = MagicMock()
-        self.mock_redis.llen = MagicMock(return_value=0)
+        # 使用fakeredis替代Redis服务
+        redis_manager.use_client(FakeAsyncRedis(server=FakeServer()))
         
         # 模拟消息
         self.update = MagicMock()
@@ -29,37 +35,271 @@ class TestMessageStats(unittest.IsolatedAsyncioTestCase):
         self.update.effective_user = self.user
         self.update.effective_chat.id = 456
         self.update.message = AsyncMock()
+        # 每次读取得到新的消息ID(模拟不同消息)
+        type(self.update.message).message_id = PropertyMock(side_effect=itertools.count(1))
         
     def tearDown(self):
-        self.redis_patch.stop()
+        redis_manager.use_client(None)
         self.engine.dispose()
     
     async def test_record_message(self):
         """测试记录消息"""
         stats = MessageStats(self.Session())
         await stats.record_message(self.update)
+        await stats.buffer.flush()
         
-        # 验证Redis调用
-        self.mock_redis.zincrby.assert_called_once_with(
-            f"chat:456:activity",
-            1,
-            "123"
-        )
+        # 验证Redis计数
+        score = await redis_conn.zscore(redis_conn.key("chat:456:activity"), "123")
+        self.assertEqual(score, 1)
+    
+    async def test_profiles_written_with_batch(self):
+        """测试用户资料随批次写出，处理消息时不访问Redis"""
+        self.user.id = 777
+        self.user.full_name = 'Alice'
+        self.user.username = 'alice'
+        stats = MessageStats(self.Session())
+        key = profiles_redis.key("user:777")
+        
+        await stats.record_message(self.update)
+        self.assertFalse(await profiles_redis.exists(key))
+        
+        await stats.buffer.flush()
+        self.assertEqual(await profiles_redis.hget(key, 'name'), b'Alice')
     
-    def test_get_leaderboard(self):
+    async def test_batch_flush(self):
+        """测试批量写入: 计数合并且一次批量插入"""
+        session = self.Session()
+        stats = MessageStats(session, batch_size=3)
+        
+        # 达到批量阈值时自动写出
+        for _ in range(3):
+            await stats.record_message(self.update, None)
+        
+        score = await redis_conn.zscore(redis_conn.key("chat:456:activity"), "123")
+        self.assertEqual(score, 3)
+        self.assertEqual(session.query(MessageRecord).count(), 3)
+    
+    async def test_stop_flushes_pending(self):
+        """测试关闭时写出剩余消息"""
+        session = self.Session()
+        stats = MessageStats(session, flush_interval=60)
+        await stats.start()
+        await stats.record_message(self.update)
+        await stats.stop()
+        
+        self.assertEqual(session.query(MessageRecord).count(), 1)
+    
+    async def test_get_leaderboard(self):
         """测试获取排行榜"""
         stats = MessageStats(self.Session())
         
-        # 设置Redis模拟数据
-        self.mock_redis.zrevrange.return_value = [
-            (b"123", 10.0),
-            (b"456", 5.0)
-        ]
+        # 设置Redis数据
+        await redis_conn.zadd(
+            redis_conn.key("chat:456:activity"),
+            {"123": 10, "456": 5}
+        )
         
-        rankings = stats.get_leaderboard(456)
+        rankings = await stats.get_leaderboard(456)
         self.assertEqual(len(rankings), 2)
         self.assertEqual(rankings[0]["user_id"], 123)
         self.assertEqual(rankings[0]["count"], 10)
 
+    async def test_iter_daily_reports(self):
+        """测试按群组分页生成所有群组的前N名"""
+        session = self.Session()
+        now = datetime.now()
+        rows = []
+        for chat_id, counts in ((1, {10: 3, 11: 5, 12: 1}), (2, {20: 2}), (3, {30: 1})):
+            for user_id, count in counts.items():
+                rows += [
+                    {'chat_id': chat_id, 'user_id': user_id, 'timestamp': now, 'message_length': 1}
+                ] * count
+        # 超过24小时的消息不计入
+        rows.append({'chat_id': 3, 'user_id': 31, 'timestamp': now - timedelta(days=2), 'message_length': 1})
+        stats = MessageStats(self.Session)
+        await stats._flush_to_db(rows)
+        
+        pages = [page async for page in stats.iter_daily_reports(top_n=2, page_size=2)]
+        
+        self.assertEqual(pages, [
+            [(1, [(11, 5), (10, 3)]), (2, [(20, 2)])],
+            [(3, [(30, 1)])]
+        ])
+
+    async def test_iter_daily_reports_async_session(self):
+        """测试异步会话下分页读取日报"""
+        manager = DatabaseManager('sqlite:///:memory:', async_mode=True)
+        async with manager.async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        stats = MessageStats(manager.get_async_session)
+        await stats._flush_to_db([
+            {'chat_id': 1, 'user_id': 2, 'timestamp': datetime.now(), 'message_length': 1}
+        ])
+        pages = [page async for page in stats.iter_daily_reports()]
+        await manager.dispose()
+        
+        self.assertEqual(pages, [[(1, [(2, 1)])]])
+
+    async def test_rollups_maintained_on_flush(self):
+        """测试写入时增量维护小时/天汇总"""
+        session = self.Session()
+        stats = MessageStats(session)
+        hour = datetime.now().replace(minute=0, second=0, microsecond=0)
+        batch = [
+            {'chat_id': 1, 'user_id': 2, 'timestamp': hour, 'message_length': 5},
+            {'chat_id': 1, 'user_id': 2, 'timestamp': hour + timedelta(minutes=30), 'message_length': 7},
+            {'chat_id': 1, 'user_id': 3, 'timestamp': hour - timedelta(hours=1), 'message_length': 1}
+        ]
+        await stats._flush_to_db(batch)
+        await stats._flush_to_db(batch[:1])
+        
+        row = session.query(MessageRollupHourly).filter_by(chat_id=1, user_id=2, bucket=hour).one()
+        self.assertEqual((row.message_count, row.total_length), (3, 17))
+        self.assertEqual(session.query(MessageRollupHourly).count(), 2)
+        
+        top = await stats.get_top_users(1, hour - timedelta(hours=1))
+        self.assertEqual([tuple(r) for r in top], [(2, 3), (3, 1)])
+        
+        trend = await stats.get_activity_trend(1, hour - timedelta(hours=1))
+        self.assertEqual([t['messages'] for t in trend], [1, 3])
+        
+        # 原始记录已按保留期删除的更早历史汇总
+        old_day = (hour - timedelta(days=90)).date()
+        session.add(MessageRollupDaily(chat_id=1, bucket=old_day, user_id=2, message_count=9, total_length=0))
+        session.commit()
+        
+        # 由原始记录重建汇总表，结果一致，历史汇总保留
+        self.assertEqual(backfill_message_rollups(session), 4)
+        self.assertEqual(
+            session.query(MessageRollupDaily).filter_by(bucket=old_day).one().message_count, 9
+        )
+        row = session.query(MessageRollupHourly).filter_by(chat_id=1, user_id=2, bucket=hour).one()
+        self.assertEqual(row.message_count, 3)
+        monthly = await stats.get_top_users(1, hour - timedelta(days=30))
+        self.assertEqual([tuple(r) for r in monthly], [(2, 3), (3, 1)])
+
+    async def test_trim_activity(self):
+        """测试裁剪活跃度有序集合"""
+        for chat_id in (1, 2):
+            await redis_conn.zadd(
+                redis_conn.key(f"chat:{chat_id}:activity"),
+                {str(user_id): user_id for user_id in range(10)}
+            )
+        
+        removed = await MessageStats(self.Session()).trim_activity(3, scan_count=1)
+        
+        self.assertEqual(removed, 14)
+        self.assertEqual(
+            await redis_conn.zrange(redis_conn.key("chat:1:activity"), 0, -1),
+            [b"7", b"8", b"9"]
+        )
+
+    async def test_windowed_leaderboard(self):
+        """测试按天分桶的窗口排行"""
+        stats = MessageStats(self.Session())
+        now = datetime.now()
+        batch = (
+            [{'chat_id': 456, 'user_id': 1, 'timestamp': now, 'message_length': 1}] * 2
+            + [{'chat_id': 456, 'user_id': 2, 'timestamp': now - timedelta(days=3), 'message_length': 1}] * 5
+            + [{'chat_id': 456, 'user_id': 3, 'timestamp': now - timedelta(days=20), 'message_length': 1}] * 9
+        )
+        await stats._write_batch(batch)
+        
+        today = await stats.get_leaderboard(456, window='today')
+        self.assertEqual(today, [{"user_id": 1, "count": 2}])
+        week = await stats.get_leaderboard(456, window='7d')
+        self.assertEqual([r['user_id'] for r in week], [2, 1])
+        month = await stats.get_leaderboard(456, window='30d')
+        self.assertEqual([r['user_id'] for r in month], [3, 2, 1])
+        
+        # 日桶带过期时间，窗口结果短时缓存
+        day_key = redis_conn.key(f"chat:456:activity:{now:%Y%m%d}")
+        self.assertGreater(await redis_conn.ttl(day_key), 30 * 86400)
+        window_key = redis_conn.key("chat:456:activity:window:7d")
+        self.assertGreater(await redis_conn.ttl(window_key), 0)
+        
+        with self.assertRaises(ValueError):
+            await stats.get_leaderboard(456, window='1y')
+
+    async def test_at_least_once_delivery(self):
+        """测试入库失败的消息保留在Redis并在下次重新投递"""
+        session = self.Session()
+        stats = MessageStats(session, consumer='worker-1')
+        
+        # 入库失败(缓冲区记录失败并继续)
+        with patch.object(stats, '_flush_to_db', side_effect=Exception("DB down")):
+            for _ in range(3):
+                await stats.record_message(self.update)
+            await stats.buffer.flush()
+        
+        # 计数已写入，消息停留在处理中列表
+        self.assertEqual(
+            await redis_conn.zscore(redis_conn.key("chat:456:activity"), "123"), 3
+        )
+        self.assertEqual(await redis_conn.llen(stats.processing_key), 3)
+        self.assertEqual(session.query(MessageRecord).count(), 0)
+        
+        before = MESSAGE_QUEUE_REDELIVERED._value.get()
+        await stats.stop()
+        
+        self.assertEqual(session.query(MessageRecord).count(), 3)
+        self.assertEqual(MESSAGE_QUEUE_REDELIVERED._value.get() - before, 3)
+        self.assertEqual(await redis_conn.llen(stats.processing_key), 0)
+        self.assertEqual(await redis_conn.llen(redis_conn.key("message_queue")), 0)
+
+    async def test_reclaim_stale_consumer(self):
+        """测试回收心跳过期的消费者(主机名已变化)遗留的处理中列表"""
+        session = self.Session()
+        old = MessageStats(session, consumer='old-host')
+        with patch.object(old, '_flush_to_db', side_effect=Exception("DB down")):
+            await old.record_message(self.update)
+            await old.record_message(self.update)
+            await old.buffer.flush()
+        self.assertEqual(await redis_conn.llen(old.processing_key), 2)
+        
+        new = MessageStats(session, consumer='new-host')
+        # 旧消费者心跳未过期时不回收
+        self.assertEqual(await new.reclaim_stale(), 0)
+        
+        await redis_conn.delete(old.heartbeat_key)
+        self.assertEqual(await new.reclaim_stale(), 2)
+        self.assertEqual(await redis_conn.llen(old.processing_key), 0)
+        
+        await new.drain()
+        self.assertEqual(session.query(MessageRecord).count(), 2)
+
+    async def test_redelivered_chunk_counted_once(self):
+        """测试入库后未及确认就崩溃时，重新投递不会重复写入或重复汇总"""
+        session = self.Session()
+        stats = MessageStats(session)
+        now = datetime(2024, 1, 1, 10, 30)
+        chunk = [
+            {'user_id': 1, 'chat_id': 456, 'message_id': i, 'timestamp': now, 'message_length': 5}
+            for i in (1, 2)
+        ]
+        
+        await stats._flush_to_db(chunk)
+        await stats._flush_to_db(chunk + [{**chunk[0], 'message_id': 3}])
+        
+        self.assertEqual(session.query(MessageRecord).count(), 3)
+        rollup = session.query(MessageRollupHourly).one()
+        self.assertEqual((rollup.message_count, rollup.total_length), (3, 15))
+
+    async def test_background_drain(self):
+        """测试后台任务按块从Redis队列入库"""
+        session = self.Session()
+        stats = MessageStats(session, batch_size=4, flush_interval=0.01)
+        await stats.start()
+        for _ in range(10):
+            await stats.record_message(self.update)
+        
+        for _ in range(50):
+            if session.query(MessageRecord).count() == 10:
+                break
+            await asyncio.sleep(0.02)
+        await stats.stop()
+        
+        self.assertEqual(session.query(MessageRecord).count(), 10)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,160 @@
+import asyncio
+import time
+import unittest
+from datetime import timedelta
+from unittest.mock import AsyncMock, MagicMock
+
+from telegram.error import RetryAfter
+
+from src.outbox import Outbox, PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BULK
+from src.utils.rate_limit import ChatRateLimiter
+
+class FakeBot:
+    """记录发送顺序的Bot，gate未放行前阻塞发送"""
+
+    def __init__(self):
+        self.sent = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.errors = []
+        self.kwargs = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self.gate.wait()
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((chat_id, text))
+        self.kwargs.append(kwargs)
+        return len(self.sent)
+
+def make_message(bot, message_id, chat_type='supergroup'):
+    """构造被回复的消息"""
+    message = MagicMock(chat_id=1, message_id=message_id, is_topic_message=False)
+    message.chat.type = chat_type
+    message.get_bot.return_value = bot
+    return message
+
+class TestOutbox(unittest.IsolatedAsyncioTestCase):
+    """测试统一发送队列"""
+
+    async def asyncSetUp(self):
+        self.bot = FakeBot()
+        self.outbox = Outbox(
+            ChatRateLimiter(global_rate=1000, per_chat_rate=1000, per_chat_burst=100),
+            max_retries=2,
+            concurrency=1
+        )
+        self.outbox.start()
+
+    async def asyncTearDown(self):
+        self.bot.gate.set()
+        await self.outbox.stop()
+
+    async def test_priority_order(self):
+        """测试命令回复先于日报发送"""
+        self.bot.gate.clear()
+        first = asyncio.create_task(self.outbox.send_message(self.bot, 1, 'first'))
+        await asyncio.sleep(0.01)
+
+        bulk = asyncio.create_task(self.outbox.send_message(self.bot, 2, 'report', priority=PRIORITY_BULK))
+        normal = asyncio.create_task(self.outbox.send_message(self.bot, 3, 'welcome', priority=PRIORITY_NORMAL))
+        reply = asyncio.create_task(self.outbox.send_message(self.bot, 4, 'reply', priority=PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0.01)
+        self.bot.gate.set()
+        await asyncio.gather(first, bulk, normal, reply)
+
+        self.assertEqual(
+            [text for _, text in self.bot.sent],
+            ['first', 'reply', 'welcome', 'report']
+        )
+
+    async def test_merge_same_chat(self):
+        """测试同一聊天排队中的消息合并发送"""
+        self.bot.gate.clear()
+        first = asyncio.create_task(self.outbox.send_message(self.bot, 1, 'a'))
+        await asyncio.sleep(0.01)
+
+        rest = [
+            asyncio.create_task(self.outbox.send_message(self.bot, 1, text))
+            for text in ('b', 'c')
+        ]
+        separate = asyncio.create_task(self.outbox.send_message(self.bot, 1, 'd', merge=False))
+        await asyncio.sleep(0.01)
+        self.bot.gate.set()
+
+        await first
+        merged = await asyncio.gather(*rest)
+        await separate
+        self.assertEqual(self.bot.sent, [(1, 'a'), (1, 'b\n\nc'), (1, 'd')])
+        # 合并发送的调用方得到同一条消息
+        self.assertEqual(merged[0], merged[1])
+
+    async def test_reply_quotes_target(self):
+        """测试群组回复引用原消息，只合并引用同一消息的回复"""
+        self.bot.gate.clear()
+        first = asyncio.create_task(self.outbox.send_message(self.bot, 1, 'busy'))
+        await asyncio.sleep(0.01)
+
+        replies = [
+            asyncio.create_task(self.outbox.reply(make_message(self.bot, message_id), text))
+            for message_id, text in ((10, 'a'), (10, 'b'), (11, 'c'))
+        ]
+        await asyncio.sleep(0.01)
+        self.bot.gate.set()
+        await asyncio.gather(first, *replies)
+
+        self.assertEqual(self.bot.sent[1:], [(1, 'a\n\nb'), (1, 'c')])
+        self.assertEqual(self.bot.kwargs[1]['reply_parameters'].message_id, 10)
+        self.assertEqual(self.bot.kwargs[2]['reply_parameters'].message_id, 11)
+
+        # 私聊与do_quote=False不引用
+        await self.outbox.reply(make_message(self.bot, 12, 'private'), 'd')
+        await self.outbox.reply(make_message(self.bot, 13), 'e', do_quote=False)
+        self.assertNotIn('reply_parameters', self.bot.kwargs[3])
+        self.assertNotIn('reply_parameters', self.bot.kwargs[4])
+
+    async def test_retry_after(self):
+        """测试RetryAfter后暂停该聊天并自动重试"""
+        self.bot.errors = [RetryAfter(timedelta(seconds=0.05))]
+        start = time.monotonic()
+        result = await self.outbox.send_message(self.bot, 1, 'hello')
+
+        self.assertEqual(result, 1)
+        self.assertEqual(self.bot.sent, [(1, 'hello')])
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+        # 超过重试次数后调用方收到异常
+        self.bot.errors = [RetryAfter(timedelta(seconds=0.01))] * 3
+        with self.assertRaises(RetryAfter):
+            await self.outbox.send_message(self.bot, 2, 'hello')
+
+    async def test_per_chat_limit(self):
+        """测试单聊天限速不阻塞其他聊天"""
+        await self.outbox.stop()
+        self.outbox = Outbox(
+            ChatRateLimiter(global_rate=1000, per_chat_rate=10, per_chat_burst=1),
+            concurrency=10
+        )
+        self.outbox.start()
+
+        start = time.monotonic()
+        slow = asyncio.gather(*(
+            self.outbox.send_message(self.bot, 1, str(i), merge=False)
+            for i in range(3)
+        ))
+        await self.outbox.send_message(self.bot, 2, 'other')
+        self.assertLess(time.monotonic() - start, 0.05)
+
+        await slow
+        self.assertGreaterEqual(time.monotonic() - start, 0.18)
+        self.assertEqual([text for chat_id, text in self.bot.sent if chat_id == 1], ['0', '1', '2'])
+
+    async def test_passthrough_when_stopped(self):
+        """测试未启动时直接调用Bot API"""
+        await self.outbox.stop()
+        bot = AsyncMock()
+        await self.outbox.send_message(bot, 1, 'hi', reply_markup=None)
+        bot.send_message.assert_awaited_once_with(chat_id=1, text='hi', reply_markup=None)
+
+if __name__ == '__main__':
+    unittest.main()
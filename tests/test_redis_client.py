@@ -0,0 +1,78 @@
+import unittest
+from fakeredis import FakeAsyncRedis, FakeServer
+
+from src.utils.redis_client import RedisManager, LEGACY_DATABASES, migrate_legacy_keys
+
+class TestRedisManager(unittest.IsolatedAsyncioTestCase):
+    """测试共享Redis访问层"""
+    
+    def setUp(self):
+        self.manager = RedisManager(client=FakeAsyncRedis(server=FakeServer()))
+    
+    async def asyncTearDown(self):
+        await self.manager.close()
+    
+    async def test_namespace_isolation(self):
+        """测试不同命名空间的键互不冲突"""
+        stats = self.manager.namespace('stats')
+        welcome = self.manager.namespace('welcome')
+        
+        await stats.set(stats.key('k'), 'a')
+        await welcome.set(welcome.key('k'), 'b')
+        
+        self.assertEqual(stats.key('k'), 'stats:k')
+        self.assertEqual(await stats.get(stats.key('k')), b'a')
+        self.assertEqual(await welcome.get(welcome.key('k')), b'b')
+    
+    async def test_shared_client(self):
+        """测试命名空间共享同一客户端"""
+        stats = self.manager.namespace('stats')
+        self.assertIs(stats, self.manager.namespace('stats'))
+        self.assertIs(stats.ping.__self__, self.manager.client)
+    
+    async def test_pipeline(self):
+        """测试命令管道"""
+        ns = self.manager.namespace('stats')
+        async with ns.pipeline() as pipe:
+            pipe.zincrby(ns.key('z'), 2, 'u1')
+            pipe.zincrby(ns.key('z'), 3, 'u1')
+            results = await pipe.execute()
+        
+        self.assertEqual(results, [2.0, 5.0])
+    
+    async def test_fakeredis_url(self):
+        """测试fakeredis://地址使用本地替身"""
+        manager = RedisManager(url='fakeredis://')
+        ns = manager.namespace('test')
+        await ns.set(ns.key('k'), '1')
+        self.assertEqual(await ns.get(ns.key('k')), b'1')
+        await manager.close()
+
+    async def test_migrate_legacy_keys(self):
+        """测试旧库数据迁移到命名空间，重复执行不重复累加"""
+        server = FakeServer()
+        self.manager.use_client(FakeAsyncRedis(server=server))
+        old_stats = FakeAsyncRedis(server=server, db=2)
+        old_welcome = FakeAsyncRedis(server=server, db=3)
+        await old_stats.zadd('chat:1:activity', {'10': 5})
+        await old_stats.set('message_queue', 'x')
+        await old_welcome.set('welcome:1', 'hi')
+        await old_welcome.sadd('verified_chats', '1')
+        
+        stats = self.manager.namespace('stats')
+        welcome = self.manager.namespace('welcome')
+        # 切换后新库中已产生的数据
+        await stats.zincrby(stats.key('chat:1:activity'), 2, '10')
+        await welcome.set(welcome.key('welcome:1'), 'new')
+        
+        self.assertEqual(await migrate_legacy_keys(old_stats, stats, LEGACY_DATABASES[2][1]), 1)
+        self.assertEqual(await migrate_legacy_keys(old_welcome, welcome, LEGACY_DATABASES[3][1]), 2)
+        self.assertEqual(await migrate_legacy_keys(old_stats, stats, LEGACY_DATABASES[2][1]), 0)
+        
+        self.assertEqual(await stats.zscore(stats.key('chat:1:activity'), '10'), 7)
+        self.assertFalse(await stats.exists(stats.key('message_queue')))
+        self.assertEqual(await welcome.get(welcome.key('welcome:1')), b'new')
+        self.assertTrue(await welcome.sismember(welcome.key('verified_chats'), '1'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, func, select, text
+
+from src.checkin import Base
+from src.message_stats import MessageRecord, MessageRollupHourly
+from src.utils.metrics import RETENTION_ROWS_DELETED
+from src.utils.retention import RetentionPolicy, RetentionEngine
+
+class TestRetentionEngine(unittest.IsolatedAsyncioTestCase):
+    """测试数据保留引擎"""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.tmpdir.name, 'test.db')}")
+        Base.metadata.create_all(self.engine)
+        self.now = datetime(2024, 6, 1, 12)
+    
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmpdir.cleanup()
+    
+    def _seed(self):
+        with self.engine.begin() as conn:
+            conn.execute(MessageRecord.__table__.insert(), [
+                {'user_id': 1, 'chat_id': 1, 'message_length': 100,
+                 'timestamp': self.now - timedelta(days=60 - i // 100)}
+                for i in range(1000)
+            ] + [
+                {'user_id': 1, 'chat_id': 1, 'message_length': 1, 'timestamp': self.now}
+            ])
+            conn.execute(MessageRollupHourly.__table__.insert(), [
+                {'chat_id': 1, 'user_id': 1, 'message_count': 1, 'total_length': 1,
+                 'bucket': self.now - timedelta(hours=h)}
+                for h in range(0, 24 * 10, 6)
+            ])
+    
+    async def test_purge_by_id_chunks(self):
+        """测试按主键区间分块删除"""
+        self._seed()
+        policy = RetentionPolicy(MessageRecord, 'timestamp', timedelta(days=30), chunk_size=128)
+        counter = RETENTION_ROWS_DELETED.labels(target='message_stats')
+        before = counter._value.get()
+        
+        deleted = await RetentionEngine(self.engine, [policy]).purge(policy, policy.cutoff(self.now))
+        
+        self.assertEqual(deleted, 1000)
+        self.assertEqual(counter._value.get() - before, 1000)
+        with self.engine.connect() as conn:
+            self.assertEqual(conn.execute(select(func.count()).select_from(MessageRecord.__table__)).scalar(), 1)
+    
+    async def test_purge_by_time_chunks(self):
+        """测试复合主键表按时间区间分块删除"""
+        self._seed()
+        policy = RetentionPolicy(MessageRollupHourly, 'bucket', timedelta(days=3))
+        self.assertIsNone(policy.id_column)
+        
+        deleted = await RetentionEngine(self.engine, [policy]).purge(policy, policy.cutoff(self.now))
+        
+        # 保留最近3天(含边界)共13个桶
+        self.assertEqual(deleted, 40 - 13)
+    
+    async def test_run_compacts(self):
+        """测试执行全部策略并回收空间"""
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text("PRAGMA auto_vacuum=INCREMENTAL"))
+            conn.execute(text("VACUUM"))
+        self._seed()
+        policies = [
+            RetentionPolicy(MessageRecord, 'timestamp', timedelta(days=30)),
+            RetentionPolicy(MessageRollupHourly, 'bucket', None)
+        ]
+        
+        result = await RetentionEngine(self.engine, policies).run(self.now)
+        
+        self.assertEqual(result['message_stats'], 1000)
+        self.assertNotIn('message_rollups_hourly', result)
+        self.assertGreater(result['bytes_reclaimed'], 0)
+    
+    async def test_compact_skips_full_vacuum(self):
+        """测试未开启增量回收时不执行完整VACUUM"""
+        self._seed()
+        policy = RetentionPolicy(MessageRecord, 'timestamp', timedelta(days=30))
+        
+        with self.assertLogs('src.utils.retention', 'WARNING'):
+            result = await RetentionEngine(self.engine, [policy]).run(self.now)
+        
+        self.assertEqual(result['message_stats'], 1000)
+        self.assertEqual(result['bytes_reclaimed'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
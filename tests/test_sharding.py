@@ -0,0 +1,89 @@
+import asyncio
+import json
+import unittest
+from collections import Counter
+
+from fakeredis import FakeAsyncRedis, FakeServer
+from telegram import Bot, Update
+
+from src.sharding import HashRing, ShardRouter, redis_conn
+from src.utils.redis_client import redis_manager
+
+def make_update(update_id: int, chat_id: int) -> Update:
+    return Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'supergroup'},
+            'from': {'id': 1, 'is_bot': False, 'first_name': 'test'},
+            'text': 'hello'
+        }
+    }, Bot('123:abc'))
+
+class TestHashRing(unittest.TestCase):
+    """测试一致性哈希环"""
+    
+    def test_balanced_and_stable(self):
+        """测试分布均衡，增加节点时只有少量键迁移"""
+        keys = range(-100000, -90000)
+        ring = HashRing(['0', '1', '2', '3'])
+        owners = {key: ring.node_for(key) for key in keys}
+        
+        counts = Counter(owners.values())
+        self.assertEqual(set(counts), {'0', '1', '2', '3'})
+        self.assertGreater(min(counts.values()), len(keys) / 4 * 0.7)
+        
+        grown = HashRing(['0', '1', '2', '3', '4'])
+        moved = sum(1 for key in keys if grown.node_for(key) != owners[key])
+        self.assertLess(moved, len(keys) * 0.35)
+        # 迁移的键只会迁往新节点
+        self.assertTrue(all(
+            grown.node_for(key) in (owners[key], '4') for key in keys
+        ))
+
+class TestShardRouter(unittest.IsolatedAsyncioTestCase):
+    """测试按群组分片路由"""
+    
+    def setUp(self):
+        redis_manager.use_client(FakeAsyncRedis(server=FakeServer()))
+    
+    def tearDown(self):
+        redis_manager.use_client(None)
+    
+    def make_router(self, index):
+        return ShardRouter(Bot('123:abc'), asyncio.Queue(maxsize=10), index=index, count=2, group='test')
+    
+    async def test_forward_to_owner(self):
+        """测试其他分片的更新经收件箱转交所属进程"""
+        routers = [self.make_router(0), self.make_router(1)]
+        chats = {routers[0].shard_for(chat): chat for chat in range(-1000, -900)}
+        self.assertEqual(set(chats), {0, 1})
+        
+        # 0号进程收到两个群组的更新
+        await routers[0].dispatch(make_update(1, chats[0]))
+        await routers[0].dispatch(make_update(2, chats[1]))
+        
+        self.assertEqual(routers[0].update_queue.get_nowait().update_id, 1)
+        self.assertTrue(routers[0].update_queue.empty())
+        forwarded = json.loads(await redis_conn.lindex(routers[0].inbox_key(1), 0))
+        self.assertEqual(forwarded['update_id'], 2)
+        
+        # 1号进程从收件箱取出
+        routers[1].start()
+        update = await asyncio.wait_for(routers[1].update_queue.get(), 5)
+        await routers[1].stop()
+        
+        self.assertEqual(update.update_id, 2)
+        self.assertEqual(update.effective_chat.id, chats[1])
+        self.assertEqual(await redis_conn.llen(routers[0].inbox_key(1)), 0)
+    
+    async def test_local_queue_full(self):
+        """测试本分片队列满时抛出QueueFull(由Webhook返回503)"""
+        router = ShardRouter(Bot('123:abc'), asyncio.Queue(maxsize=1), index=0, count=1)
+        await router.dispatch(make_update(1, -1))
+        with self.assertRaises(asyncio.QueueFull):
+            await router.dispatch(make_update(2, -1))
+
+if __name__ == '__main__':
+    unittest.main()
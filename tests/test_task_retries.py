@@ -1,8 +1,19 @@
 import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
-from src.task_scheduler import TaskScheduler
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+from fakeredis import FakeAsyncRedis, FakeServer
+from src.task_scheduler import TaskScheduler, format_report
+from src.user_profiles import profile_cache
+from src.utils.redis_client import redis_manager
+from src.utils.rate_limit import ChatRateLimiter, TokenBucket
 import asyncio
 
+async def reports(chat_ids, page_size=4):
+    """模拟按页产出的日报生成器"""
+    chat_ids = list(chat_ids)
+    for start in range(0, len(chat_ids), page_size):
+        yield [(chat_id, [(1, 10)]) for chat_id in chat_ids[start:start + page_size]]
+
 class TestTaskRetries:
     """Test task retry mechanisms"""
     
@@ -20,30 +31,112 @@ class TestTaskRetries:
         
         app = MagicMock()
         app.session = MagicMock()
-        scheduler = TaskScheduler(app)
-        scheduler._get_active_chats = MagicMock(return_value=[123])
+        scheduler = TaskScheduler(app, async_mode=False)
+        scheduler._iter_reports = lambda: reports([123])
         return scheduler
 
     @pytest.mark.asyncio
     async def test_retry_mechanism(self, scheduler):
         """Test task retry logic"""
-        with patch.object(scheduler, '_send_report', side_effect=Exception("DB error")) as mock_send:
+        with patch.object(scheduler, '_send_report', side_effect=NetworkError("connection reset")) as mock_send:
             with patch('asyncio.sleep', new_callable=AsyncMock) as mock_sleep:
                 with patch.object(scheduler, '_log_task_failure') as mock_log:
                     await scheduler._generate_daily_report()
                     
                     assert mock_send.call_count == 4  # 0(首次) + 3次重试
                     assert mock_log.call_count == 1  # 最终失败记录
-                    assert mock_sleep.call_count == 4  # 首次+3次重试
+                    assert mock_sleep.call_count == 3  # 3次重试前各等待一次
                     mock_log.assert_called_once()
 
     @pytest.mark.asyncio
     async def test_backoff_strategy(self, scheduler):
         """Test exponential backoff"""
-        with patch.object(scheduler, '_send_report', side_effect=Exception("DB error")):
+        with patch.object(scheduler, '_send_report', side_effect=TimedOut()):
             with patch('asyncio.sleep', new_callable=AsyncMock) as mock_sleep:
                 await scheduler._generate_daily_report()
                 
                 assert mock_sleep.call_args_list[0][0][0] == 5  # 2^0*5
                 assert mock_sleep.call_args_list[1][0][0] == 10  # 2^1*5 
-                assert mock_sleep.call_args_list[2][0][0] == 20  # 2^2*5
\ No newline at end of file
+                assert mock_sleep.call_args_list[2][0][0] == 20  # 2^2*5
+
+    @pytest.mark.asyncio
+    async def test_report_text(self):
+        """Report lists one user per line by display name"""
+        redis_manager.use_client(FakeAsyncRedis(server=FakeServer()))
+        try:
+            user = MagicMock(id=1, full_name='Alice', username='alice')
+            await profile_cache.remember(user)
+            text = await format_report([(1, 10), (2, 3)])
+        finally:
+            redis_manager.use_client(None)
+        assert text.splitlines()[1:] == ["1. Alice: 10条", "2. 用户 2: 3条"]
+
+    @pytest.mark.asyncio
+    async def test_permanent_errors_fail_fast(self, scheduler):
+        """Forbidden/BadRequest and unexpected errors are not retried"""
+        for error in (Forbidden("bot was kicked"), BadRequest("Chat not found"), ValueError("bug")):
+            with patch.object(scheduler, '_send_report', side_effect=error) as mock_send:
+                with patch('asyncio.sleep', new_callable=AsyncMock) as mock_sleep:
+                    await scheduler._generate_daily_report()
+            assert mock_send.call_count == 1
+            mock_sleep.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_per_chat_retry(self, scheduler):
+        """Failing chat retries alone; other chats are sent once"""
+        scheduler._iter_reports = lambda: reports([1, 2, 3])
+        calls = []
+        
+        async def send(chat_id, report):
+            calls.append(chat_id)
+            if chat_id == 2 and calls.count(2) == 1:
+                raise RetryAfter(7)
+        
+        with patch.object(scheduler, '_send_report', side_effect=send):
+            with patch('asyncio.sleep', new_callable=AsyncMock) as mock_sleep:
+                await scheduler._generate_daily_report()
+        
+        assert sorted(calls) == [1, 2, 2, 3]
+        assert mock_sleep.call_args_list[0][0][0] == 7  # RetryAfter要求的等待
+
+    @pytest.mark.asyncio
+    async def test_concurrency_cap(self, scheduler):
+        """Reports run in parallel up to report_concurrency"""
+        scheduler._iter_reports = lambda: reports(range(10))
+        scheduler.report_concurrency = 3
+        running = 0
+        peak = 0
+        
+        async def send(chat_id, report):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+        
+        with patch.object(scheduler, '_send_report', side_effect=send) as mock_send:
+            await scheduler._generate_daily_report()
+        
+        assert mock_send.call_count == 10
+        assert peak == 3
+
+    @pytest.mark.asyncio
+    async def test_token_bucket(self):
+        """Token bucket allows a burst then waits for refill"""
+        now = [0.0]
+        bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0])
+        assert bucket.try_acquire() == 0
+        assert bucket.try_acquire() == 0
+        assert bucket.try_acquire() == pytest.approx(0.5)
+        now[0] = 0.5
+        assert bucket.try_acquire() == 0
+        
+        bucket.penalize(3)
+        assert bucket.try_acquire() == pytest.approx(3.5)
+    
+    def test_global_rate_split_across_workers(self, monkeypatch):
+        """Worker processes share the global send rate"""
+        monkeypatch.setenv('TELEGRAM_GLOBAL_RATE', '30')
+        monkeypatch.setenv('WORKER_COUNT', '3')
+        assert ChatRateLimiter().global_bucket.rate == pytest.approx(10)
+        assert ChatRateLimiter(global_rate=30).global_bucket.rate == 30
@@ -1,11 +1,15 @@
+import asyncio
 import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from datetime import datetime, timedelta
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
 from src.task_scheduler import TaskScheduler
 from src.checkin import Base
+from src.utils.metrics import TASK_SKIPPED
 
 class TestTaskScheduler(unittest.TestCase):
     """测试定时任务系统"""
@@ -67,5 +71,85 @@ class TestTaskScheduler(unittest.TestCase):
         self.assertEqual(jobs[0].id, 'daily_report')
         self.assertEqual(jobs[1].id, 'weekly_cleanup')
 
+class TestAsyncTaskScheduler(unittest.IsolatedAsyncioTestCase):
+    """测试异步调度模式"""
+    
+    async def asyncSetUp(self):
+        self.app = MagicMock()
+        self.scheduler = TaskScheduler(self.app, async_mode=True)
+        self.scheduler.start()
+    
+    async def asyncTearDown(self):
+        self.scheduler.shutdown()
+    
+    async def test_jobs_run_on_event_loop(self):
+        """测试协程任务在当前事件循环中执行"""
+        self.assertIsInstance(self.scheduler.scheduler, AsyncIOScheduler)
+        loop = asyncio.get_running_loop()
+        done = asyncio.Event()
+        seen = {}
+        
+        async def job():
+            seen['loop'] = asyncio.get_running_loop()
+            done.set()
+        
+        self.scheduler.add_job(job, 'date', jobstore='memory')
+        await asyncio.wait_for(done.wait(), 5)
+        self.assertIs(seen['loop'], loop)
+    
+    async def test_max_instances(self):
+        """测试任务并发上限"""
+        release = asyncio.Event()
+        running = []
+        
+        async def slow_job():
+            running.append(1)
+            await release.wait()
+        
+        skipped = TASK_SKIPPED.labels(job_id='slow', reason='max_instances')
+        before = skipped._value.get()
+        self.scheduler.add_job(
+            slow_job, 'interval', seconds=0.05, id='slow',
+            jobstore='memory', max_instances=1, misfire_grace_time=None
+        )
+        await asyncio.sleep(0.3)
+        release.set()
+        
+        self.assertEqual(len(running), 1)
+        self.assertGreater(skipped._value.get(), before)
+    
+    async def test_leader_only_jobs(self):
+        """测试默认任务只在领导者上执行"""
+        leader = MagicMock(is_leader=False)
+        scheduler = TaskScheduler(self.app, async_mode=True, leader=leader)
+        cleanup = AsyncMock(return_value={})
+        job = scheduler._leader_only('weekly_cleanup', cleanup)
+        
+        await job()
+        cleanup.assert_not_awaited()
+        
+        leader.is_leader = True
+        await job()
+        cleanup.assert_awaited_once()
+
+class TestThreadedTaskScheduler(unittest.IsolatedAsyncioTestCase):
+    """测试线程池调度模式"""
+    
+    async def test_coroutine_jobs_run_on_event_loop(self):
+        """测试默认任务在线程中执行时提交回事件循环并等待完成"""
+        scheduler = TaskScheduler(MagicMock(), async_mode=False)
+        scheduler.start()
+        self.addCleanup(scheduler.shutdown)
+        loop = asyncio.get_running_loop()
+        seen = {}
+        
+        async def report():
+            seen['loop'] = asyncio.get_running_loop()
+            return 'done'
+        
+        job = scheduler._leader_only('daily_report', report)
+        self.assertEqual(await asyncio.to_thread(job), 'done')
+        self.assertIs(seen['loop'], loop)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
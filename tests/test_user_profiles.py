@@ -0,0 +1,70 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from fakeredis import FakeAsyncRedis, FakeServer
+
+from src.user_profiles import UserProfileCache, redis_conn
+from src.utils.redis_client import redis_manager
+
+def make_user(user_id, full_name, username=None):
+    user = MagicMock()
+    user.id = user_id
+    user.full_name = full_name
+    user.username = username
+    return user
+
+class TestUserProfileCache(unittest.IsolatedAsyncioTestCase):
+    """测试用户资料缓存"""
+    
+    def setUp(self):
+        redis_manager.use_client(FakeAsyncRedis(server=FakeServer()))
+    
+    def tearDown(self):
+        redis_manager.use_client(None)
+    
+    async def test_remember_and_resolve(self):
+        """测试采集资料后批量解析显示名"""
+        cache = UserProfileCache()
+        await cache.remember_many([make_user(1, "Alice", "alice"), make_user(2, "", "bob"), None])
+        
+        names = await cache.display_names([1, 2, 3])
+        
+        self.assertEqual(names, {1: "Alice", 2: "bob", 3: "用户 3"})
+        self.assertGreater(await redis_conn.ttl(redis_conn.key("user:1")), 0)
+    
+    async def test_loaded_from_redis(self):
+        """测试其他实例写入的资料可从Redis读取"""
+        await UserProfileCache().remember(make_user(1, "Alice"))
+        
+        replica = UserProfileCache()
+        profiles = await replica.get_many([1])
+        
+        self.assertEqual(profiles[1]['name'], "Alice")
+        self.assertIn(1, replica.cache)
+    
+    async def test_unchanged_profile_skips_redis(self):
+        """测试资料未变化时不重复写Redis"""
+        cache = UserProfileCache()
+        user = make_user(1, "Alice")
+        await cache.remember(user)
+        
+        with patch.object(redis_conn, 'pipeline') as pipeline:
+            await cache.remember(user)
+            pipeline.assert_not_called()
+        
+        user.full_name = "Alice Liddell"
+        await cache.remember(user)
+        self.assertEqual(
+            await redis_conn.hget(redis_conn.key("user:1"), "name"), "Alice Liddell".encode()
+        )
+    
+    async def test_lru_eviction(self):
+        """测试本地缓存容量上限"""
+        cache = UserProfileCache(maxsize=2)
+        await cache.remember_many([make_user(i, f"u{i}") for i in range(3)])
+        
+        self.assertEqual(len(cache.cache), 2)
+        self.assertNotIn(0, cache.cache)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import MagicMock
+
+import httpx
+from telegram import Bot
+
+from src.webhook import WebhookServer
+
+def make_update(update_id: int) -> dict:
+    """构造最小的消息更新"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': -100, 'type': 'supergroup'},
+            'from': {'id': 1, 'is_bot': False, 'first_name': 'test'},
+            'text': 'hello'
+        }
+    }
+
+class TestWebhookServer(unittest.IsolatedAsyncioTestCase):
+    """测试Webhook接入服务"""
+
+    async def asyncSetUp(self):
+        self.queue = asyncio.Queue(maxsize=2)
+        self.server = WebhookServer(
+            Bot('123:abc'),
+            self.queue,
+            listen='127.0.0.1',
+            port=0,
+            path='/hook',
+            secret_token='s3cret'
+        )
+        await self.server.start()
+        self.client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{self.server.bound_port}")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        await self.server.stop()
+
+    async def post(self, payload, token='s3cret', path='/hook'):
+        headers = {'X-Telegram-Bot-Api-Secret-Token': token} if token else {}
+        return await self.client.post(path, content=json.dumps(payload), headers=headers)
+
+    async def test_enqueue_update(self):
+        """测试有效更新进入队列(同一连接复用)"""
+        for update_id in (1, 2):
+            response = await self.post(make_update(update_id))
+            self.assertEqual(response.status_code, 200)
+
+        first = self.queue.get_nowait()
+        self.assertEqual(first.update_id, 1)
+        self.assertEqual(first.message.text, 'hello')
+        self.assertEqual(self.queue.get_nowait().update_id, 2)
+
+    async def test_secret_token(self):
+        """测试密钥校验"""
+        response = await self.post(make_update(1), token='wrong')
+        self.assertEqual(response.status_code, 403)
+        response = await self.post(make_update(1), token=None)
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(self.queue.empty())
+
+    async def test_queue_full(self):
+        """测试队列已满时返回503"""
+        for update_id in (1, 2):
+            await self.post(make_update(update_id))
+
+        response = await self.post(make_update(3))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+
+        self.queue.get_nowait()
+        response = await self.post(make_update(3))
+        self.assertEqual(response.status_code, 200)
+
+    async def test_processor_saturated(self):
+        """测试并发处理的在途更新达到上限时返回503"""
+        self.server.update_processor = MagicMock(current_concurrent_updates=5, max_concurrent_updates=5)
+        response = await self.post(make_update(1))
+        self.assertEqual(response.status_code, 503)
+
+        self.server.update_processor.current_concurrent_updates = 4
+        response = await self.post(make_update(1))
+        self.assertEqual(response.status_code, 200)
+
+    async def test_bad_requests(self):
+        """测试路径、方法与请求体错误"""
+        response = await self.post(make_update(1), path='/other')
+        self.assertEqual(response.status_code, 404)
+
+        response = await self.client.get('/hook')
+        self.assertEqual(response.status_code, 405)
+
+        response = await self.client.post(
+            '/hook',
+            content=b'{not json',
+            headers={'X-Telegram-Bot-Api-Secret-Token': 's3cret'}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(self.queue.empty())
+
+if __name__ == '__main__':
+    unittest.main()
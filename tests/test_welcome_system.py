@@ -1,3 +1,4 @@
+import asyncio
 import unittest
 from datetime import datetime
 from unittest.mock import AsyncMock, MagicMock, patch
@@ -5,8 +6,12 @@ from datetime import datetime
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-from src.welcome_system import WelcomeSystem
+from fakeredis import FakeAsyncRedis, FakeServer
+
+from src.welcome_system import WelcomeSystem, WelcomeTemplate, redis_conn
 from src.checkin import Base
+from src.utils.metrics import PENDING_VERIFICATIONS
+from src.utils.redis_client import redis_manager
 
 class TestWelcomeSystem(unittest.IsolatedAsyncioTestCase):
     """测试欢迎系统功能"""
@@ -17,11 +22,8 @@ class TestWelcomeSystem(unittest.IsolatedAsyncioTestCase):
         Base.metadata.create_all(self.engine)
         self.Session = sessionmaker(bind=self.engine)
         
-        # Mock Redis连接
-        self.redis_patch = patch('src.welcome_system.redis_conn')
-        self.mock_redis = self.redis_patch.start()
-        self.mock_redis.get.return_value = None  # 默认返回空欢迎语
-        self.mock_redis.sismember.return_value = False  # 默认不启用验证
+        # 使用fakeredis替代Redis服务(默认无自定义欢迎语、不启用验证)
+        redis_manager.use_client(FakeAsyncRedis(server=FakeServer()))
         
         # 模拟新成员消息
         self.update = MagicMock()
@@ -42,7 +44,7 @@ class TestWelcomeSystem(unittest.IsolatedAsyncioTestCase):
         self.context.bot = AsyncMock()
     
     def tearDown(self):
-        self.redis_patch.stop()
+        redis_manager.use_client(None)
         self.engine.dispose()
     
     async def test_handle_new_member(self):
@@ -59,8 +61,8 @@ class TestWelcomeSystem(unittest.IsolatedAsyncioTestCase):
     async def test_custom_welcome(self):
         """测试自定义欢迎语"""
         custom_msg = "欢迎{username}"
-        self.mock_redis.get.return_value = custom_msg.encode('utf-8')
         system = WelcomeSystem(self.Session())
+        await system.set_welcome_message(123, custom_msg)
         
         await system.handle_new_member(self.update, self.context)
         
@@ -69,5 +71,192 @@ class TestWelcomeSystem(unittest.IsolatedAsyncioTestCase):
         _, kwargs = self.context.bot.send_message.call_args
         self.assertEqual(kwargs['text'], custom_msg.format(username="test_user"))
 
+    async def test_verify_member(self):
+        """测试新人验证"""
+        await redis_conn.sadd(redis_conn.key("verified_chats"), 123)
+        system = WelcomeSystem(self.Session())
+        await system.handle_new_member(self.update, self.context)
+        
+        # 启用验证时附带验证按钮
+        _, kwargs = self.context.bot.send_message.call_args
+        self.assertIsNotNone(kwargs['reply_markup'])
+        
+        query = MagicMock()
+        query.answer = AsyncMock()
+        query.edit_message_text = AsyncMock()
+        query.data = "verify_123"
+        query.from_user.id = 456
+        update = MagicMock()
+        update.callback_query = query
+        
+        await system.verify_member(update, self.context)
+        query.edit_message_text.assert_awaited_once()
+        self.assertIsNone(
+            await redis_conn.zscore(redis_conn.key("pending_verify:123"), "456")
+        )
+
+    async def test_merged_joiners_verify_in_turn(self):
+        """测试合并欢迎的多名新人依次验证，最后一人验证后才移除按钮"""
+        await redis_conn.sadd(redis_conn.key("verified_chats"), 123)
+        second = MagicMock()
+        second.id = 457
+        second.username = "second_user"
+        self.update.message.new_chat_members = [self.new_member, second]
+        self.context.bot.send_message.return_value = MagicMock(message_id=77)
+        system = WelcomeSystem(self.Session())
+        await system.handle_new_member(self.update, self.context)
+        self.context.bot.send_message.assert_awaited_once()
+        
+        query = MagicMock()
+        query.answer = AsyncMock()
+        query.edit_message_text = AsyncMock()
+        query.data = "verify_123"
+        query.message.message_id = 77
+        update = MagicMock()
+        update.callback_query = query
+        
+        query.from_user.id = 456
+        await system.verify_member(update, self.context)
+        query.answer.assert_awaited_with("✅ 验证成功，欢迎加入群聊！", show_alert=False)
+        query.edit_message_text.assert_not_awaited()
+        
+        query.from_user.id = 457
+        await system.verify_member(update, self.context)
+        query.edit_message_text.assert_awaited_once()
+        self.assertEqual(await redis_conn.zcard(redis_conn.key("pending_verify:123")), 0)
+
+    async def test_mass_join_single_message(self):
+        """测试多人同时入群合并为一条欢迎消息"""
+        members = []
+        for user_id in range(1000, 1005):
+            member = MagicMock()
+            member.id = user_id
+            member.username = f"user{user_id}"
+            members.append(member)
+        self.update.message.new_chat_members = members
+        
+        system = WelcomeSystem(self.Session())
+        await system.handle_new_member(self.update, self.context)
+        
+        self.context.bot.send_message.assert_awaited_once()
+        _, kwargs = self.context.bot.send_message.call_args
+        for member in members:
+            self.assertIn(member.username, kwargs['text'])
+        self.assertEqual(
+            await redis_conn.zcard(redis_conn.key("pending_verify:123")), 5
+        )
+
+    async def test_debounced_welcome(self):
+        """测试防抖窗口内的入群合并欢迎"""
+        system = WelcomeSystem(self.Session(), debounce_seconds=0.05)
+        await system.handle_new_member(self.update, self.context)
+        
+        other = MagicMock()
+        other.id = 789
+        other.username = "other_user"
+        self.update.message.new_chat_members = [other]
+        await system.handle_new_member(self.update, self.context)
+        
+        self.context.bot.send_message.assert_not_awaited()
+        await asyncio.sleep(0.1)
+        
+        self.context.bot.send_message.assert_awaited_once()
+        _, kwargs = self.context.bot.send_message.call_args
+        self.assertIn("test_user", kwargs['text'])
+        self.assertIn("other_user", kwargs['text'])
+
+    async def test_config_cached(self):
+        """测试群配置缓存与本地失效"""
+        system = WelcomeSystem(self.Session())
+        await system.handle_new_member(self.update, self.context)
+        
+        # 绕过set_welcome_message直接修改Redis，缓存期内仍使用旧配置
+        await redis_conn.set(redis_conn.key("welcome:123"), "hi {username}")
+        await system.handle_new_member(self.update, self.context)
+        _, kwargs = self.context.bot.send_message.call_args
+        self.assertIn("请阅读群规", kwargs['text'])
+        
+        await system.set_welcome_message(123, "hello {username}")
+        await system.handle_new_member(self.update, self.context)
+        _, kwargs = self.context.bot.send_message.call_args
+        self.assertEqual(kwargs['text'], "hello test_user")
+
+    async def test_config_invalidated_across_instances(self):
+        """测试通过发布订阅失效其他实例的缓存"""
+        replica = WelcomeSystem(self.Session())
+        await replica.start()
+        await asyncio.sleep(0.05)
+        await replica._get_chat_config(123)
+        self.assertIn(123, replica.config_cache)
+        
+        await WelcomeSystem(self.Session()).set_verification(123, True)
+        for _ in range(20):
+            if 123 not in replica.config_cache:
+                break
+            await asyncio.sleep(0.05)
+        await replica.stop()
+        
+        self.assertNotIn(123, replica.config_cache)
+        _, verified = await replica._get_chat_config(123)
+        self.assertTrue(verified)
+
+    def test_template_render(self):
+        """测试预解析模板与str.format结果一致"""
+        for text in ["欢迎{username}({user_id!r})", "{{转义}} {username:>6}", "{0}"]:
+            template = WelcomeTemplate(text)
+            if text == "{0}":
+                with self.assertRaises(IndexError):
+                    template.render(username="a", user_id=1)
+                continue
+            self.assertEqual(
+                template.render(username="bob", user_id=7),
+                text.format(username="bob", user_id=7)
+            )
+
+    async def test_sweep_pending_verifications(self):
+        """测试验证超时清理"""
+        system = WelcomeSystem(self.Session())
+        await system.set_verification(123, True)
+        now = datetime.now().timestamp()
+        await redis_conn.zadd(redis_conn.key("pending_verify:123"), {
+            "1": now - 3600, "2": now - 3600, "3": now
+        })
+        await redis_conn.zadd(redis_conn.key("pending_verify:999"), {"4": now - 3600})
+        await redis_conn.sadd(redis_conn.key("pending_chats"), 123, 999)
+        
+        bot = AsyncMock()
+        result = await system.sweep_pending(bot)
+        
+        self.assertEqual(result, {'expired': 3, 'moderated': 2, 'pending': 1})
+        # 默认踢出: 封禁后解封，未启用验证的群不处理
+        self.assertEqual(
+            sorted(c.kwargs['user_id'] for c in bot.ban_chat_member.await_args_list),
+            [1, 2]
+        )
+        self.assertEqual(bot.unban_chat_member.await_count, 2)
+        self.assertEqual(
+            await redis_conn.zrange(redis_conn.key("pending_verify:123"), 0, -1), [b"3"]
+        )
+        self.assertEqual(
+            await redis_conn.smembers(redis_conn.key("pending_chats")), {b"123"}
+        )
+        self.assertEqual(PENDING_VERIFICATIONS._value.get(), 1)
+
+    async def test_sweep_only_on_leader(self):
+        """测试验证超时清理只在领导者实例上执行"""
+        system = WelcomeSystem(self.Session())
+        system.sweep_interval = 0.01
+        leader = MagicMock(is_leader=False)
+        bot = AsyncMock()
+        with patch.object(system, 'sweep_pending', AsyncMock()) as sweep:
+            await system.start(bot, leader=leader)
+            await asyncio.sleep(0.05)
+            sweep.assert_not_awaited()
+            
+            leader.is_leader = True
+            await asyncio.sleep(0.05)
+            await system.stop()
+        sweep.assert_awaited_with(bot)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
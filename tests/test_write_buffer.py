@@ -0,0 +1,90 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock
+
+from src.utils.write_buffer import WriteBehindBuffer
+
+class TestWriteBehindBuffer(unittest.IsolatedAsyncioTestCase):
+    """测试写后缓冲区"""
+    
+    async def test_size_bounded_batches(self):
+        """测试按数量切分批次"""
+        batches = []
+        
+        async def flush(batch):
+            batches.append(list(batch))
+        
+        buffer = WriteBehindBuffer('test_size', flush, max_batch_size=2, flush_interval=60)
+        buffer.start()
+        for i in range(5):
+            await buffer.put(i)
+        await buffer.stop()
+        
+        self.assertEqual(batches, [[0, 1], [2, 3], [4]])
+    
+    async def test_time_bounded_flush(self):
+        """测试时间窗口到期写出"""
+        flush = AsyncMock()
+        buffer = WriteBehindBuffer('test_time', flush, max_batch_size=100, flush_interval=0.01)
+        buffer.start()
+        await buffer.put('a')
+        # 等待时间窗口到期(不依赖固定睡眠时长，避免GC停顿导致偶发失败)
+        for _ in range(100):
+            if flush.await_count:
+                break
+            await asyncio.sleep(0.01)
+        
+        flush.assert_awaited_once_with(['a'])
+        await buffer.stop()
+    
+    async def test_backpressure(self):
+        """测试队列满时put等待"""
+        release = asyncio.Event()
+        
+        async def slow_flush(batch):
+            await release.wait()
+        
+        buffer = WriteBehindBuffer(
+            'test_backpressure', slow_flush,
+            max_batch_size=1, flush_interval=60, max_queue_size=1
+        )
+        buffer.start()
+        await buffer.put(1)  # 被后台任务取走并阻塞在写出
+        await asyncio.sleep(0)
+        await buffer.put(2)  # 占满队列
+        
+        blocked = asyncio.create_task(buffer.put(3))
+        await asyncio.sleep(0.01)
+        self.assertFalse(blocked.done())
+        
+        release.set()
+        await blocked
+        await buffer.stop()
+    
+    async def test_flush_failure_retries_batch(self):
+        """测试写出失败时重试同一批次，不丢数据也不影响后续批次"""
+        flush = AsyncMock(side_effect=[Exception("Redis error"), None, None])
+        buffer = WriteBehindBuffer(
+            'test_failure', flush, max_batch_size=1, flush_interval=60, retry_delay=0.01
+        )
+        buffer.start()
+        await buffer.put('a')
+        await buffer.put('b')
+        await buffer.stop()
+        
+        self.assertEqual([c.args[0] for c in flush.await_args_list], [['a'], ['a'], ['b']])
+    
+    async def test_stop_gives_up_after_retries(self):
+        """测试关闭时持续失败的批次在有限次重试后放弃"""
+        flush = AsyncMock(side_effect=Exception("Redis down"))
+        buffer = WriteBehindBuffer(
+            'test_give_up', flush, max_batch_size=10, flush_interval=60,
+            retry_delay=0.01, stop_retries=2
+        )
+        await buffer.put('a')
+        await buffer.stop()
+        
+        self.assertEqual(flush.await_count, 3)
+
+if __name__ == '__main__':
+    unittest.main()